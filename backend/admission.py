@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import JSONResponse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRateLimiter:
+    """Per-worker token buckets.
+
+    Each bucket is kept GCRA-style as a single "theoretical arrival time": the
+    moment the bucket would be full again. That is the same admission decision as
+    refilling a token counter, with one float of state per key.
+    """
+
+    def __init__(self, max_keys: int = 100000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._arrivals: "OrderedDict[str, float]" = OrderedDict()
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        """Take a token; returns 0 when admitted, otherwise seconds until one is available"""
+        now = self.clock()
+        interval = 1 / rate
+        arrival = max(self._arrivals.get(key, now), now)
+        wait = arrival - now - (burst - 1) * interval
+        if wait > 0:
+            return wait
+        self._arrivals[key] = arrival + interval
+        self._arrivals.move_to_end(key)
+        while len(self._arrivals) > self.max_keys:
+            # Least recently seen first; an evicted bucket simply starts full again
+            self._arrivals.popitem(last=False)
+        return 0.0
+
+
+class MongoRateLimiter:
+    """Token buckets shared by all workers through one MongoDB collection.
+
+    Same GCRA state as LocalRateLimiter, on the wall clock, updated with
+    conditional writes so concurrent workers never admit more than the bucket
+    holds. Records expire through a TTL index once the bucket is full again.
+    """
+
+    def __init__(self, collection, clock: Callable[[], float] = time.time):
+        self.collection = collection
+        # Wall clock: every worker must agree on it
+        self.clock = clock
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        now = self.clock()
+        interval = 1 / rate
+        tolerance = (burst - 1) * interval
+        expires_at = datetime.utcfromtimestamp(now + burst * interval)
+        try:
+            # New or idle key: the bucket is full
+            await self.collection.update_one(
+                {"_id": key, "arrival": {"$lte": now}},
+                {"$set": {"arrival": now + interval, "expires_at": expires_at}},
+                upsert=True,
+            )
+            return 0.0
+        except DuplicateKeyError:
+            # The record exists and is ahead of now
+            pass
+        admitted = await self.collection.find_one_and_update(
+            {"_id": key, "arrival": {"$gt": now, "$lte": now + tolerance}},
+            {"$inc": {"arrival": interval}, "$set": {"expires_at": expires_at}},
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if admitted:
+            return 0.0
+        bucket = await self.collection.find_one({"_id": key})
+        if bucket is None:
+            # Expired in between
+            return 0.0
+        return max(bucket["arrival"] - now - tolerance, 0.001)
+
+
+class RouteClass:
+    """A group of expensive routes sharing per-client rate limits, a per-worker concurrency cap and a body size cap.
+
+    With `body_key` the body (at most max_body_size bytes) is read up front and the
+    account it names is added to the client address in the bucket key.
+    """
+
+    def __init__(self, name: str, routes: Iterable[Tuple[str, str]], rate: float, burst: int, max_concurrency: int, key_by_user: bool = False, max_body_size: int = 0,
+                 body_key: Optional[Callable[[bytes], Optional[str]]] = None):
+        self.name = name
+        self.routes = list(routes)
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.key_by_user = key_by_user
+        self.max_body_size = max_body_size
+        self.body_key = body_key
+        self.in_flight = 0
+
+
+class AdmissionController:
+    """Decides, before a request body is read, whether an expensive request runs or is shed.
+
+    A declared Content-Length over the route's body cap gets 413 before anything
+    is spooled. Over the concurrency cap the worker answers 503 at once instead of
+    queueing; a client over its rate gets 429. Both carry Retry-After. Buckets are keyed by
+    user for authenticated route classes, by client IP and the account named in the
+    body for body-keyed ones and by client IP otherwise. Behind `trusted_proxies`
+    proxies the client IP is read from X-Forwarded-For, counting from the right, as
+    entries further left are whatever the client sent. A failing limiter backend
+    admits requests rather than taking the routes down.
+    """
+
+    def __init__(self, route_classes: Iterable[RouteClass], limiter=None, identify_user: Optional[Callable[[dict], Optional[str]]] = None, trusted_proxies: int = 0):
+        self.route_classes = list(route_classes)
+        self.limiter = limiter
+        self.identify_user = identify_user
+        self.trusted_proxies = trusted_proxies
+        self._routes: Dict[Tuple[str, str], RouteClass] = {
+            route: route_class for route_class in self.route_classes for route in route_class.routes
+        }
+
+    def route_class(self, scope: dict) -> Optional[RouteClass]:
+        return self._routes.get((scope["method"], scope["path"]))
+
+    def client_ip(self, scope: dict) -> str:
+        if self.trusted_proxies:
+            forwarded = [
+                address.strip()
+                for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+                for address in value.decode("latin-1").split(",")
+            ]
+            if forwarded:
+                return forwarded[max(len(forwarded) - self.trusted_proxies, 0)]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def bucket_key(self, route_class: RouteClass, scope: dict, body: Optional[bytes] = None) -> str:
+        if route_class.key_by_user and self.identify_user is not None:
+            user = self.identify_user(scope)
+            if user:
+                return f"{route_class.name}:user:{user}"
+        key = f"{route_class.name}:ip:{self.client_ip(scope)}"
+        if route_class.body_key is not None and body is not None:
+            account = route_class.body_key(body)
+            if account:
+                # Hashed so bucket records never hold the account name
+                return f"{key}:account:{hashlib.sha256(account.encode()).hexdigest()[:32]}"
+        return key
+
+    @staticmethod
+    def content_length(scope: dict) -> Optional[int]:
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    return int(value)
+                except ValueError:
+                    # Left to the server to reject
+                    return None
+        return None
+
+    def over_size(self, route_class: RouteClass, scope: dict) -> bool:
+        if not route_class.max_body_size:
+            return False
+        length = self.content_length(scope)
+        return length is not None and length > route_class.max_body_size
+
+    async def admit(self, route_class: RouteClass, scope: dict, body: Optional[bytes] = None, too_large: bool = False) -> Optional[JSONResponse]:
+        """Reserve a slot for the request, or return the response shedding it.
+
+        `body` is the buffered body of a body-keyed route class; `too_large` says it
+        went over max_body_size while being read.
+        """
+        if too_large or self.over_size(route_class, scope):
+            metrics.ADMISSION_REJECTED.inc(1, route_class.name, "size")
+            return JSONResponse({"detail": "Request body too large"}, status_code=413)
+        if route_class.max_concurrency and route_class.in_flight >= route_class.max_concurrency:
+            metrics.ADMISSION_REJECTED.inc(1, route_class.name, "concurrency")
+            return JSONResponse(
+                {"detail": "Server is busy, try again later"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+        route_class.in_flight += 1
+        if self.limiter is None or route_class.rate <= 0:
+            return None
+        try:
+            wait = await self.limiter.acquire(self.bucket_key(route_class, scope, body), route_class.rate, route_class.burst)
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable, admitting request: {e}")
+            wait = 0.0
+        if wait > 0:
+            route_class.in_flight -= 1
+            metrics.ADMISSION_REJECTED.inc(1, route_class.name, "rate")
+            return JSONResponse(
+                {"detail": "Too many requests, try again later"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+        return None
+
+    def release(self, route_class: RouteClass):
+        route_class.in_flight -= 1
+
+    def render(self) -> List[str]:
+        return [f'impnet_admission_in_flight{{route_class="{route_class.name}"}} {route_class.in_flight}' for route_class in self.route_classes]
+
+
+async def read_body(receive, limit: int) -> Tuple[bytes, bool]:
+    """Buffer a request body; returns (body, True) as soon as it grows past `limit` (0 means no limit)"""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # Disconnected; the app sees the rest of the stream as usual
+            return b"".join(chunks), False
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit and size > limit:
+            return b"", True
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks), False
+
+
+def replay(body: bytes, receive):
+    """A receive channel that hands the app an already buffered body first"""
+    replayed = False
+
+    async def receive_buffered():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return receive_buffered
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController ahead of routing and body parsing.
+
+    Only body-keyed route classes have their (capped) body read here, and the app
+    gets it replayed. The slot is given back once the last body message is sent,
+    so background tasks running after the response don't hold it.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.controller.route_class(scope) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        body, too_large = None, False
+        if route_class.body_key is not None and not self.controller.over_size(route_class, scope):
+            body, too_large = await read_body(receive, route_class.max_body_size)
+            receive = replay(body, receive)
+        rejection = await self.controller.admit(route_class, scope, body, too_large)
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.release(route_class)
+
+        async def send_and_release(message):
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                release()
+
+        try:
+            await self.app(scope, receive, send_and_release)
+        finally:
+            release()
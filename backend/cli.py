@@ -0,0 +1,84 @@
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+import server
+
+app = typer.Typer(help="impNet administration commands")
+
+
+@app.callback()
+def main():
+    """impNet administration commands"""
+
+
+async def _import_users(path: Path, fmt: str, create_passports: bool, batch_size: int):
+    server.connect_db()
+    server.init_executors()
+    await server.ensure_indexes()
+    await server.role_registry.refresh()
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            return await server.import_users(server.iter_import_rows(stream, fmt), create_passports, batch_size)
+    finally:
+        server.client.close()
+        server.shutdown_executors(wait=True)
+
+
+@app.command("import-users")
+def import_users(
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="CSV or NDJSON file"),
+    fmt: Optional[str] = typer.Option(None, "--format", help="csv or ndjson (default: from file extension)"),
+    create_passports: bool = typer.Option(False, "--passports", help="Also create passports from passport columns"),
+    batch_size: int = typer.Option(server.IMPORT_BATCH_SIZE, help="Rows validated, hashed and inserted per batch"),
+):
+    """Bulk onboard citizens from a file"""
+    fmt = fmt or ("ndjson" if path.suffix.lower() in (".ndjson", ".jsonl") else "csv")
+    report = asyncio.run(_import_users(path, fmt, create_passports, batch_size))
+    for error in report.errors:
+        typer.echo(f"row {error.row}: {error.error}", err=True)
+    typer.echo(
+        f"processed={report.processed} inserted={report.inserted} "
+        f"passports={report.passports_created} errors={len(report.errors)}"
+    )
+
+
+async def _backfill_usage(batch_size: int):
+    server.connect_db()
+    await server.ensure_indexes()
+    try:
+        return await server.backfill_usage(batch_size)
+    finally:
+        server.client.close()
+
+
+@app.command("backfill-usage")
+def backfill_usage(
+    batch_size: int = typer.Option(server.USAGE_BACKFILL_BATCH_SIZE, help="Users recounted per batch"),
+):
+    """Rebuild per-user storage counters from the documents collection"""
+    report = asyncio.run(_backfill_usage(batch_size))
+    typer.echo(f"users={report['users']} bytes={report['bytes']} objects={report['objects']}")
+
+
+async def _backfill_search(batch_size: int):
+    server.connect_db()
+    await server.ensure_indexes()
+    try:
+        return await server.backfill_search_keys(batch_size)
+    finally:
+        server.client.close()
+
+
+@app.command("backfill-search")
+def backfill_search(
+    batch_size: int = typer.Option(server.IMPORT_BATCH_SIZE, help="Users updated per batch"),
+):
+    """Add citizen search keys to users created before search or name tokens existed"""
+    typer.echo(f"updated={asyncio.run(_backfill_search(batch_size))}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,340 @@
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in self._values.items():
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                total = series[len(self.buckets)]
+                inf_labels = _format_labels(self.labels, label_values, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf_labels} {total}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {series[-1]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {total}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """Register a callback producing extra exposition lines (e.g. gauges) at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "impnet_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+REQUEST_DB_COMMANDS = registry.histogram(
+    "impnet_http_request_db_commands", "MongoDB commands issued per request", ("method", "route"), COUNT_BUCKETS
+)
+DB_COMMAND_DURATION = registry.histogram(
+    "impnet_mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome")
+)
+BCRYPT_DURATION = registry.histogram(
+    "impnet_bcrypt_duration_seconds", "Password hashing job latency including queueing", ("operation",)
+)
+UPLOAD_BYTES = registry.counter("impnet_upload_bytes_total", "Bytes received in document uploads")
+POOL_CHECKOUT_WAIT = registry.histogram(
+    "impnet_mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled MongoDB connection", ("outcome",)
+)
+ADMISSION_REJECTED = registry.counter(
+    "impnet_admission_rejected_total", "Requests shed by body size, rate limits or concurrency caps", ("route_class", "reason")
+)
+GC_RECLAIMED_BYTES = registry.counter(
+    "impnet_gc_reclaimed_bytes_total", "Stored bytes freed by deletions and reconciliation", ("source",)
+)
+GC_RECLAIMED_OBJECTS = registry.counter(
+    "impnet_gc_reclaimed_total", "Orphaned files and records reclaimed", ("kind",)
+)
+
+
+class RequestStats:
+    """Per-request accounting, shared with Motor's executor threads through the context"""
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+        self.upload_bytes = 0
+        self._lock = threading.Lock()
+
+    def add_db(self, seconds: float):
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+    def server_timing(self, total_seconds: float) -> str:
+        parts = [f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_commands} commands"']
+        if self.bcrypt_seconds:
+            parts.append(f"bcrypt;dur={self.bcrypt_seconds * 1000:.1f}")
+        if self.upload_bytes:
+            parts.append(f'upload;desc="{self.upload_bytes} bytes"')
+        parts.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return request_stats.get()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every MongoDB command; Motor runs pymongo with the caller's context copied"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1_000_000
+        DB_COMMAND_DURATION.observe(seconds, event.command_name, outcome)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.add_db(seconds)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """Tracks per-server pool occupancy and how long callers wait to check out a connection"""
+
+    def __init__(self, recent: int = 1000):
+        self._lock = threading.Lock()
+        # Checkout runs synchronously on the calling thread, so start times are thread-local
+        self._local = threading.local()
+        self._pools: Dict[str, Dict[str, int]] = {}
+        self._recent_waits = deque(maxlen=recent)
+        self.checkout_failures = 0
+
+    def _pool(self, address) -> Dict[str, int]:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {"open": 0, "in_use": 0, "waiting": 0}
+        return pool
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["open"] = max(0, pool["open"] - 1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self._pool(event.address)["waiting"] += 1
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited()
+        POOL_CHECKOUT_WAIT.observe(waited, "failure")
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] = max(0, pool["waiting"] - 1)
+            self.checkout_failures += 1
+            self._recent_waits.append(waited)
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        POOL_CHECKOUT_WAIT.observe(waited, "success")
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] = max(0, pool["waiting"] - 1)
+            pool["in_use"] += 1
+            self._recent_waits.append(waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["in_use"] = max(0, pool["in_use"] - 1)
+
+    def _waited(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def snapshot(self, max_pool_size: int) -> dict:
+        """Pool state for readiness: saturation is the busiest server's in-use share of the pool"""
+        with self._lock:
+            pools = {address: dict(pool) for address, pool in self._pools.items()}
+            waits = sorted(self._recent_waits)
+            failures = self.checkout_failures
+        saturation = max((pool["in_use"] / max_pool_size for pool in pools.values()), default=0.0)
+        return {
+            "max_pool_size": max_pool_size,
+            "saturation": round(saturation, 3),
+            "waiting": sum(pool["waiting"] for pool in pools.values()),
+            "checkout_failures": failures,
+            "checkout_wait_ms": {
+                "p50": round(waits[len(waits) // 2] * 1000, 3) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95)] * 1000, 3) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 3) if waits else 0.0,
+            },
+            "servers": pools,
+        }
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for address, pool in self._pools.items():
+                for key, value in pool.items():
+                    lines.append(f'impnet_mongo_pool_{key}{{server="{address}"}} {value}')
+        return lines
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and adding a Server-Timing header.
+
+    A request is measured up to its last body message, so background tasks that
+    run after the response is sent don't count towards it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # Route template, not the raw path, keeps label cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], route_path, str(status_code))
+            REQUEST_DB_COMMANDS.observe(stats.db_commands, scope["method"], route_path)
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timing = stats.server_timing(time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_stats.reset(token)
+            # No complete response was sent (an error or a dropped client)
+            record()
@@ -1,25 +1,40 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse, PlainTextResponse, ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ASCENDING, DESCENDING, ReturnDocument, read_preferences
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from bson import ObjectId
 import os
+import asyncio
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+import time
+from pathlib import Path, PurePosixPath
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter
+from typing import List, Optional, Dict, Any, Awaitable, Callable, FrozenSet, Iterable, Iterator, TextIO
+from collections import OrderedDict
 import uuid
-from datetime import datetime, timedelta, date
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from datetime import datetime, timedelta, timezone, date
 import json
-from PIL import Image
-import io
+import shutil
 import base64
 import aiofiles
+import hashlib
+import hmac
 import secrets
-import string
+import csv
+import itertools
+import functools
+import multiprocessing
+import unicodedata
+import re
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import admission
+import metrics
+from storage import create_storage, remove_file
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,24 +43,230 @@ load_dotenv(ROOT_DIR / '.env')
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# MongoDB connection
+# Uploaded bytes live in a content-addressed blob store keyed by SHA-256
+BLOB_DIR = UPLOAD_DIR / "blobs"
+UPLOAD_TMP_DIR = UPLOAD_DIR / "tmp"
+BLOB_DIR.mkdir(exist_ok=True)
+UPLOAD_TMP_DIR.mkdir(exist_ok=True)
+# In-flight .part files and derivatives being rendered; storage reconciliation never touches these
+UPLOAD_TMP_PREFIX = f"{UPLOAD_TMP_DIR.relative_to(ROOT_DIR).as_posix()}/"
+
+# Stored files go to local disk under ROOT_DIR or to an S3-compatible bucket (see init_storage);
+# uploads are always spooled and checksummed in UPLOAD_TMP_DIR first
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')  # "local" or "s3"
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_PREFIX = os.environ.get('S3_PREFIX', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # e.g. a MinIO instance
+S3_REGION = os.environ.get('S3_REGION')
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024))
+S3_MULTIPART_CHUNK_SIZE = int(os.environ.get('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024))
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', 8))
+# Downloads redirect to short-lived presigned URLs so bytes bypass the API; off streams through it
+S3_PRESIGNED_DOWNLOADS = os.environ.get('S3_PRESIGNED_DOWNLOADS', 'true').lower() in ('1', 'true', 'yes')
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 300))
+file_storage = None
+
+# MongoDB connection, created in startup_event (see connect_db). PIL, passlib, jose
+# and motor are imported where first used so importing this module stays cheap.
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_CONNECTING = int(os.environ.get('MONGO_MAX_CONNECTING', 2))
+# A burst beyond the pool waits this long for a connection instead of queueing forever
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+# Comma-separated, in preference order, e.g. "zstd,snappy,zlib"; the server picks one it supports
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+MONGO_ZLIB_COMPRESSION_LEVEL = int(os.environ.get('MONGO_ZLIB_COMPRESSION_LEVEL', -1))
+# Listings and exports may read from secondaries ("secondaryPreferred"); everything else reads the primary
+LISTING_READ_PREFERENCE = os.environ.get('LISTING_READ_PREFERENCE', 'primary')
+LISTING_MAX_STALENESS_SECONDS = int(os.environ.get('LISTING_MAX_STALENESS_SECONDS', -1))
+READINESS_PING_TIMEOUT = float(os.environ.get('READINESS_PING_TIMEOUT', 2))
+
+mongo_pool = metrics.MongoPoolListener()
+client = None
+db = None
+listing_db = None
+
+# Indexes backing every query the API makes; unique ones enforce what the code assumes
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Citizen search: prefix ranges on normalized keys, paged by (key, _id); names by _id
+        # over a multikey array holding the name from each of its words on
+        IndexModel([("search.name_tokens", ASCENDING), ("_id", ASCENDING)], name="search_name_tokens"),
+        IndexModel([("search.email", ASCENDING), ("_id", ASCENDING)], name="search_email_cursor"),
+        IndexModel([("search.username", ASCENDING), ("_id", ASCENDING)], name="search_username_cursor"),
+    ],
+    "roles": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "documents": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_cursor"),
+        IndexModel([("blob_id", ASCENDING)], name="blob_id"),
+        IndexModel([("file_path", ASCENDING)], name="file_path"),
+    ],
+    "passports": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("series", ASCENDING), ("number", ASCENDING)], name="series_number_unique", unique=True),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "sessions": [
+        IndexModel([("token_hash", ASCENDING)], name="token_hash_unique", unique=True),
+        IndexModel([("previous_token_hash", ASCENDING)], name="previous_token_hash"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # MongoDB removes sessions once they expire
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "usage": [
+        # Top consumers are read straight off these
+        IndexModel([("bytes", DESCENDING)], name="bytes_desc"),
+        IndexModel([("objects", DESCENDING)], name="objects_desc"),
+    ],
+    "rate_limits": [
+        # Buckets are dropped once they would be full again
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "tombstones": [
+        IndexModel([("lease_until", ASCENDING)], name="lease_until"),
+        IndexModel([("blob_id", ASCENDING)], name="blob_id"),
+    ],
+    "import_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+# Passport numbers are leased in blocks per worker from a counter document
+PASSPORT_NUMBER_BLOCK_SIZE = int(os.environ.get('PASSPORT_NUMBER_BLOCK_SIZE', 100))
+# Allocated numbers never repeat, but may land on a random one issued before the allocator
+PASSPORT_NUMBER_ATTEMPTS = 3
+
+# Per-user storage usage is kept as counters; roles without a quota of their own use these (0 means unlimited)
+DEFAULT_STORAGE_QUOTA_BYTES = int(os.environ.get('DEFAULT_STORAGE_QUOTA_BYTES', 0))
+DEFAULT_DOCUMENT_QUOTA = int(os.environ.get('DEFAULT_DOCUMENT_QUOTA', 0))
+USAGE_BACKFILL_BATCH_SIZE = int(os.environ.get('USAGE_BACKFILL_BATCH_SIZE', 1000))
+
+# Uploads are streamed to disk in fixed-size chunks; the limit applies to bytes received
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Room for multipart boundaries and form fields when capping the declared request size
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024
+
+# Image derivatives are rendered in a process pool after upload
+IMAGE_POOL_SIZE = int(os.environ.get('IMAGE_POOL_SIZE', 2))
+THUMBNAIL_SIZE = (320, 320)
+PASSPORT_PHOTO_SIZE = (350, 450)  # 35x45 mm aspect ratio
+image_executor = None
+
+# Staff roles allowed to search citizens; queries shorter than the minimum would match most users
+SEARCH_PERMISSIONS = frozenset({"admin", "mfc_operations", "bank_operations"})
+SEARCH_MIN_PREFIX = 2
+SEARCH_FIELDS = ("name", "email", "username")
+
+# Listing endpoints page by _id (keyset) so memory per request stays bounded
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 # Security setup
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Refresh tokens rotate on every use and live in the sessions collection, stored as HMACs
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+# Concurrent refreshes from one client (several tabs) present the just-rotated token;
+# within this window that is rejected, after it the reuse is treated as theft
+REFRESH_REUSE_GRACE_SECONDS = int(os.environ.get('REFRESH_REUSE_GRACE_SECONDS', 30))
+
+# Password hashing. Changing BCRYPT_ROUNDS makes existing hashes "need update",
+# so they are transparently rehashed with the new cost on the next login.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+# bcrypt runs in a dedicated pool so logins never block the event loop
+HASH_EXECUTOR = os.environ.get('HASH_EXECUTOR', 'thread')  # "thread" or "process"
+HASH_POOL_SIZE = int(os.environ.get('HASH_POOL_SIZE', os.cpu_count() or 2))
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 64))
+hash_executor = None
+hash_jobs_pending = 0
+# Bulk imports hash in their own process pool so they never compete with logins for queue slots
+bulk_hash_executor = None
+# Pools are created in startup_event (see init_executors). Workers come from a forkserver
+# (or "spawn"), so they never inherit the event loop, Motor sockets or held locks.
+PROCESS_START_METHOD = os.environ.get('PROCESS_START_METHOD', 'forkserver')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+# Imports over HTTP run as background jobs; a job record keeps at most this many row errors
+IMPORT_JOB_MAX_ERRORS = int(os.environ.get('IMPORT_JOB_MAX_ERRORS', 1000))
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 5000))
+
+# Authenticated principals are cached per worker; TTL bounds staleness across workers
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+
+# Roles are held in memory; other workers' writes are picked up by polling or a change stream
+ROLE_REFRESH_MODE = os.environ.get('ROLE_REFRESH_MODE', 'poll')  # "poll", "change_stream" or "off"
+ROLE_REFRESH_INTERVAL = float(os.environ.get('ROLE_REFRESH_INTERVAL', 30))
+
+# Ownership checks for file downloads are cached so repeat views skip the database
+FILE_ACCESS_CACHE_SIZE = int(os.environ.get('FILE_ACCESS_CACHE_SIZE', 50000))
+FILE_ACCESS_CACHE_TTL = float(os.environ.get('FILE_ACCESS_CACHE_TTL', 300))
+# <img>/<a> links carry an HMAC scoped to one file and owner instead of the bearer token.
+# Expiry is rounded up to this window so a link stays the same (and cacheable) for a while;
+# each link is valid for between one and two windows.
+FILE_URL_WINDOW_SECONDS = int(os.environ.get('FILE_URL_WINDOW_SECONDS', 3600))
+
+# last_login updates and status checks are written behind the response, in batches
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 1.0))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+
+# Deleted documents leave a tombstone; a background reaper releases their files off the request path
+GC_REAPER_INTERVAL = float(os.environ.get('GC_REAPER_INTERVAL', 5))
+# A claimed tombstone or reconciliation run is retried by another worker once its lease lapses
+GC_LEASE_SECONDS = int(os.environ.get('GC_LEASE_SECONDS', 300))
+# Reconciliation walks records and stored files in batches and reclaims orphans; 0 disables the schedule
+GC_RECONCILE_INTERVAL = float(os.environ.get('GC_RECONCILE_INTERVAL', 6 * 3600))
+GC_BATCH_SIZE = int(os.environ.get('GC_BATCH_SIZE', 500))
+# Database batches, listing pages and file deletions per second the reaper and reconciliation may spend
+GC_IO_BUDGET = float(os.environ.get('GC_IO_BUDGET', 50))
+# Files and blob references younger than this may belong to an upload still in flight
+GC_MIN_AGE_SECONDS = int(os.environ.get('GC_MIN_AGE_SECONDS', 3600))
+
+# Admission control for the expensive routes (bcrypt, upload streaming), applied before the body is read.
+# Token buckets per client: per user for uploads, per IP and account for login/register. "memory" keeps
+# buckets per worker, "mongo" shares them through the rate_limits collection, "off" disables rate limiting.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Proxies in front of the API that append to X-Forwarded-For (the ingress is one); the client address
+# is taken that many entries from the right. 0 uses the socket peer, which behind a proxy is the proxy.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+AUTH_RATE_LIMIT_PER_SECOND = float(os.environ.get('AUTH_RATE_LIMIT_PER_SECOND', 1))
+AUTH_RATE_LIMIT_BURST = int(os.environ.get('AUTH_RATE_LIMIT_BURST', 10))
+UPLOAD_RATE_LIMIT_PER_SECOND = float(os.environ.get('UPLOAD_RATE_LIMIT_PER_SECOND', 2))
+UPLOAD_RATE_LIMIT_BURST = int(os.environ.get('UPLOAD_RATE_LIMIT_BURST', 20))
+# Login/register bodies are read before admission to key their bucket by account; larger ones get 413
+AUTH_MAX_BODY_SIZE = 16 * 1024
+# Requests of a class running at once per worker; beyond that they are shed with 503, 0 means no cap
+AUTH_MAX_CONCURRENCY = int(os.environ.get('AUTH_MAX_CONCURRENCY', HASH_POOL_SIZE * 4))
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get('UPLOAD_MAX_CONCURRENCY', 16))
+
+# POST /api/reset-database drops every collection; development only, off unless set
+ALLOW_DATABASE_RESET = os.environ.get('ALLOW_DATABASE_RESET', 'false').lower() in ('1', 'true', 'yes')
+
+# Scaled-out replicas can skip index creation and seeding when another instance owns them
+SKIP_BOOTSTRAP = os.environ.get('SKIP_BOOTSTRAP', 'false').lower() in ('1', 'true', 'yes')
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Create the main app without a prefix
-app = FastAPI(title="impNet API", version="1.0.0")
-
-# Mount static files for uploads
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app = FastAPI(title="impNet API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -57,6 +278,9 @@ class Role(BaseModel):
     display_name: str
     description: Optional[str] = None
     permissions: List[str] = []
+    # None falls back to DEFAULT_STORAGE_QUOTA_BYTES / DEFAULT_DOCUMENT_QUOTA, 0 means unlimited
+    storage_quota_bytes: Optional[int] = None
+    document_quota: Optional[int] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     created_by: str
 
@@ -65,6 +289,8 @@ class RoleCreate(BaseModel):
     display_name: str
     description: Optional[str] = None
     permissions: List[str] = []
+    storage_quota_bytes: Optional[int] = Field(None, ge=0)
+    document_quota: Optional[int] = Field(None, ge=0)
 
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -90,6 +316,10 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class UserUpdate(BaseModel):
+    role_id: Optional[str] = None
+    is_active: Optional[bool] = None
+
 class UserResponse(BaseModel):
     id: str
     email: str
@@ -106,6 +336,29 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: UserResponse
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class Session(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    email: str
+    token_hash: str
+    previous_token_hash: Optional[str] = None
+    user_agent: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+    revoked_at: Optional[datetime] = None
+
+class SessionResponse(BaseModel):
+    id: str
+    user_agent: Optional[str] = None
+    created_at: datetime
+    last_used_at: datetime
+    expires_at: datetime
 
 class TokenData(BaseModel):
     email: Optional[str] = None
@@ -121,6 +374,19 @@ class Document(BaseModel):
     mime_type: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     description: Optional[str] = None
+    sha256: Optional[str] = None
+    blob_id: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+    passport_photo_path: Optional[str] = None
+    # Public URLs are stored at write time so listings never rebuild them
+    url: Optional[str] = None
+    thumbnail_url: Optional[str] = None
+
+class StoredFile(BaseModel):
+    file_path: str
+    file_size: int
+    sha256: str
+    derivatives: Dict[str, str] = {}
 
 class DocumentResponse(BaseModel):
     id: str
@@ -132,6 +398,7 @@ class DocumentResponse(BaseModel):
     created_at: datetime
     description: Optional[str] = None
     url: str
+    thumbnail_url: Optional[str] = None
 
 class Passport(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -141,6 +408,7 @@ class Passport(BaseModel):
     issue_date: datetime
     issue_place: str
     photo_document_id: Optional[str] = None
+    photo_path: Optional[str] = None  # denormalized from the photo document
     first_name: str
     last_name: str
     middle_name: Optional[str] = None
@@ -175,6 +443,67 @@ class PassportResponse(BaseModel):
     updated_at: datetime
     photo_url: Optional[str] = None
 
+class PassportSummary(BaseModel):
+    series: str
+    number: str
+    first_name: str
+    last_name: str
+    middle_name: Optional[str] = None
+    birth_date: datetime
+    issue_date: datetime
+
+class CitizenSearchResult(UserResponse):
+    passport: Optional[PassportSummary] = None
+
+class Principal(BaseModel):
+    user: User
+    permissions: FrozenSet[str] = frozenset()
+
+class UserImportRow(BaseModel):
+    email: EmailStr
+    username: str
+    full_name: str
+    password: str
+    role: Optional[str] = None  # role name, defaults to citizen
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    middle_name: Optional[str] = None
+    birth_date: Optional[date] = None
+    birth_place: Optional[str] = None
+    gender: Optional[str] = None
+    issue_place: Optional[str] = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    processed: int = 0
+    inserted: int = 0
+    passports_created: int = 0
+    errors: List[ImportRowError] = []
+
+class ImportJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"  # "queued", "running", "completed" or "failed"
+    format: str
+    create_passports: bool = False
+    created_by: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    report: ImportReport = Field(default_factory=ImportReport)
+    error: Optional[str] = None
+
+class UsageResponse(BaseModel):
+    user_id: str
+    email: Optional[str] = None
+    username: Optional[str] = None
+    full_name: Optional[str] = None
+    bytes: int = 0
+    objects: int = 0
+    storage_quota_bytes: Optional[int] = None
+    document_quota: Optional[int] = None
+
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
@@ -184,13 +513,125 @@ class StatusCheckCreate(BaseModel):
     client_name: str
 
 # Utility functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxConnecting": MONGO_MAX_CONNECTING,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "event_listeners": [metrics.MongoCommandListener(), mongo_pool],
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+        options["zlibCompressionLevel"] = MONGO_ZLIB_COMPRESSION_LEVEL
+    return options
+
+def connect_db():
+    """Create the Motor client on first use; tools and benchmarks may install their own client first"""
+    global client, db, listing_db
+    if client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
+    db = client[DB_NAME]
+    read_preference = read_preferences.make_read_preference(
+        read_preferences.read_pref_mode_from_name(LISTING_READ_PREFERENCE),
+        None,
+        max_staleness=LISTING_MAX_STALENESS_SECONDS
+    )
+    listing_db = client.get_database(DB_NAME, read_preference=read_preference)
+
+@functools.lru_cache(maxsize=None)
+def password_context():
+    """The passlib context, built on first use in whichever thread or process hashes"""
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS,
+    )
+
+def init_storage():
+    """Create the configured storage backend; benchmarks may install their own first"""
+    global file_storage
+    if file_storage is None:
+        file_storage = create_storage(
+            STORAGE_BACKEND,
+            root=ROOT_DIR,
+            tmp_dir=UPLOAD_TMP_DIR,
+            bucket=S3_BUCKET,
+            prefix=S3_PREFIX,
+            endpoint_url=S3_ENDPOINT_URL,
+            region=S3_REGION,
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunk_size=S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+            presign_expires=S3_PRESIGN_EXPIRES,
+            presigned_downloads=S3_PRESIGNED_DOWNLOADS,
+        )
+
+def init_executors():
+    """Create the hashing and image pools; the CLI calls this too"""
+    global hash_executor, bulk_hash_executor, image_executor
+    context = multiprocessing.get_context(PROCESS_START_METHOD)
+    if hash_executor is None:
+        if HASH_EXECUTOR == 'process':
+            hash_executor = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=context)
+        else:
+            hash_executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="bcrypt")
+    if bulk_hash_executor is None:
+        bulk_hash_executor = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=context)
+    if image_executor is None:
+        image_executor = ProcessPoolExecutor(max_workers=IMAGE_POOL_SIZE, mp_context=context)
+
+def shutdown_executors(wait: bool = False):
+    global hash_executor, bulk_hash_executor, image_executor
+    for executor in (hash_executor, bulk_hash_executor, image_executor):
+        if executor is not None:
+            executor.shutdown(wait=wait)
+    hash_executor = bulk_hash_executor = image_executor = None
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+def _hash_password_sync(password):
+    return password_context().hash(password)
+
+def _verify_and_update_sync(plain_password, hashed_password):
+    return password_context().verify_and_update(plain_password, hashed_password)
+
+async def run_hash_job(func, *args):
+    """Run a bcrypt job in the hashing pool, shedding load once the queue is full"""
+    global hash_jobs_pending
+    if hash_jobs_pending >= HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    hash_jobs_pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(hash_executor, func, *args)
+    finally:
+        hash_jobs_pending -= 1
+        elapsed = time.perf_counter() - start
+        metrics.BCRYPT_DURATION.observe(elapsed, func.__name__.strip("_").removesuffix("_sync"))
+        stats = metrics.current_request_stats()
+        if stats is not None:
+            stats.bcrypt_seconds += elapsed
+
+async def verify_and_update_password(plain_password, hashed_password):
+    """Verify password, returning (verified, new_hash) where new_hash is set if the stored hash is outdated"""
+    return await run_hash_job(_verify_and_update_sync, plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await run_hash_job(_hash_password_sync, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -200,44 +641,920 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def generate_passport_number():
-    """Generate passport series and number"""
-    series = ''.join(secrets.choice(string.digits) for _ in range(4))
-    number = ''.join(secrets.choice(string.digits) for _ in range(6))
-    return series, number
+def hash_refresh_token(token: str) -> str:
+    # Tokens are 256 random bits, so a keyed hash is enough; bcrypt would defeat the purpose
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
 
-async def save_uploaded_file(file: UploadFile, user_id: str) -> str:
-    """Save uploaded file and return file path"""
-    # Generate unique filename
-    file_extension = file.filename.split('.')[-1] if '.' in file.filename else ''
-    unique_filename = f"{user_id}_{uuid.uuid4().hex}.{file_extension}"
-    
-    # Create user directory
-    user_dir = UPLOAD_DIR / user_id
-    user_dir.mkdir(exist_ok=True)
+async def create_session(user: dict, user_agent: Optional[str] = None) -> str:
+    """Start a refresh session for the user and return its first refresh token"""
+    refresh_token = secrets.token_urlsafe(32)
+    session = Session(
+        user_id=user["id"],
+        email=user["email"],
+        token_hash=hash_refresh_token(refresh_token),
+        user_agent=user_agent,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    await db.sessions.insert_one(session.dict())
+    return refresh_token
+
+async def rotate_session(refresh_token: str) -> tuple:
+    """Swap a live refresh token for a new one in a single indexed update; returns (session, new token)"""
+    token_hash = hash_refresh_token(refresh_token)
+    new_token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    session = await db.sessions.find_one_and_update(
+        {"token_hash": token_hash, "revoked_at": None, "expires_at": {"$gt": now}},
+        {"$set": {
+            "token_hash": hash_refresh_token(new_token),
+            "previous_token_hash": token_hash,
+            "last_used_at": now,
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if session is None:
+        # A rotated-out token presented again was copied somewhere: end that session
+        stolen = await db.sessions.find_one_and_update(
+            {
+                "previous_token_hash": token_hash,
+                "revoked_at": None,
+                "last_used_at": {"$lt": now - timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS)},
+            },
+            {"$set": {"revoked_at": now}}
+        )
+        if stolen:
+            logger.warning(f"Refresh token reuse detected, revoked session {stolen['id']}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return session, new_token
+
+async def revoke_sessions(query: dict) -> int:
+    result = await db.sessions.update_many({**query, "revoked_at": None}, {"$set": {"revoked_at": datetime.utcnow()}})
+    return result.modified_count
+
+class PassportNumberAllocator:
+    """Hands out unique series/number pairs from blocks leased off an atomic counter.
+
+    Each worker leases PASSPORT_NUMBER_BLOCK_SIZE sequence values with one $inc and
+    serves them from memory. Sequence values are spread over the 10-digit space by
+    multiplying with a constant coprime to 10**10, which is a bijection, so distinct
+    sequence values always give distinct passport numbers.
+    """
+    SPACE = 10 ** 10
+    MULTIPLIER = 7654321123
+    OFFSET = 1000000007
+
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _lease_block(self):
+        counter = await db.counters.find_one_and_update(
+            {"_id": "passport_number"},
+            {"$inc": {"value": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._end = counter["value"]
+        self._next = self._end - self.block_size
+
+    async def allocate(self) -> tuple:
+        async with self._lock:
+            if self._next >= self._end:
+                await self._lease_block()
+            sequence = self._next
+            self._next += 1
+        if sequence >= self.SPACE:
+            raise HTTPException(status_code=503, detail="Passport number space exhausted")
+        digits = f"{(sequence * self.MULTIPLIER + self.OFFSET) % self.SPACE:010d}"
+        return digits[:4], digits[4:]
+
+passport_numbers = PassportNumberAllocator(PASSPORT_NUMBER_BLOCK_SIZE)
+
+BLOB_EXTENSION = re.compile(r"[A-Za-z0-9]{1,16}")
+
+def blob_suffix(filename: Optional[str]) -> str:
+    """".ext" for a blob key from the client's file name; anything but a short alphanumeric extension is dropped"""
+    extension = filename.rsplit('.', 1)[-1] if filename and '.' in filename else ''
+    return f".{extension}" if BLOB_EXTENSION.fullmatch(extension) else ''
+
+async def save_uploaded_file(file: UploadFile) -> StoredFile:
+    """Stream upload into the blob store, enforcing MAX_UPLOAD_SIZE and checksumming in the same pass.
+
+    Identical content is stored once: the blob's reference count is bumped instead.
+    """
+    temp_path = UPLOAD_TMP_DIR / f"{uuid.uuid4().hex}.part"
     
-    file_path = user_dir / unique_filename
+    # Spool chunk by chunk, the storage backend takes over the finished file
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(temp_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File size too large (max 10MB)")
+                digest.update(chunk)
+                await f.write(chunk)
+        sha256 = digest.hexdigest()
+        
+        metrics.UPLOAD_BYTES.inc(size)
+        stats = metrics.current_request_stats()
+        if stats is not None:
+            stats.upload_bytes += size
+        
+        # Content that is already stored and referenced needs no transfer: holding a
+        # reference keeps release_blob from deleting it
+        blob = await db.blobs.find_one_and_update(
+            {"_id": sha256, "ref_count": {"$gt": 0}},
+            {"$inc": {"ref_count": 1}, "$set": {"referenced_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob:
+            await remove_file(temp_path)
+            return StoredFile(file_path=blob["file_path"], file_size=size, sha256=sha256, derivatives=blob.get("derivatives", {}))
+        
+        # Store under a fresh, never-reused key before referencing it,
+        # so a concurrent release of the same hash can never delete our bytes
+        candidate = f"uploads/blobs/{sha256[:2]}/{sha256}-{uuid.uuid4().hex[:8]}{blob_suffix(file.filename)}"
+        await file_storage.put_file(temp_path, candidate, file.content_type)
+    except BaseException:
+        await remove_file(temp_path)
+        raise
     
-    # Save file
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+    blob = await db.blobs.find_one_and_update(
+        {"_id": sha256},
+        {
+            "$inc": {"ref_count": 1},
+            # Reconciliation leaves recently referenced blobs alone: the document may not be inserted yet
+            "$set": {"referenced_at": datetime.utcnow()},
+            "$setOnInsert": {"file_path": candidate, "file_size": size, "created_at": datetime.utcnow()},
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if blob["file_path"] != candidate:
+        # Content stored concurrently, drop the duplicate bytes
+        await file_storage.delete(candidate)
     
-    return str(file_path.relative_to(ROOT_DIR))
+    return StoredFile(
+        file_path=blob["file_path"],
+        file_size=size,
+        sha256=sha256,
+        derivatives=blob.get("derivatives", {})
+    )
+
+async def release_blob(blob_id: str) -> int:
+    """Drop one reference to a blob, deleting its stored files when nothing points at it; returns bytes freed"""
+    blob = await db.blobs.find_one_and_update(
+        {"_id": blob_id},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not blob or blob["ref_count"] > 0:
+        return 0
+    return await delete_unreferenced_blob(blob) or 0
+
+async def delete_unreferenced_blob(blob: dict) -> Optional[int]:
+    """Delete a blob whose count reached zero and its files; returns bytes freed, None if it was re-referenced"""
+    # Only the writer that removes the record deletes; a concurrent upload re-referencing
+    # the blob makes this a no-op, and new uploads always get a new key
+    result = await db.blobs.delete_one({"_id": blob["_id"], "ref_count": {"$lte": 0}})
+    if not result.deleted_count:
+        return None
+    await file_storage.delete_many([blob["file_path"], *blob.get("derivatives", {}).values()])
+    return blob.get("file_size", 0)
 
 def is_image_file(filename: str) -> bool:
     """Check if file is an image"""
     image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
     return any(filename.lower().endswith(ext) for ext in image_extensions)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def upload_url(file_path: str) -> str:
+    return f"/api/files/{file_path.split('uploads/')[-1]}"
+
+def file_url_signature(user_id: str, url: str, expires: int) -> str:
+    message = f"{user_id}\n{url}\n{expires}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+def sign_file_url(url: str, user_id: str) -> str:
+    """Signed link to one of the user's files, usable without an Authorization header"""
+    expires = (int(time.time()) // FILE_URL_WINDOW_SECONDS + 2) * FILE_URL_WINDOW_SECONDS
+    query = urlencode({"uid": user_id, "expires": expires, "signature": file_url_signature(user_id, url, expires)})
+    return f"{url}?{query}"
+
+def verify_file_url(url: str, user_id: str, expires: int, signature: str) -> bool:
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(file_url_signature(user_id, url, expires), signature)
+
+def _save_webp(image, target: Path):
+    # Targets are private temp files; the storage backend publishes them once complete
+    image.save(target, "WEBP", quality=80, method=4)
+
+def _render_image_derivatives(source: str, thumbnail: str, passport_photo: str):
+    """Render WebP thumbnail and passport-photo derivatives; runs in the image process pool.
+
+    Only pixel data is re-encoded, so EXIF and other metadata are stripped.
+    """
+    from PIL import Image, ImageOps
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        _save_webp(ImageOps.fit(image, PASSPORT_PHOTO_SIZE, Image.LANCZOS), Path(passport_photo))
+        image.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+        _save_webp(image, Path(thumbnail))
+
+async def generate_image_derivatives(blob_id: str, file_path: str):
+    """Background job: render derivatives for a blob and attach them to its documents"""
+    stem = PurePosixPath(file_path).with_suffix("")
+    derivatives = {
+        "thumbnail": f"{stem}.thumb.webp",
+        "passport_photo": f"{stem}.passport.webp",
+    }
+    rendered = {name: UPLOAD_TMP_DIR / f"{uuid.uuid4().hex}.webp" for name in derivatives}
+    try:
+        async with file_storage.local_copy(file_path) as source:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                image_executor,
+                _render_image_derivatives,
+                str(source),
+                str(rendered["thumbnail"]),
+                str(rendered["passport_photo"]),
+            )
+        for name, key in derivatives.items():
+            await file_storage.put_file(rendered[name], key, "image/webp")
+    except Exception as e:
+        logger.warning(f"Image processing failed for blob {blob_id}: {e}")
+        for path in rendered.values():
+            await remove_file(path)
+        return
+    
+    result = await db.blobs.update_one({"_id": blob_id}, {"$set": {"derivatives": derivatives}})
+    if not result.matched_count:
+        # Blob released while we were rendering
+        for derivative_path in derivatives.values():
+            await file_storage.delete(derivative_path)
+        return
+    await db.documents.update_many(
+        {"blob_id": blob_id},
+        {"$set": {
+            "thumbnail_path": derivatives["thumbnail"],
+            "thumbnail_url": upload_url(derivatives["thumbnail"]),
+            "passport_photo_path": derivatives["passport_photo"],
+        }}
+    )
+    # Passports using one of these documents as photo switch to the rendition
+    document_ids = await db.documents.distinct("id", {"blob_id": blob_id})
+    await db.passports.update_many(
+        {"photo_document_id": {"$in": document_ids}},
+        {"$set": {"photo_path": derivatives["passport_photo"]}}
+    )
+
+def passport_photo_path(photo_doc: dict) -> str:
+    """Passport-sized rendition when ready, the original otherwise"""
+    return photo_doc.get("passport_photo_path") or photo_doc["file_path"]
+
+class TTLCache:
+    """Bounded TTL/LRU cache with hit/miss accounting"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class PrincipalCache(TTLCache):
+    """Authenticated principals keyed by token subject, and by ("user_id", id) for signed file links"""
+
+    def invalidate_user_id(self, user_id: str):
+        for subject, (_, principal) in list(self._entries.items()):
+            if principal.user.id == user_id:
+                del self._entries[subject]
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+# (user_id, file_path) pairs that passed the ownership check
+file_access_cache = TTLCache(FILE_ACCESS_CACHE_SIZE, FILE_ACCESS_CACHE_TTL)
+
+class RoleRegistry:
+    """In-memory role index by id and name with precomputed permission sets"""
+
+    def __init__(self):
+        self._by_id: Dict[str, Role] = {}
+        self._by_name: Dict[str, Role] = {}
+        self._permissions: Dict[str, FrozenSet[str]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.loaded_at: Optional[datetime] = None
+
+    async def refresh(self):
+        roles = [Role(**role) for role in await db.roles.find({}, {"_id": 0}).to_list(None)]
+        permissions = {role.id: frozenset(role.permissions) for role in roles}
+        if permissions != self._permissions:
+            # Cached principals carry permission sets, drop them so changes apply immediately
+            principal_cache.clear()
+        self._by_id = {role.id: role for role in roles}
+        self._by_name = {role.name: role for role in roles}
+        self._permissions = permissions
+        self.loaded_at = datetime.utcnow()
+
+    def get(self, role_id: str) -> Optional[Role]:
+        return self._by_id.get(role_id)
+
+    def get_by_name(self, name: str) -> Optional[Role]:
+        return self._by_name.get(name)
+
+    def all(self) -> List[Role]:
+        return list(self._by_id.values())
+
+    def permissions(self, role_id: str) -> FrozenSet[str]:
+        return self._permissions.get(role_id, frozenset())
+
+    def start(self, mode: str, interval: float):
+        if mode != "off" and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(mode, interval))
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self, mode: str, interval: float):
+        if mode == "change_stream":
+            try:
+                async with db.roles.watch() as stream:
+                    async for _ in stream:
+                        await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Change streams need a replica set; degrade to polling
+                logger.warning(f"Role change stream unavailable, falling back to polling: {e}")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Role registry refresh failed: {e}")
+
+role_registry = RoleRegistry()
+
+class WriteBehindBuffer:
+    """Takes login bookkeeping and status check inserts off the request path.
+
+    Updates to the same user are coalesced into one $set and status checks are
+    inserted together. Pending entries are flushed every `interval` seconds or
+    once `batch_size` are queued, and drained on shutdown. At `max_pending` the
+    caller waits for a flush, so memory stays bounded when MongoDB is slow.
+    """
+
+    def __init__(self, batch_size: int, interval: float, max_pending: int):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        # user id -> (principal cache key, fields to $set)
+        self._user_updates: Dict[str, tuple] = {}
+        self._status_checks: List[dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def pending(self) -> int:
+        return len(self._user_updates) + len(self._status_checks)
+
+    async def update_user(self, user_id: str, email: str, fields: dict):
+        _, pending_fields = self._user_updates.get(user_id, (email, {}))
+        self._user_updates[user_id] = (email, {**pending_fields, **fields})
+        await self._added()
+
+    async def add_status_check(self, status_check: dict):
+        self._status_checks.append(status_check)
+        await self._added()
+
+    async def _added(self):
+        if self._task is None:
+            # Not running (CLI, scripts): write through
+            await self.flush()
+        elif self.pending() >= self.max_pending:
+            await self.flush()
+        elif self.pending() >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            user_updates, self._user_updates = self._user_updates, {}
+            status_checks, self._status_checks = self._status_checks, []
+            if user_updates:
+                await self._flush_user_updates(user_updates)
+            if status_checks:
+                await self._flush_status_checks(status_checks)
+
+    async def _flush_user_updates(self, user_updates: Dict[str, tuple]):
+        operations = [UpdateOne({"id": user_id}, {"$set": fields}) for user_id, (_, fields) in user_updates.items()]
+        try:
+            await db.users.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            logger.warning(f"Write-behind dropped {len(bulk_write_errors(e))} user updates")
+        except Exception as e:
+            logger.warning(f"Write-behind flush of {len(operations)} user updates failed, will retry: {e}")
+            for user_id, (email, fields) in user_updates.items():
+                # Anything queued since takes precedence
+                _, newer = self._user_updates.get(user_id, (email, {}))
+                self._user_updates[user_id] = (email, {**fields, **newer})
+            return
+        for email, _ in user_updates.values():
+            principal_cache.invalidate(email)
+
+    async def _flush_status_checks(self, status_checks: List[dict]):
+        try:
+            await db.status_checks.insert_many(status_checks, ordered=False)
+        except BulkWriteError as e:
+            logger.warning(f"Write-behind dropped {len(bulk_write_errors(e))} status checks")
+        except Exception as e:
+            logger.warning(f"Write-behind flush of {len(status_checks)} status checks failed, will retry: {e}")
+            self._status_checks[:0] = status_checks
+            overflow = len(self._status_checks) - self.max_pending
+            if overflow > 0:
+                # Oldest first: keep memory bounded through a long outage
+                del self._status_checks[:overflow]
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and drain whatever is still pending"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Write-behind flush failed: {e}")
+
+write_behind = WriteBehindBuffer(WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_PENDING)
+
+def usage_quota(role_id: Optional[str]) -> tuple:
+    """(bytes, documents) a role may store; None means unlimited"""
+    role = role_registry.get(role_id)
+    bytes_quota = role.storage_quota_bytes if role and role.storage_quota_bytes is not None else DEFAULT_STORAGE_QUOTA_BYTES
+    document_quota = role.document_quota if role and role.document_quota is not None else DEFAULT_DOCUMENT_QUOTA
+    return bytes_quota or None, document_quota or None
+
+async def reserve_usage(user: User, size: int):
+    """Charge a new document to its owner before it is stored, refusing it if the role's quota would be exceeded"""
+    bytes_quota, document_quota = usage_quota(user.role_id)
+    quota_exceeded = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Storage quota exceeded")
+    query = {"_id": user.id}
+    if bytes_quota is not None:
+        if size > bytes_quota:
+            raise quota_exceeded
+        query["bytes"] = {"$lte": bytes_quota - size}
+    if document_quota is not None:
+        query["objects"] = {"$lte": document_quota - 1}
+    try:
+        # The check and the charge are one write, so concurrent uploads can't overshoot together
+        await db.usage.update_one(query, {"$inc": {"bytes": size, "objects": 1}}, upsert=True)
+    except DuplicateKeyError:
+        # The counter exists but is over quota, so the upsert collided with it
+        raise quota_exceeded
+
+async def record_usage(user_id: str, size: int, objects: int):
+    # Adjusts a counter reserve_usage or backfill_usage created; users without one are left alone
+    await db.usage.update_one({"_id": user_id}, {"$inc": {"bytes": size, "objects": objects}})
+
+async def backfill_usage(batch_size: int = USAGE_BACKFILL_BATCH_SIZE) -> dict:
+    """Rebuild every user's counters from their documents, batch_size users at a time.
+
+    Each batch is one indexed aggregation over those users' documents and one bulk
+    write. An upload or deletion landing between the two is lost from that user's
+    counter, so run it when uploads are quiet.
+    """
+    report = {"users": 0, "bytes": 0, "objects": 0}
+    after = None
+    while True:
+        query = {"_id": {"$gt": after}} if after is not None else {}
+        users = await db.users.find(query, {"id": 1}).sort("_id", ASCENDING).limit(batch_size).to_list(batch_size)
+        if not users:
+            return report
+        after = users[-1]["_id"]
+        user_ids = [user["id"] for user in users]
+        totals = {
+            row["_id"]: row for row in await db.documents.aggregate([
+                {"$match": {"user_id": {"$in": user_ids}}},
+                {"$group": {"_id": "$user_id", "bytes": {"$sum": "$file_size"}, "objects": {"$sum": 1}}},
+            ]).to_list(None)
+        }
+        operations = []
+        for user_id in user_ids:
+            row = totals.get(user_id, {})
+            counters = {"bytes": row.get("bytes", 0), "objects": row.get("objects", 0)}
+            operations.append(UpdateOne({"_id": user_id}, {"$set": counters}, upsert=True))
+            report["bytes"] += counters["bytes"]
+            report["objects"] += counters["objects"]
+        await db.usage.bulk_write(operations, ordered=False)
+        report["users"] += len(user_ids)
+
+DOCUMENT_PATH_FIELDS = ("file_path", "thumbnail_path", "passport_photo_path")
+
+async def tombstone_document(document: dict) -> bool:
+    """Replace a document record with a tombstone for the reaper; False if it is already being deleted"""
+    now = datetime.utcnow()
+    try:
+        # Written before the record goes, so a crash in between still gets reaped
+        await db.tombstones.insert_one({
+            "_id": document["id"],
+            "user_id": document["user_id"],
+            "blob_id": document.get("blob_id"),
+            "keys": [document[field] for field in DOCUMENT_PATH_FIELDS if document.get(field)],
+            "file_size": document.get("file_size", 0),
+            "created_at": now,
+            "lease_until": now,
+        })
+    except DuplicateKeyError:
+        return False
+    result = await db.documents.delete_one({"id": document["id"]})
+    if result.deleted_count:
+        await record_usage(document["user_id"], -document.get("file_size", 0), -1)
+    return True
+
+class IOBudget:
+    """Paces background jobs to `rate` operations per second; 0 means unlimited"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next_slot = 0.0
+
+    async def spend(self, operations: int = 1):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + operations / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class StorageCollector:
+    """Reclaims stored files and records that nothing references any more.
+
+    The reaper claims tombstones under a lease, removes the record if the request
+    died before doing so, releases the blob and drops the tombstone; any step can
+    be repeated after a crash. Reconciliation walks documents, passports, blobs and
+    the stored files in batches, one worker at a time, and reclaims what is
+    orphaned. Both spend from one IO budget so they never crowd out requests.
+    """
+
+    def __init__(self, budget: IOBudget, batch_size: int, reaper_interval: float, reconcile_interval: float,
+                 lease_seconds: int, min_age_seconds: int, clock: Callable[[], float] = time.time):
+        self.budget = budget
+        self.batch_size = batch_size
+        self.reaper_interval = reaper_interval
+        self.reconcile_interval = reconcile_interval
+        self.lease_seconds = lease_seconds
+        self.min_age_seconds = min_age_seconds
+        # Wall clock: leases and file ages are compared across workers
+        self.clock = clock
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def now(self) -> datetime:
+        return datetime.utcfromtimestamp(self.clock())
+
+    def wake(self):
+        self._wakeup.set()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._reaper_loop()))
+            if self.reconcile_interval > 0:
+                self._tasks.append(asyncio.create_task(self._reconcile_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _reaper_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.reaper_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.warning(f"Tombstone reaper failed: {e}")
+
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Storage reconciliation failed: {e}")
+
+    async def reap(self) -> int:
+        """Process every claimable tombstone; returns how many were reaped"""
+        reaped = 0
+        while True:
+            # Claim, record, blob and tombstone writes
+            await self.budget.spend(4)
+            now = self.now()
+            tombstone = await db.tombstones.find_one_and_update(
+                {"lease_until": {"$lte": now}},
+                {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds)}},
+                sort=[("lease_until", ASCENDING)],
+            )
+            if tombstone is None:
+                return reaped
+            try:
+                result = await db.documents.delete_one({"id": tombstone["_id"]})
+                if result.deleted_count:
+                    await record_usage(tombstone["user_id"], -tombstone.get("file_size", 0), -1)
+                if tombstone.get("blob_id"):
+                    reclaimed = await release_blob(tombstone["blob_id"])
+                else:
+                    await file_storage.delete_many(tombstone["keys"])
+                    reclaimed = tombstone.get("file_size", 0)
+                await db.tombstones.delete_one({"_id": tombstone["_id"]})
+            except Exception as e:
+                # The lease lapses and another pass retries it
+                logger.warning(f"Reaping tombstone {tombstone['_id']} failed: {e}")
+                continue
+            metrics.GC_RECLAIMED_BYTES.inc(reclaimed, "reaper")
+            reaped += 1
+
+    async def reconcile(self, min_age_seconds: Optional[int] = None) -> Optional[dict]:
+        """One full reconciliation pass; None when another worker is already running one"""
+        owner = uuid.uuid4().hex
+        if not await self._acquire_lease(owner):
+            return None
+        min_age = self.min_age_seconds if min_age_seconds is None else min_age_seconds
+        cutoff = self.now() - timedelta(seconds=min_age)
+        report = {
+            "started_at": self.now(),
+            "finished_at": None,
+            "documents_scanned": 0,
+            "orphaned_documents": 0,
+            "passports_scanned": 0,
+            "orphaned_passports": 0,
+            "blobs_scanned": 0,
+            "blobs_repaired": 0,
+            "blobs_reclaimed": 0,
+            "files_scanned": 0,
+            "orphaned_files": 0,
+            "bytes_reclaimed": 0,
+        }
+        try:
+            await self._reconcile_records(owner, report)
+            await self._reconcile_blobs(owner, cutoff, report)
+            await self._reconcile_files(owner, cutoff, report)
+        finally:
+            report["finished_at"] = self.now()
+            await db.gc_state.update_one(
+                {"_id": "reconcile", "owner": owner},
+                {"$set": {"lease_until": self.now(), "report": report}},
+            )
+        metrics.GC_RECLAIMED_BYTES.inc(report["bytes_reclaimed"], "reconcile")
+        logger.info(
+            f"Storage reconciliation reclaimed {report['bytes_reclaimed']} bytes: "
+            f"{report['orphaned_files']} files, {report['blobs_reclaimed']} blobs, "
+            f"{report['orphaned_documents']} documents, {report['orphaned_passports']} passports"
+        )
+        # Tombstones written for orphaned documents
+        self.wake()
+        return report
+
+    async def _acquire_lease(self, owner: str) -> bool:
+        now = self.now()
+        try:
+            await db.gc_state.update_one(
+                {"_id": "reconcile", "lease_until": {"$lte": now}},
+                {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds), "owner": owner}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Held by another worker: the upsert collided with the existing state document
+            return False
+        return True
+
+    async def _renew_lease(self, owner: str):
+        await self.budget.spend()
+        result = await db.gc_state.update_one(
+            {"_id": "reconcile", "owner": owner},
+            {"$set": {"lease_until": self.now() + timedelta(seconds=self.lease_seconds)}},
+        )
+        if not result.matched_count:
+            raise RuntimeError("Reconciliation lease lost to another worker")
+
+    async def _batches(self, collection, projection: dict, owner: str):
+        """Whole collection in _id order, batch_size records at a time"""
+        after = None
+        while True:
+            await self._renew_lease(owner)
+            query = {"_id": {"$gt": after}} if after is not None else {}
+            batch = await collection.find(query, projection).sort("_id", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                return
+            yield batch
+            after = batch[-1]["_id"]
+
+    async def _existing_user_ids(self, records: List[dict]) -> set:
+        await self.budget.spend()
+        user_ids = list({record["user_id"] for record in records})
+        return set(await db.users.distinct("id", {"id": {"$in": user_ids}}))
+
+    async def _reconcile_records(self, owner: str, report: dict):
+        """Documents and passports whose owner no longer exists"""
+        projection = {"id": 1, "user_id": 1, "blob_id": 1, "file_size": 1, **{field: 1 for field in DOCUMENT_PATH_FIELDS}}
+        async for documents in self._batches(db.documents, projection, owner):
+            report["documents_scanned"] += len(documents)
+            existing = await self._existing_user_ids(documents)
+            for document in documents:
+                if document["user_id"] not in existing:
+                    await self.budget.spend(2)
+                    if await tombstone_document(document):
+                        report["orphaned_documents"] += 1
+                        metrics.GC_RECLAIMED_OBJECTS.inc(1, "document")
+
+        async for passports in self._batches(db.passports, {"user_id": 1}, owner):
+            report["passports_scanned"] += len(passports)
+            existing = await self._existing_user_ids(passports)
+            orphaned = [passport["_id"] for passport in passports if passport["user_id"] not in existing]
+            if orphaned:
+                await self.budget.spend()
+                result = await db.passports.delete_many({"_id": {"$in": orphaned}})
+                report["orphaned_passports"] += result.deleted_count
+                metrics.GC_RECLAIMED_OBJECTS.inc(result.deleted_count, "passport")
+
+    async def _reference_counts(self, collection, blob_ids: List[str]) -> Dict[str, int]:
+        await self.budget.spend()
+        rows = await collection.aggregate([
+            {"$match": {"blob_id": {"$in": blob_ids}}},
+            {"$group": {"_id": "$blob_id", "count": {"$sum": 1}}},
+        ]).to_list(None)
+        return {row["_id"]: row["count"] for row in rows}
+
+    async def _reconcile_blobs(self, owner: str, cutoff: datetime, report: dict):
+        """Reference counts against the documents (and pending tombstones) pointing at each blob"""
+        projection = {"ref_count": 1, "file_path": 1, "derivatives": 1, "file_size": 1, "created_at": 1, "referenced_at": 1}
+        async for blobs in self._batches(db.blobs, projection, owner):
+            report["blobs_scanned"] += len(blobs)
+            blob_ids = [blob["_id"] for blob in blobs]
+            documents = await self._reference_counts(db.documents, blob_ids)
+            pending = await self._reference_counts(db.tombstones, blob_ids)
+            for blob in blobs:
+                references = documents.get(blob["_id"], 0) + pending.get(blob["_id"], 0)
+                if references < blob["ref_count"] and (blob.get("referenced_at") or blob["created_at"]) > cutoff:
+                    # An upload may hold a reference it has not recorded on a document yet
+                    continue
+                if references != blob["ref_count"]:
+                    # Conditional on the count read above, so a concurrent upload or release wins
+                    await self.budget.spend()
+                    result = await db.blobs.update_one(
+                        {"_id": blob["_id"], "ref_count": blob["ref_count"]},
+                        {"$set": {"ref_count": references}},
+                    )
+                    if not result.modified_count:
+                        continue
+                    report["blobs_repaired"] += 1
+                if references == 0:
+                    await self.budget.spend(2)
+                    reclaimed = await delete_unreferenced_blob(blob)
+                    if reclaimed is not None:
+                        report["blobs_reclaimed"] += 1
+                        report["bytes_reclaimed"] += reclaimed
+                        metrics.GC_RECLAIMED_OBJECTS.inc(1, "blob")
+
+    async def _reconcile_files(self, owner: str, cutoff: datetime, report: dict):
+        """Stored files that no blob or legacy document references; spooled uploads in UPLOAD_TMP_DIR are skipped"""
+        cutoff_timestamp = cutoff.replace(tzinfo=timezone.utc).timestamp()
+        async for page in file_storage.list_pages("uploads/", self.batch_size, exclude=[UPLOAD_TMP_PREFIX]):
+            await self._renew_lease(owner)
+            report["files_scanned"] += len(page)
+            candidates = {key: size for key, size, modified in page if modified < cutoff_timestamp}
+            if not candidates:
+                continue
+
+            known = set()
+            # Blob files are named <sha256>-<suffix>.<ext>, derivatives included
+            blob_ids = {PurePosixPath(key).name.split("-")[0] for key in candidates if key.startswith("uploads/blobs/")}
+            legacy_keys = [key for key in candidates if not key.startswith("uploads/blobs/")]
+            await self.budget.spend(2)
+            async for blob in db.blobs.find({"_id": {"$in": list(blob_ids)}}, {"file_path": 1, "derivatives": 1}):
+                known.add(blob["file_path"])
+                known.update(blob.get("derivatives", {}).values())
+            if legacy_keys:
+                known.update(await db.documents.distinct("file_path", {"file_path": {"$in": legacy_keys}}))
+
+            orphaned = [key for key in candidates if key not in known]
+            if orphaned:
+                await self.budget.spend(len(orphaned))
+                await file_storage.delete_many(orphaned)
+                report["orphaned_files"] += len(orphaned)
+                report["bytes_reclaimed"] += sum(candidates[key] for key in orphaned)
+                metrics.GC_RECLAIMED_OBJECTS.inc(len(orphaned), "file")
+
+storage_collector = StorageCollector(
+    IOBudget(GC_IO_BUDGET), GC_BATCH_SIZE, GC_REAPER_INTERVAL, GC_RECONCILE_INTERVAL, GC_LEASE_SECONDS, GC_MIN_AGE_SECONDS
+)
+
+async def load_principal(email: str) -> Optional[Principal]:
+    """Load user from the database, permissions come from the role registry"""
+    user = await db.users.find_one({"email": email})
+    if user is None:
+        return None
+    return Principal(user=User(**user), permissions=role_registry.permissions(user["role_id"]))
+
+async def file_link_principal(user_id: str) -> Optional[Principal]:
+    """Owner of a signed file link, cached next to token subjects so deactivation evicts it too"""
+    key = ("user_id", user_id)
+    principal = principal_cache.get(key)
+    if principal is None:
+        user = await db.users.find_one({"id": user_id})
+        if user is None:
+            return None
+        principal = Principal(user=User(**user), permissions=role_registry.permissions(user["role_id"]))
+        principal_cache.put(key, principal)
+    return principal
+
+async def authenticate_token(token: Optional[str]) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
+    from jose import JWTError, jwt
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
@@ -245,101 +1562,682 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except JWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"email": token_data.email})
-    if user is None:
-        raise credentials_exception
-    return User(**user)
+    principal = principal_cache.get(token_data.email)
+    if principal is None:
+        principal = await load_principal(token_data.email)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.put(token_data.email, principal)
+    return principal
+
+def token_subject(scope: dict) -> Optional[str]:
+    """Email in a valid bearer token, checked without touching the database; used to key rate limits"""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            from jose import JWTError, jwt
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            except JWTError:
+                return None
+    return None
+
+def login_account(body: bytes) -> Optional[str]:
+    """Email a login/register body names (username if it has none); keys the auth bucket with the client IP"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    account = data.get("email") or data.get("username") if isinstance(data, dict) else None
+    return account.strip().casefold() if isinstance(account, str) else None
+
+admission_control = admission.AdmissionController(
+    [
+        admission.RouteClass(
+            "auth",
+            [("POST", "/api/auth/login"), ("POST", "/api/auth/register")],
+            AUTH_RATE_LIMIT_PER_SECOND, AUTH_RATE_LIMIT_BURST, AUTH_MAX_CONCURRENCY,
+            max_body_size=AUTH_MAX_BODY_SIZE, body_key=login_account,
+        ),
+        admission.RouteClass(
+            "upload",
+            [("POST", "/api/documents/upload")],
+            UPLOAD_RATE_LIMIT_PER_SECOND, UPLOAD_RATE_LIMIT_BURST, UPLOAD_MAX_CONCURRENCY,
+            key_by_user=True, max_body_size=MAX_UPLOAD_SIZE + UPLOAD_MULTIPART_OVERHEAD,
+        ),
+    ],
+    identify_user=token_subject,
+    trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES,
+)
+
+def init_admission():
+    """Attach the configured rate limiter backend"""
+    if RATE_LIMIT_BACKEND == "mongo":
+        admission_control.limiter = admission.MongoRateLimiter(db.rate_limits)
+    elif RATE_LIMIT_BACKEND == "memory":
+        admission_control.limiter = admission.LocalRateLimiter()
+    elif RATE_LIMIT_BACKEND != "off":
+        raise ValueError(f"Unknown rate limit backend: {RATE_LIMIT_BACKEND}")
+
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def get_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal.user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-async def get_admin_user(current_user: User = Depends(get_current_active_user)):
-    role = await db.roles.find_one({"id": current_user.role_id})
-    if not role or "admin" not in role.get("permissions", []):
+async def get_admin_user(
+    current_user: User = Depends(get_current_active_user),
+    principal: Principal = Depends(get_current_principal)
+):
+    if "admin" not in principal.permissions:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return current_user
 
+async def get_search_user(
+    current_user: User = Depends(get_current_active_user),
+    principal: Principal = Depends(get_current_principal)
+):
+    if not SEARCH_PERMISSIONS & principal.permissions:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return current_user
+
+def projection_for(model) -> Dict[str, int]:
+    """Mongo projection returning only the fields a response model needs"""
+    return {field: 1 for field in model.model_fields}
+
+def keyset_query(query: dict, after: Optional[str]) -> dict:
+    """Restrict query to records after the given _id cursor"""
+    if not after:
+        return query
+    if not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {**query, "_id": {"$gt": ObjectId(after)}}
+
+async def fetch_page(collection, query: dict, projection: dict, after: Optional[str], limit: int):
+    """Return one keyset page ordered by _id and the cursor for the next page"""
+    query = keyset_query(query, after)
+    # Fetch one extra row to know whether another page exists
+    docs = await collection.find(query, projection).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = str(docs[-1]["_id"])
+    return docs, next_cursor
+
+class ResponseSerializer:
+    """Precompiled pydantic-core validator and JSON serializer for a response model.
+
+    Handlers return the bytes directly, which skips FastAPI's second
+    response_model pass: each record is validated and dumped exactly once.
+    """
+
+    def __init__(self, model):
+        self.item = TypeAdapter(model)
+        self.many = TypeAdapter(List[model])
+
+    def dump(self, item) -> bytes:
+        return self.item.dump_json(self.item.validate_python(item))
+
+    def dump_many(self, items: list) -> bytes:
+        return self.many.dump_json(self.many.validate_python(items))
+
+    def response(self, item) -> Response:
+        return Response(self.dump(item), media_type="application/json")
+
+    def page(self, items: list, next_cursor: Optional[str]) -> Response:
+        headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+        return Response(self.dump_many(items), media_type="application/json", headers=headers)
+
+def stream_ndjson(collection, query: dict, projection: dict, after: Optional[str], limit: Optional[int], serializer: ResponseSerializer, prepare=None):
+    """Stream matching records as NDJSON straight from the Motor cursor"""
+    query = keyset_query(query, after)
+    cursor = collection.find(query, projection).sort("_id", ASCENDING).batch_size(DEFAULT_PAGE_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    async def generate():
+        async for doc in cursor:
+            yield serializer.dump(prepare(doc) if prepare else doc) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def with_document_urls(doc: dict, user_id: str) -> dict:
+    """Sign the document's URLs for its owner, filling them in for documents stored before they were denormalized"""
+    doc["url"] = sign_file_url(doc.get("url") or upload_url(doc["file_path"]), user_id)
+    if doc.get("thumbnail_path") or doc.get("thumbnail_url"):
+        doc["thumbnail_url"] = sign_file_url(doc.get("thumbnail_url") or upload_url(doc["thumbnail_path"]), user_id)
+    return doc
+
+def document_response(doc: dict, user_id: str) -> DocumentResponse:
+    return DocumentResponse(**with_document_urls(doc, user_id))
+
+def normalize_search_text(text: str) -> str:
+    """Case- and accent-insensitive form of a search key: NFKC, casefolded, ё as е, single spaces"""
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return " ".join(text.split())
+
+def name_search_tokens(full_name: str) -> List[str]:
+    """The normalized name from each word on, so a prefix finds the surname, first name or patronymic"""
+    words = normalize_search_text(full_name).split()
+    return sorted({" ".join(words[start:]) for start in range(len(words))})
+
+def with_search_keys(user: dict) -> dict:
+    """Add the normalized keys citizen search matches prefixes against"""
+    user["search"] = {
+        "name_tokens": name_search_tokens(user["full_name"]),
+        "email": normalize_search_text(user["email"]),
+        "username": normalize_search_text(user["username"]),
+    }
+    return user
+
+def encode_search_cursor(key: Optional[str], object_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(json.dumps([key, str(object_id)], ensure_ascii=False).encode()).decode()
+
+def decode_search_cursor(cursor: str) -> tuple:
+    try:
+        key, object_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return key, ObjectId(object_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def backfill_search_keys(batch_size: int = IMPORT_BATCH_SIZE) -> int:
+    """Add search keys to users created before citizen search or name tokens existed; returns how many were updated"""
+    updated = 0
+    while True:
+        users = await db.users.find(
+            {"search.name_tokens": {"$exists": False}}, {"email": 1, "username": 1, "full_name": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not users:
+            return updated
+        await db.users.bulk_write(
+            [UpdateOne({"_id": user["_id"]}, {"$set": {"search": with_search_keys(user)["search"]}}) for user in users],
+            ordered=False,
+        )
+        updated += len(users)
+
+user_serializer = ResponseSerializer(UserResponse)
+document_serializer = ResponseSerializer(DocumentResponse)
+passport_serializer = ResponseSerializer(PassportResponse)
+status_check_serializer = ResponseSerializer(StatusCheck)
+citizen_serializer = ResponseSerializer(CitizenSearchResult)
+
+def duplicate_key_fields(error: DuplicateKeyError) -> List[str]:
+    """Return the fields of the unique index that rejected a write"""
+    return list((error.details or {}).get("keyPattern", {}).keys())
+
+# Index management
+async def ensure_indexes():
+    """Create indexes from INDEX_SPECS that don't exist yet; a warm start only lists indexes"""
+    missing = await missing_indexes()
+    if not missing:
+        return
+    for collection in missing:
+        try:
+            await db[collection].create_indexes(INDEX_SPECS[collection])
+        except Exception as e:
+            # Usually existing duplicates blocking a unique index; keep serving and report it
+            logger.error(f"Failed to create indexes on {collection}: {e}")
+    for collection, names in (await missing_indexes()).items():
+        logger.warning(f"Collection {collection} is missing indexes: {', '.join(names)}")
+
+async def missing_indexes() -> Dict[str, List[str]]:
+    missing = {}
+    for collection, indexes in INDEX_SPECS.items():
+        existing = await db[collection].index_information()
+        names = [index.document["name"] for index in indexes if index.document["name"] not in existing]
+        if names:
+            missing[collection] = names
+    return missing
+
+async def index_report() -> Dict[str, Any]:
+    """Per-collection index usage counters plus expected indexes that are missing"""
+    usage = {}
+    for collection in INDEX_SPECS:
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        except Exception as e:
+            logger.warning(f"$indexStats unavailable for {collection}: {e}")
+            usage[collection] = None
+            continue
+        usage[collection] = {
+            stat["name"]: {"ops": stat["accesses"]["ops"], "since": stat["accesses"]["since"]}
+            for stat in stats
+        }
+    return {"usage": usage, "missing": await missing_indexes()}
+
 # Initialize default roles
+DEFAULT_ROLES = [
+    {
+        "name": "super_admin",
+        "display_name": "Супер Администратор",
+        "description": "Полный доступ к системе",
+        "permissions": ["admin", "create_roles", "manage_users", "manage_services"],
+    },
+    {
+        "name": "citizen",
+        "display_name": "Гражданин",
+        "description": "Базовый пользователь системы",
+        "permissions": ["user", "view_services", "create_applications"],
+        "storage_quota_bytes": 200 * 1024 * 1024,
+        "document_quota": 1000,
+    },
+    {
+        "name": "bank_employee",
+        "display_name": "Сотрудник ЦБ",
+        "description": "Сотрудник Центрального Банка",
+        "permissions": ["user", "bank_operations", "view_applications"],
+    },
+    {
+        "name": "mfc_employee",
+        "display_name": "Сотрудник МФЦ",
+        "description": "Сотрудник Многофункционального Центра",
+        "permissions": ["user", "mfc_operations", "process_applications"],
+    },
+]
+DEFAULT_ADMIN = {
+    "email": "admin@impnet.ru",
+    "username": "admin",
+    "full_name": "Администратор Системы",
+}
+DEFAULT_ADMIN_PASSWORD = "admin123"
+
+ROLE_QUOTA_FIELDS = ("storage_quota_bytes", "document_quota")
+
 async def init_default_roles():
-    # Check if roles exist
-    roles_count = await db.roles.count_documents({})
-    if roles_count == 0:
-        default_roles = [
-            {
-                "id": str(uuid.uuid4()),
-                "name": "super_admin",
-                "display_name": "Супер Администратор",
-                "description": "Полный доступ к системе",
-                "permissions": ["admin", "create_roles", "manage_users", "manage_services"],
-                "created_at": datetime.utcnow(),
-                "created_by": "system"
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "name": "citizen",
-                "display_name": "Гражданин",
-                "description": "Базовый пользователь системы",
-                "permissions": ["user", "view_services", "create_applications"],
-                "created_at": datetime.utcnow(),
-                "created_by": "system"
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "name": "bank_employee",
-                "display_name": "Сотрудник ЦБ",
-                "description": "Сотрудник Центрального Банка",
-                "permissions": ["user", "bank_operations", "view_applications"],
-                "created_at": datetime.utcnow(),
-                "created_by": "system"
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "name": "mfc_employee",
-                "display_name": "Сотрудник МФЦ",
-                "description": "Сотрудник Многофункционального Центра",
-                "permissions": ["user", "mfc_operations", "process_applications"],
-                "created_at": datetime.utcnow(),
-                "created_by": "system"
-            }
+    """Seed missing default roles and the admin account; a warm start is one read and no writes.
+
+    Default roles seeded before quotas existed get the default quota fields; a
+    field that is present, even as null, is left as it is.
+    """
+    names = [role["name"] for role in DEFAULT_ROLES]
+    projection = {"_id": 0, "name": 1, **{field: 1 for field in ROLE_QUOTA_FIELDS}}
+    existing = {role["name"]: role for role in await db.roles.find({"name": {"$in": names}}, projection).to_list(None)}
+    missing = [role for role in DEFAULT_ROLES if role["name"] not in existing]
+    outdated = [
+        (role["name"], field, role[field])
+        for role in DEFAULT_ROLES if role["name"] in existing
+        for field in ROLE_QUOTA_FIELDS if field in role and field not in existing[role["name"]]
+    ]
+    if not missing and not outdated:
+        return
+    
+    now = datetime.utcnow()
+    # Upserts keyed by name let several workers seed at once without duplicates
+    operations = [
+        UpdateOne(
+            {"name": role["name"]},
+            {"$setOnInsert": {**role, "id": str(uuid.uuid4()), "created_at": now, "created_by": "system"}},
+            upsert=True
+        )
+        for role in missing
+    ]
+    # Conditional on the field still being absent, so concurrent workers set it once
+    operations += [
+        UpdateOne({"name": name, field: {"$exists": False}}, {"$set": {field: value}})
+        for name, field, value in outdated
+    ]
+    try:
+        await db.roles.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Losing the race on the unique name index means the role is there
+        if any(error.get("code") != 11000 for error in bulk_write_errors(e)):
+            raise
+    
+    # The admin account is created together with the super_admin role, as before
+    if "super_admin" in existing:
+        return
+    admin_role = await db.roles.find_one({"name": "super_admin"}, {"_id": 0, "id": 1})
+    if not admin_role or await db.users.find_one({"email": DEFAULT_ADMIN["email"]}, {"_id": 1}):
+        return
+    admin_user = {
+        **DEFAULT_ADMIN,
+        "id": str(uuid.uuid4()),
+        "role_id": admin_role["id"],
+        "hashed_password": await get_password_hash(DEFAULT_ADMIN_PASSWORD),
+        "is_active": True,
+        "created_at": now,
+        "profile_data": {}
+    }
+    try:
+        await db.users.insert_one(with_search_keys(admin_user))
+    except DuplicateKeyError:
+        pass
+
+# Bulk user import
+def _hash_passwords_sync(passwords: List[str]) -> List[str]:
+    context = password_context()
+    return [context.hash(password) for password in passwords]
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """Hash a batch of passwords spread across the bulk hashing process pool"""
+    chunk_size = max(1, -(-len(passwords) // HASH_POOL_SIZE))
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*[
+        loop.run_in_executor(bulk_hash_executor, _hash_passwords_sync, chunk) for chunk in chunks
+    ])
+    return [hashed for chunk in results for hashed in chunk]
+
+def iter_import_rows(stream: TextIO, fmt: str) -> Iterator[Any]:
+    """Lazily read CSV rows (as dicts) or NDJSON lines (parsed per row, so one bad line fails alone)"""
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            # Empty CSV cells mean "not provided"
+            yield {key: value for key, value in row.items() if key and value not in (None, "")}
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                yield line
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+PASSPORT_IMPORT_FIELDS = set(PassportCreate.model_fields)
+
+def build_passport(user_id: str, passport_data: PassportCreate, series: str, number: str) -> Passport:
+    return Passport(
+        user_id=user_id,
+        series=series,
+        number=number,
+        issue_date=datetime.combine(date.today(), datetime.min.time()),
+        issue_place=passport_data.issue_place,
+        first_name=passport_data.first_name,
+        last_name=passport_data.last_name,
+        middle_name=passport_data.middle_name,
+        birth_date=datetime.combine(passport_data.birth_date, datetime.min.time()),
+        birth_place=passport_data.birth_place,
+        gender=passport_data.gender
+    )
+
+def bulk_write_errors(error: BulkWriteError) -> List[dict]:
+    return error.details.get("writeErrors", [])
+
+async def import_user_batch(batch: List[tuple], create_passports: bool, report: ImportReport):
+    """Validate, hash and insert one batch of (row_number, raw_row) pairs"""
+    valid = []
+    for row_number, raw in batch:
+        report.processed += 1
+        try:
+            row = UserImportRow(**(json.loads(raw) if isinstance(raw, str) else raw))
+            role = role_registry.get_by_name(row.role or "citizen")
+            if not role:
+                raise ValueError(f"Unknown role: {row.role}")
+            passport_data = None
+            if create_passports and any(getattr(row, field) for field in PASSPORT_IMPORT_FIELDS):
+                passport_data = PassportCreate(**row.dict(include=PASSPORT_IMPORT_FIELDS))
+        except Exception as e:
+            report.errors.append(ImportRowError(row=row_number, error=str(e)))
+            continue
+        valid.append((row_number, row, role, passport_data))
+    if not valid:
+        return
+    
+    hashed_passwords = await hash_passwords([row.password for _, row, _, _ in valid])
+    users = [
+        User(
+            email=row.email,
+            username=row.username,
+            full_name=row.full_name,
+            role_id=role.id,
+            hashed_password=hashed_password
+        )
+        for (_, row, role, _), hashed_password in zip(valid, hashed_passwords)
+    ]
+    
+    # Unordered insert keeps going past duplicates; each failure is reported against its row
+    failed = set()
+    try:
+        await db.users.insert_many([with_search_keys(user.dict()) for user in users], ordered=False)
+    except BulkWriteError as e:
+        for write_error in bulk_write_errors(e):
+            failed.add(write_error["index"])
+            fields = ", ".join(write_error.get("keyPattern", {}).keys()) or "key"
+            message = f"Duplicate {fields}" if write_error.get("code") == 11000 else write_error.get("errmsg", "Write failed")
+            report.errors.append(ImportRowError(row=valid[write_error["index"]][0], error=message))
+    report.inserted += len(users) - len(failed)
+    
+    passports = []
+    passport_rows = []
+    for index, (user, (row_number, _, _, passport_data)) in enumerate(zip(users, valid)):
+        if passport_data and index not in failed:
+            series, number = await passport_numbers.allocate()
+            passports.append(build_passport(user.id, passport_data, series, number).dict())
+            passport_rows.append(row_number)
+    if not passports:
+        return
+    failed_passports = 0
+    try:
+        await db.passports.insert_many(passports, ordered=False)
+    except BulkWriteError as e:
+        for write_error in bulk_write_errors(e):
+            failed_passports += 1
+            report.errors.append(ImportRowError(
+                row=passport_rows[write_error["index"]],
+                error=f"Passport not created: {write_error.get('errmsg', 'write failed')}"
+            ))
+    report.passports_created += len(passports) - failed_passports
+
+async def import_users(
+    rows: Iterable[Any],
+    create_passports: bool = False,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[ImportReport], Awaitable[None]]] = None
+) -> ImportReport:
+    """Import users batch by batch, holding only one batch in memory"""
+    report = ImportReport()
+    numbered = enumerate(rows, start=1)
+    while True:
+        try:
+            # Rows are read and parsed from the file in a thread
+            batch = await asyncio.to_thread(list, itertools.islice(numbered, batch_size))
+        except (ValueError, csv.Error) as e:
+            # Malformed input stops the import; rows before it are already stored
+            report.errors.append(ImportRowError(row=report.processed + 1, error=f"Unreadable input: {e}"))
+            break
+        if not batch:
+            break
+        await import_user_batch(batch, create_passports, report)
+        if progress is not None:
+            await progress(report)
+    return report
+
+def _copy_to_file(source, path: Path):
+    source.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, UPLOAD_CHUNK_SIZE)
+
+def _open_import_file(path: Path) -> TextIO:
+    return open(path, encoding="utf-8-sig", newline="")
+
+def import_job_report(report: ImportReport) -> dict:
+    return {**report.dict(), "errors": [error.dict() for error in report.errors[:IMPORT_JOB_MAX_ERRORS]]}
+
+async def run_import_job(job: ImportJob, path: Path):
+    """Run a queued import from its spooled file, saving the report on the job after every batch"""
+    async def save_progress(report: ImportReport):
+        await db.import_jobs.update_one(
+            {"id": job.id},
+            {"$set": {"report": import_job_report(report), "updated_at": datetime.utcnow()}}
+        )
+    
+    await db.import_jobs.update_one({"id": job.id}, {"$set": {"status": "running", "updated_at": datetime.utcnow()}})
+    try:
+        stream = await asyncio.to_thread(_open_import_file, path)
+        try:
+            report = await import_users(iter_import_rows(stream, job.format), job.create_passports, progress=save_progress)
+        finally:
+            stream.close()
+        update = {"status": "completed", "report": import_job_report(report)}
+    except Exception as e:
+        logger.exception(f"Import job {job.id} failed")
+        update = {"status": "failed", "error": str(e)}
+    finally:
+        await remove_file(path)
+    await db.import_jobs.update_one({"id": job.id}, {"$set": {**update, "updated_at": datetime.utcnow()}})
+
+# Bulk export
+# Exported fields per dataset with their kind, used for projection, CSV and Parquet schema
+EXPORT_DATASETS = {
+    "users": {
+        "collection": "users",
+        "fields": {
+            "id": "str", "email": "str", "username": "str", "full_name": "str", "role_id": "str",
+            "is_active": "bool", "avatar_url": "str", "created_at": "datetime",
+            "last_login": "datetime", "profile_data": "json",
+        },
+    },
+    "passports": {
+        "collection": "passports",
+        "fields": {
+            "id": "str", "user_id": "str", "series": "str", "number": "str", "issue_date": "datetime",
+            "issue_place": "str", "first_name": "str", "last_name": "str", "middle_name": "str",
+            "birth_date": "datetime", "birth_place": "str", "gender": "str", "photo_document_id": "str",
+            "created_at": "datetime", "updated_at": "datetime",
+        },
+    },
+    "documents": {
+        "collection": "documents",
+        "fields": {
+            "id": "str", "user_id": "str", "type": "str", "filename": "str", "original_name": "str",
+            "file_size": "int", "mime_type": "str", "sha256": "str", "description": "str",
+            "created_at": "datetime",
+        },
+    },
+}
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def export_cursor(dataset: str, role_id: Optional[str], created_from: Optional[datetime], created_to: Optional[datetime]):
+    """Motor cursor over one dataset with projection and optional role/date filters"""
+    spec = EXPORT_DATASETS[dataset]
+    projection = {"_id": 0, **{field: 1 for field in spec["fields"]}}
+    match = {}
+    if created_from or created_to:
+        match["created_at"] = {}
+        if created_from:
+            match["created_at"]["$gte"] = created_from
+        if created_to:
+            match["created_at"]["$lt"] = created_to
+    collection = listing_db[spec["collection"]]
+    
+    if role_id and dataset == "users":
+        match["role_id"] = role_id
+    elif role_id:
+        # Owner's role lives on users; join per record instead of collecting user ids up front
+        pipeline = [
+            {"$match": match},
+            {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "owner"}},
+            {"$match": {"owner.role_id": role_id}},
+            {"$project": projection},
         ]
-        await db.roles.insert_many(default_roles)
-        
-        # Create default admin user
-        admin_role = await db.roles.find_one({"name": "super_admin"})
-        if admin_role:
-            admin_user = {
-                "id": str(uuid.uuid4()),
-                "email": "admin@impnet.ru",
-                "username": "admin",
-                "full_name": "Администратор Системы",
-                "role_id": admin_role["id"],
-                "hashed_password": get_password_hash("admin123"),
-                "is_active": True,
-                "created_at": datetime.utcnow(),
-                "profile_data": {}
-            }
-            await db.users.insert_one(admin_user)
+        return collection.aggregate(pipeline, batchSize=EXPORT_CHUNK_SIZE)
+    return collection.find(match, projection).batch_size(EXPORT_CHUNK_SIZE)
+
+def _export_value(value, kind: str):
+    if value is None:
+        return None
+    if kind == "datetime":
+        return value.isoformat()
+    if kind == "json":
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return value
+
+async def export_chunks(cursor, fields: Dict[str, str]):
+    """Group cursor records into EXPORT_CHUNK_SIZE lists of normalized rows"""
+    chunk = []
+    async for doc in cursor:
+        chunk.append({field: _export_value(doc.get(field), kind) for field, kind in fields.items()})
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Encoders turn each chunk into bytes in a worker thread, so a large export never stalls the loop
+def _ndjson_chunk(chunk: List[dict]) -> bytes:
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk).encode()
+
+async def encode_ndjson(chunks, fields: Dict[str, str]):
+    async for chunk in chunks:
+        yield await asyncio.to_thread(_ndjson_chunk, chunk)
+
+def _csv_chunk(chunk: List[dict], columns: List[str], header: bool) -> bytes:
+    import pandas as pd
+    # object dtype keeps ints as ints when some rows are missing the value
+    frame = pd.DataFrame(chunk, columns=columns, dtype=object)
+    return frame.to_csv(index=False, header=header).encode()
+
+async def encode_csv(chunks, fields: Dict[str, str]):
+    header = True
+    async for chunk in chunks:
+        yield await asyncio.to_thread(_csv_chunk, chunk, list(fields), header)
+        header = False
+    if header:
+        yield (",".join(fields) + "\n").encode()
+
+class _ParquetSink:
+    """Write-only file object whose bytes are drained after each row group"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def _parquet_chunk(writer, sink: _ParquetSink, chunk: List[dict], schema) -> bytes:
+    import pyarrow as pa
+    writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+    return sink.drain()
+
+def _parquet_close(writer, sink: _ParquetSink) -> bytes:
+    writer.close()
+    return sink.drain()
+
+async def encode_parquet(chunks, fields: Dict[str, str]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # Datetimes are exported as ISO strings in every format, so all kinds map to plain types
+    types = {"str": pa.string(), "int": pa.int64(), "bool": pa.bool_(), "datetime": pa.string(), "json": pa.string()}
+    schema = pa.schema([(field, types[kind]) for field, kind in fields.items()])
+    sink = _ParquetSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    async for chunk in chunks:
+        yield await asyncio.to_thread(_parquet_chunk, writer, sink, chunk, schema)
+    yield await asyncio.to_thread(_parquet_close, writer, sink)
+
+EXPORT_ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv, "parquet": encode_parquet}
 
 # Routes
 @api_router.post("/auth/register", response_model=Token)
-async def register(user_data: UserCreate):
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    existing_username = await db.users.find_one({"username": user_data.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
+async def register(user_data: UserCreate, request: Request):
     # Get default citizen role if no role specified
     if not user_data.role_id:
-        citizen_role = await db.roles.find_one({"name": "citizen"})
+        citizen_role = role_registry.get_by_name("citizen")
         if not citizen_role:
             raise HTTPException(status_code=500, detail="Default role not found")
-        user_data.role_id = citizen_role["id"]
+        user_data.role_id = citizen_role.id
     
     # Create user
     user = User(
@@ -347,10 +2245,16 @@ async def register(user_data: UserCreate):
         username=user_data.username,
         full_name=user_data.full_name,
         role_id=user_data.role_id,
-        hashed_password=get_password_hash(user_data.password)
+        hashed_password=await get_password_hash(user_data.password)
     )
     
-    await db.users.insert_one(user.dict())
+    # Unique indexes on email and username reject duplicates atomically
+    try:
+        await db.users.insert_one(with_search_keys(user.dict()))
+    except DuplicateKeyError as e:
+        if "username" in duplicate_key_fields(e):
+            raise HTTPException(status_code=400, detail="Username already taken")
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -358,13 +2262,17 @@ async def register(user_data: UserCreate):
         data={"sub": user.email}, expires_delta=access_token_expires
     )
     
+    refresh_token = await create_session(user.dict(), request.headers.get("user-agent"))
     user_response = UserResponse(**user.dict())
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(access_token=access_token, token_type="bearer", user=user_response, refresh_token=refresh_token)
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(user_data: UserLogin):
+async def login(user_data: UserLogin, request: Request):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["hashed_password"]):
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await verify_and_update_password(user_data.password, user["hashed_password"])
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -374,34 +2282,77 @@ async def login(user_data: UserLogin):
     if not user["is_active"]:
         raise HTTPException(status_code=400, detail="Inactive user")
     
-    # Update last login
-    await db.users.update_one(
-        {"id": user["id"]},
-        {"$set": {"last_login": datetime.utcnow()}}
-    )
+    # Update last login behind the response, upgrading the stored hash in the same write if its cost changed
+    login_update = {"last_login": datetime.utcnow()}
+    if new_hash:
+        login_update["hashed_password"] = new_hash
+    await write_behind.update_user(user["id"], user["email"], login_update)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["email"]}, expires_delta=access_token_expires
     )
     
+    refresh_token = await create_session(user, request.headers.get("user-agent"))
     user_response = UserResponse(**user)
-    return Token(access_token=access_token, token_type="bearer", user=user_response)
+    return Token(access_token=access_token, token_type="bearer", user=user_response, refresh_token=refresh_token)
+
+@api_router.post("/auth/refresh", response_model=Token)
+async def refresh_access_token(refresh_data: RefreshRequest):
+    """Exchange a refresh token for a new access token and a rotated refresh token, without bcrypt"""
+    session, refresh_token = await rotate_session(refresh_data.refresh_token)
+    principal = principal_cache.get(session["email"])
+    if principal is None:
+        principal = await load_principal(session["email"])
+        if principal is not None:
+            principal_cache.put(session["email"], principal)
+    if principal is None or not principal.user.is_active:
+        await revoke_sessions({"id": session["id"]})
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    
+    access_token = create_access_token(
+        data={"sub": session["email"]}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    user_response = UserResponse(**principal.user.dict())
+    return Token(access_token=access_token, token_type="bearer", user=user_response, refresh_token=refresh_token)
+
+@api_router.post("/auth/logout")
+async def logout(refresh_data: RefreshRequest):
+    """Revoke the session behind a refresh token; the access token lapses on its own"""
+    await revoke_sessions({"token_hash": hash_refresh_token(refresh_data.refresh_token)})
+    return {"message": "Logged out"}
+
+@api_router.get("/auth/sessions", response_model=List[SessionResponse])
+async def get_sessions(current_user: User = Depends(get_current_active_user)):
+    sessions = await db.sessions.find(
+        {"user_id": current_user.id, "revoked_at": None, "expires_at": {"$gt": datetime.utcnow()}},
+        projection_for(SessionResponse)
+    ).to_list(None)
+    return [SessionResponse(**session) for session in sessions]
+
+@api_router.delete("/auth/sessions")
+async def revoke_all_sessions(current_user: User = Depends(get_current_active_user)):
+    revoked = await revoke_sessions({"user_id": current_user.id})
+    return {"message": f"Revoked {revoked} sessions"}
+
+@api_router.delete("/auth/sessions/{session_id}")
+async def revoke_session(session_id: str, current_user: User = Depends(get_current_active_user)):
+    if not await revoke_sessions({"id": session_id, "user_id": current_user.id}):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session revoked"}
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
-    return UserResponse(**current_user.dict())
+    return user_serializer.response(current_user.dict())
 
 @api_router.get("/roles", response_model=List[Role])
 async def get_roles(current_user: User = Depends(get_current_active_user)):
-    roles = await db.roles.find().to_list(1000)
-    return [Role(**role) for role in roles]
+    return role_registry.all()
 
 @api_router.post("/roles", response_model=Role)
 async def create_role(role_data: RoleCreate, current_user: User = Depends(get_admin_user)):
     # Check if role name already exists
-    existing_role = await db.roles.find_one({"name": role_data.name})
-    if existing_role:
+    if role_registry.get_by_name(role_data.name):
         raise HTTPException(status_code=400, detail="Role name already exists")
     
     role = Role(
@@ -409,31 +2360,265 @@ async def create_role(role_data: RoleCreate, current_user: User = Depends(get_ad
         display_name=role_data.display_name,
         description=role_data.description,
         permissions=role_data.permissions,
+        storage_quota_bytes=role_data.storage_quota_bytes,
+        document_quota=role_data.document_quota,
         created_by=current_user.id
     )
     
-    await db.roles.insert_one(role.dict())
+    try:
+        await db.roles.insert_one(role.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Role name already exists")
+    await role_registry.refresh()
     return role
 
 @api_router.get("/users", response_model=List[UserResponse])
-async def get_users(current_user: User = Depends(get_admin_user)):
-    users = await db.users.find().to_list(1000)
-    return [UserResponse(**user) for user in users]
+async def get_users(
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: User = Depends(get_admin_user)
+):
+    projection = projection_for(UserResponse)
+    if stream:
+        return stream_ndjson(listing_db.users, {}, projection, after, limit, user_serializer)
+    
+    users, next_cursor = await fetch_page(listing_db.users, {}, projection, after, limit or DEFAULT_PAGE_SIZE)
+    return user_serializer.page(users, next_cursor)
 
-# Document endpoints
-@api_router.post("/documents/upload", response_model=DocumentResponse)
-async def upload_document(
+@api_router.get("/citizens/search", response_model=List[CitizenSearchResult])
+async def search_citizens(
+    q: Optional[str] = None,
+    field: Optional[str] = None,
+    series: Optional[str] = None,
+    number: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_search_user)
+):
+    """Find citizens by name, email or username prefix, or exactly by passport series and number.
+
+    Matching is case-insensitive against normalized keys; a name prefix may start
+    at any word of the full name. Only users with the citizen role are returned;
+    staff accounts never are. Each result carries its passport, joined in the
+    same aggregation.
+    """
+    citizen_role = role_registry.get_by_name("citizen")
+    if not citizen_role:
+        raise HTTPException(status_code=500, detail="Default role not found")
+    passport_fields = {name: 1 for name in PassportSummary.model_fields}
+    user_fields = projection_for(UserResponse)
+    if series or number:
+        if not (series and number):
+            raise HTTPException(status_code=400, detail="Passport search needs both series and number")
+        # Unique series+number index: at most one passport
+        pipeline = [
+            {"$match": {"series": series.strip(), "number": number.strip()}},
+            {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+            {"$unwind": "$user"},
+            {"$match": {"user.role_id": citizen_role.id}},
+        ]
+        results = []
+        async for passport in listing_db.passports.aggregate(pipeline):
+            user = {name: passport["user"].get(name) for name in user_fields}
+            user["passport"] = {name: passport.get(name) for name in passport_fields}
+            results.append(user)
+        return citizen_serializer.page(results, None)
+    
+    prefix = normalize_search_text(q or "")
+    if len(prefix) < SEARCH_MIN_PREFIX:
+        raise HTTPException(status_code=400, detail=f"Search needs at least {SEARCH_MIN_PREFIX} characters")
+    field = field or ("email" if "@" in prefix else "name")
+    if field not in SEARCH_FIELDS:
+        raise HTTPException(status_code=400, detail="Field must be name, email or username")
+    
+    if field == "name":
+        # Array sort keys don't follow the matched token, so names page by _id alone; the
+        # planner picks the token range for rare prefixes and an _id scan for common ones
+        key = "search.name_tokens"
+        # $elemMatch makes one token satisfy both bounds and keeps the index range tight
+        match = {key: {"$elemMatch": {"$gte": prefix, "$lt": prefix + "\U0010ffff"}}}
+        if after:
+            _, after_id = decode_search_cursor(after)
+            match["_id"] = {"$gt": after_id}
+        sort = {"_id": 1}
+    else:
+        # A prefix is a range on the normalized key, so the (key, _id) index serves both match and order
+        key = f"search.{field}"
+        match = {key: {"$gte": prefix, "$lt": prefix + "\U0010ffff"}}
+        if after:
+            after_key, after_id = decode_search_cursor(after)
+            match = {"$and": [match, {"$or": [{key: {"$gt": after_key}}, {key: after_key, "_id": {"$gt": after_id}}]}]}
+        sort = {key: 1, "_id": 1}
+    # Staff are a handful of accounts, so filtering them out of the index range costs next to nothing
+    match["role_id"] = citizen_role.id
+    pipeline = [
+        {"$match": match},
+        {"$sort": sort},
+        {"$limit": limit + 1},
+        {"$lookup": {"from": "passports", "localField": "id", "foreignField": "user_id", "as": "passport"}},
+        {"$unwind": {"path": "$passport", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            **user_fields,
+            key: 1,
+            **{f"passport.{name}": 1 for name in passport_fields},
+        }},
+    ]
+    users = await listing_db.users.aggregate(pipeline).to_list(limit + 1)
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_search_cursor(None if field == "name" else last["search"][field], last["_id"])
+    return citizen_serializer.page(users, next_cursor)
+
+@api_router.post("/users/import", response_model=ImportJob, status_code=status.HTTP_202_ACCEPTED)
+async def import_users_endpoint(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    document_type: str = Form(...),
-    description: Optional[str] = Form(None),
-    current_user: User = Depends(get_current_active_user)
+    format: Optional[str] = Form(None),
+    create_passports: bool = Form(False),
+    current_user: User = Depends(get_admin_user)
+):
+    """Queue bulk onboarding from a CSV or NDJSON file; poll GET /users/import/{job_id} for the report"""
+    fmt = format or ("ndjson" if file.filename.lower().endswith((".ndjson", ".jsonl")) else "csv")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    job = ImportJob(format=fmt, create_passports=create_passports, created_by=current_user.id)
+    # The request's spool file is closed with the response, so the job reads its own copy
+    path = UPLOAD_TMP_DIR / f"import-{job.id}.{fmt}"
+    await asyncio.to_thread(_copy_to_file, file.file, path)
+    await db.import_jobs.insert_one(job.dict())
+    background_tasks.add_task(run_import_job, job, path)
+    return job
+
+@api_router.get("/users/import/{job_id}", response_model=ImportJob)
+async def get_import_job(job_id: str, current_user: User = Depends(get_admin_user)):
+    job = await db.import_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return ImportJob(**job)
+
+@api_router.patch("/users/{user_id}", response_model=UserResponse)
+async def update_user(user_id: str, user_data: UserUpdate, current_user: User = Depends(get_admin_user)):
+    update_data = {k: v for k, v in user_data.dict().items() if v is not None}
+    if "role_id" in update_data and not role_registry.get(update_data["role_id"]):
+        raise HTTPException(status_code=400, detail="Role not found")
+    
+    if update_data:
+        await db.users.update_one({"id": user_id}, {"$set": update_data})
+    user = await db.users.find_one({"id": user_id})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Deactivation and role changes must take effect on the very next request
+    principal_cache.invalidate_user_id(user_id)
+    if update_data.get("is_active") is False:
+        await revoke_sessions({"user_id": user_id})
+    return UserResponse(**user)
+
+@api_router.get("/admin/export/{dataset}")
+async def export_dataset(
+    dataset: str,
+    format: str = "ndjson",
+    role: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    current_user: User = Depends(get_admin_user)
 ):
-    # Validate file size (max 10MB)
-    if file.size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File size too large (max 10MB)")
+    """Stream a whole collection as NDJSON, CSV or Parquet with constant memory"""
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail="Unknown dataset")
+    if format not in EXPORT_ENCODERS:
+        raise HTTPException(status_code=400, detail="Format must be ndjson, csv or parquet")
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    role_id = None
+    if role:
+        role_obj = role_registry.get_by_name(role)
+        if not role_obj:
+            raise HTTPException(status_code=400, detail="Role not found")
+        role_id = role_obj.id
     
+    fields = EXPORT_DATASETS[dataset]["fields"]
+    cursor = export_cursor(dataset, role_id, created_from, created_to)
+    # StreamingResponse awaits each send, so a slow client pauses the cursor instead of buffering
+    body = EXPORT_ENCODERS[format](export_chunks(cursor, fields), fields)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{format}"'}
+    )
+
+@api_router.get("/admin/indexes")
+async def get_index_report(current_user: User = Depends(get_admin_user)):
+    return await index_report()
+
+@api_router.get("/admin/storage/gc")
+async def get_storage_gc_report(current_user: User = Depends(get_admin_user)):
+    """Pending deletions and the last reconciliation report"""
+    state = await db.gc_state.find_one({"_id": "reconcile"}) or {}
+    return {
+        "pending_tombstones": await db.tombstones.count_documents({}),
+        "last_reconcile": state.get("report"),
+    }
+
+@api_router.post("/admin/storage/gc")
+async def run_storage_gc(background_tasks: BackgroundTasks, current_user: User = Depends(get_admin_user)):
+    """Start a reconciliation pass now; its report shows up in GET /admin/storage/gc"""
+    background_tasks.add_task(storage_collector.reconcile)
+    return {"message": "Reconciliation started"}
+
+@api_router.get("/admin/usage/top", response_model=List[UsageResponse])
+async def get_top_consumers(
+    by: str = "bytes",
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_admin_user)
+):
+    """Users storing the most, read off the usage counter indexes"""
+    if by not in ("bytes", "objects"):
+        raise HTTPException(status_code=400, detail="Sort must be bytes or objects")
+    counters = await listing_db.usage.find({}).sort(by, DESCENDING).limit(limit).to_list(limit)
+    users = {
+        user["id"]: user for user in await listing_db.users.find(
+            {"id": {"$in": [counter["_id"] for counter in counters]}},
+            {"_id": 0, "id": 1, "email": 1, "username": 1, "full_name": 1, "role_id": 1},
+        ).to_list(None)
+    }
+    report = []
+    for counter in counters:
+        user = users.get(counter["_id"], {})
+        bytes_quota, document_quota = usage_quota(user.get("role_id"))
+        report.append(UsageResponse(
+            user_id=counter["_id"],
+            email=user.get("email"),
+            username=user.get("username"),
+            full_name=user.get("full_name"),
+            bytes=counter.get("bytes", 0),
+            objects=counter.get("objects", 0),
+            storage_quota_bytes=bytes_quota,
+            document_quota=document_quota,
+        ))
+    return report
+
+@api_router.post("/admin/usage/backfill")
+async def run_usage_backfill(current_user: User = Depends(get_admin_user)):
+    """Rebuild all usage counters from the documents collection"""
+    return await backfill_usage()
+
+@api_router.get("/auth/cache-stats")
+async def get_auth_cache_stats(current_user: User = Depends(get_admin_user)):
+    return principal_cache.stats()
+
+# Document endpoints
+async def store_document(file: UploadFile, document_type: str, description: Optional[str], current_user: User) -> Document:
+    """Store an upload and create its document record"""
     # Save file
-    file_path = await save_uploaded_file(file, current_user.id)
+    stored = await save_uploaded_file(file)
+    file_path = stored.file_path
     
     # Create document record
     document = Document(
@@ -442,134 +2627,244 @@ async def upload_document(
         filename=file_path.split('/')[-1],
         original_name=file.filename,
         file_path=file_path,
-        file_size=file.size,
+        file_size=stored.file_size,
         mime_type=file.content_type,
-        description=description
+        description=description,
+        sha256=stored.sha256,
+        blob_id=stored.sha256,
+        thumbnail_path=stored.derivatives.get("thumbnail"),
+        passport_photo_path=stored.derivatives.get("passport_photo"),
+        url=upload_url(file_path)
     )
+    if document.thumbnail_path:
+        document.thumbnail_url = upload_url(document.thumbnail_path)
     
     await db.documents.insert_one(document.dict())
+    return document
+
+@api_router.post("/documents/upload", response_model=DocumentResponse)
+async def upload_document(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    document_type: str = Form(...),
+    description: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_active_user)
+):
+    # Oversize requests are already refused by admission control on Content-Length;
+    # this catches a declared part size, and the limit is enforced while streaming too
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File size too large (max 10MB)")
     
-    # Create response
-    response = DocumentResponse(
-        **document.dict(),
-        url=f"/uploads/{file_path.split('uploads/')[-1]}"
-    )
+    # Quota is charged before anything is stored; an undeclared size reserves the limit and is settled below
+    reserved = file.size if file.size is not None else MAX_UPLOAD_SIZE
+    await reserve_usage(current_user, reserved)
+    try:
+        document = await store_document(file, document_type, description, current_user)
+    except BaseException:
+        await record_usage(current_user.id, -reserved, -1)
+        raise
+    if document.file_size != reserved:
+        await record_usage(current_user.id, document.file_size - reserved, 0)
     
-    return response
+    # Render thumbnails after the response is sent, unless this content already has them
+    if is_image_file(file.filename) and not document.thumbnail_path:
+        background_tasks.add_task(generate_image_derivatives, document.blob_id, document.file_path)
+    
+    return document_response(document.dict(), current_user.id)
+
+@api_router.get("/documents/usage", response_model=UsageResponse)
+async def get_my_usage(current_user: User = Depends(get_current_active_user)):
+    counter = await db.usage.find_one({"_id": current_user.id}) or {}
+    bytes_quota, document_quota = usage_quota(current_user.role_id)
+    return UsageResponse(
+        user_id=current_user.id,
+        email=current_user.email,
+        username=current_user.username,
+        full_name=current_user.full_name,
+        bytes=counter.get("bytes", 0),
+        objects=counter.get("objects", 0),
+        storage_quota_bytes=bytes_quota,
+        document_quota=document_quota,
+    )
 
 @api_router.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(current_user: User = Depends(get_current_active_user)):
-    documents = await db.documents.find({"user_id": current_user.id}).to_list(1000)
+async def get_documents(
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False,
+    current_user: User = Depends(get_current_active_user)
+):
+    query = {"user_id": current_user.id}
+    projection = {**projection_for(DocumentResponse), "file_path": 1, "thumbnail_path": 1}
+    if stream:
+        prepare = functools.partial(with_document_urls, user_id=current_user.id)
+        return stream_ndjson(listing_db.documents, query, projection, after, limit, document_serializer, prepare)
     
-    responses = []
+    documents, next_cursor = await fetch_page(listing_db.documents, query, projection, after, limit or DEFAULT_PAGE_SIZE)
     for doc in documents:
-        doc_response = DocumentResponse(
-            **doc,
-            url=f"/uploads/{doc['file_path'].split('uploads/')[-1]}"
-        )
-        responses.append(doc_response)
-    
-    return responses
+        with_document_urls(doc, current_user.id)
+    return document_serializer.page(documents, next_cursor)
 
 @api_router.delete("/documents/{document_id}")
 async def delete_document(document_id: str, current_user: User = Depends(get_current_active_user)):
-    # Find document
     document = await db.documents.find_one({"id": document_id, "user_id": current_user.id})
-    if not document:
+    # Files are released by the reaper; the request only swaps the record for a tombstone
+    if not document or not await tombstone_document(document):
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete file
-    file_path = ROOT_DIR / document["file_path"]
-    if file_path.exists():
-        file_path.unlink()
+    # A deleted photo no longer shows on the passport
+    await db.passports.update_one(
+        {"user_id": current_user.id, "photo_document_id": document_id},
+        {"$unset": {"photo_document_id": "", "photo_path": ""}}
+    )
     
-    # Delete from database
-    await db.documents.delete_one({"id": document_id})
+    for path_field in DOCUMENT_PATH_FIELDS:
+        if document.get(path_field):
+            file_access_cache.invalidate((current_user.id, document[path_field]))
+    storage_collector.wake()
     
     return {"message": "Document deleted successfully"}
 
+@api_router.get("/files/{file_path:path}")
+async def download_file(
+    file_path: str,
+    request: Request,
+    uid: Optional[str] = None,
+    expires: Optional[int] = None,
+    signature: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Serve an uploaded file or derivative to its owner, with conditional and range requests.
+
+    Accepts either a bearer token or the signed query from sign_file_url.
+    """
+    stored_path = f"uploads/{file_path}"
+    if signature:
+        if not uid or expires is None or not verify_file_url(upload_url(stored_path), uid, expires, signature):
+            raise HTTPException(status_code=403, detail="Invalid or expired file link")
+        # A link outlives its page; it stops working once the owner is deactivated
+        principal = await file_link_principal(uid)
+        if principal is None or not principal.user.is_active:
+            raise HTTPException(status_code=403, detail="Invalid or expired file link")
+        user_id = uid
+    else:
+        principal = await authenticate_token(credentials.credentials if credentials else None)
+        if not principal.user.is_active:
+            raise HTTPException(status_code=400, detail="Inactive user")
+        user_id = principal.user.id
+    access_key = (user_id, stored_path)
+    media_type = file_access_cache.get(access_key)
+    if media_type is None:
+        document = await db.documents.find_one(
+            {
+                "user_id": user_id,
+                "$or": [
+                    {"file_path": stored_path},
+                    {"thumbnail_path": stored_path},
+                    {"passport_photo_path": stored_path},
+                ],
+            },
+            {"file_path": 1, "mime_type": 1},
+        )
+        if not document:
+            raise HTTPException(status_code=404, detail="File not found")
+        # Derivatives are always WebP
+        media_type = document["mime_type"] if document["file_path"] == stored_path else "image/webp"
+        file_access_cache.put(access_key, media_type)
+    
+    # Stored file names are unique and never rewritten, so the name is a strong validator
+    headers = {
+        "ETag": f'"{Path(file_path).name}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": (
+            "private, max-age=31536000, immutable"
+            if file_path.startswith("blobs/") else "private, max-age=3600"
+        ),
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or headers["ETag"] in if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    # Object stores hand out a short-lived URL so the bytes never pass through the API
+    presigned_url = await file_storage.presigned_url(stored_path, media_type)
+    if presigned_url:
+        return RedirectResponse(
+            presigned_url,
+            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+            headers={"Cache-Control": f"private, max-age={max(S3_PRESIGN_EXPIRES - 60, 0)}"}
+        )
+    return await file_storage.serve(stored_path, request.headers.get("range"), media_type, headers)
+
 # Passport endpoints
 @api_router.post("/passport", response_model=PassportResponse)
 async def create_passport(
     passport_data: PassportCreate,
     current_user: User = Depends(get_current_active_user)
 ):
-    # Check if user already has a passport
-    existing_passport = await db.passports.find_one({"user_id": current_user.id})
-    if existing_passport:
-        raise HTTPException(status_code=400, detail="User already has a passport")
-    
-    # Generate passport series and number
-    series, number = generate_passport_number()
+    passport = build_passport(current_user.id, passport_data, series="", number="")
     
-    # Create passport
-    passport = Passport(
-        user_id=current_user.id,
-        series=series,
-        number=number,
-        issue_date=datetime.combine(date.today(), datetime.min.time()),
-        issue_place=passport_data.issue_place,
-        first_name=passport_data.first_name,
-        last_name=passport_data.last_name,
-        middle_name=passport_data.middle_name,
-        birth_date=datetime.combine(passport_data.birth_date, datetime.min.time()),
-        birth_place=passport_data.birth_place,
-        gender=passport_data.gender
-    )
-    
-    await db.passports.insert_one(passport.dict())
+    # Unique indexes on user_id and series+number reject duplicates atomically.
+    # Only a clash on series+number is retried: it can only be a legacy random number
+    for attempt in range(PASSPORT_NUMBER_ATTEMPTS):
+        passport.series, passport.number = await passport_numbers.allocate()
+        try:
+            await db.passports.insert_one(passport.dict())
+            break
+        except DuplicateKeyError as e:
+            fields = duplicate_key_fields(e)
+            if "user_id" in fields:
+                raise HTTPException(status_code=400, detail="User already has a passport")
+            if sorted(fields) != ["number", "series"]:
+                raise
+            logger.warning(f"Passport number {passport.series} {passport.number} is held by a legacy passport, allocating another")
+    else:
+        raise HTTPException(status_code=503, detail="Could not allocate passport number")
     
     # Create response
     response = PassportResponse(**passport.dict())
     return response
 
+async def passport_response(passport: dict) -> PassportResponse:
+    response = PassportResponse(**passport)
+    photo_path = passport.get("photo_path")
+    if passport.get("photo_document_id") and not photo_path:
+        # Passports written before photo_path was denormalized: look it up once and store it
+        photo_doc = await db.documents.find_one({"id": passport["photo_document_id"]})
+        if photo_doc:
+            photo_path = passport_photo_path(photo_doc)
+            await db.passports.update_one({"id": passport["id"]}, {"$set": {"photo_path": photo_path}})
+    if photo_path:
+        response.photo_url = sign_file_url(upload_url(photo_path), passport["user_id"])
+    return response
+
 @api_router.get("/passport", response_model=PassportResponse)
 async def get_passport(current_user: User = Depends(get_current_active_user)):
     passport = await db.passports.find_one({"user_id": current_user.id})
     if not passport:
         raise HTTPException(status_code=404, detail="Passport not found")
     
-    response = PassportResponse(**passport)
-    
-    # Add photo URL if exists
-    if passport.get("photo_document_id"):
-        photo_doc = await db.documents.find_one({"id": passport["photo_document_id"]})
-        if photo_doc:
-            response.photo_url = f"/uploads/{photo_doc['file_path'].split('uploads/')[-1]}"
-    
-    return response
+    return passport_serializer.response(await passport_response(passport))
 
 @api_router.put("/passport", response_model=PassportResponse)
 async def update_passport(
     passport_data: PassportCreate,
     current_user: User = Depends(get_current_active_user)
 ):
-    # Find existing passport
-    existing_passport = await db.passports.find_one({"user_id": current_user.id})
-    if not existing_passport:
-        raise HTTPException(status_code=404, detail="Passport not found")
-    
     # Update passport data
     update_data = passport_data.dict()
     update_data["updated_at"] = datetime.utcnow()
     update_data["birth_date"] = datetime.combine(passport_data.birth_date, datetime.min.time())
     
-    await db.passports.update_one(
+    # Update and read back in one round trip
+    updated_passport = await db.passports.find_one_and_update(
         {"user_id": current_user.id},
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_passport:
+        raise HTTPException(status_code=404, detail="Passport not found")
     
-    # Get updated passport
-    updated_passport = await db.passports.find_one({"user_id": current_user.id})
-    response = PassportResponse(**updated_passport)
-    
-    # Add photo URL if exists
-    if updated_passport.get("photo_document_id"):
-        photo_doc = await db.documents.find_one({"id": updated_passport["photo_document_id"]})
-        if photo_doc:
-            response.photo_url = f"/uploads/{photo_doc['file_path'].split('uploads/')[-1]}"
-    
-    return response
+    return await passport_response(updated_passport)
 
 @api_router.post("/passport/photo")
 async def set_passport_photo(
@@ -585,10 +2880,14 @@ async def set_passport_photo(
     if not is_image_file(document["filename"]):
         raise HTTPException(status_code=400, detail="Document must be an image")
     
-    # Update passport with photo
+    # Update passport with photo, denormalizing its path so reads need no documents lookup
     await db.passports.update_one(
         {"user_id": current_user.id},
-        {"$set": {"photo_document_id": document_id, "updated_at": datetime.utcnow()}}
+        {"$set": {
+            "photo_document_id": document_id,
+            "photo_path": passport_photo_path(document),
+            "updated_at": datetime.utcnow()
+        }}
     )
     
     return {"message": "Passport photo updated successfully"}
@@ -601,32 +2900,89 @@ async def root():
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    _ = await db.status_checks.insert_one(status_obj.dict())
+    await write_behind.add_status_check(status_obj.dict())
     return status_obj
 
 @api_router.post("/reset-database")
-async def reset_database():
-    """Reset database - only for development"""
-    await db.users.drop()
-    await db.roles.drop()
+async def reset_database(admin_user: User = Depends(get_admin_user)):
+    """Reset database - only for development, when ALLOW_DATABASE_RESET is set"""
+    if not ALLOW_DATABASE_RESET:
+        raise HTTPException(status_code=403, detail="Database reset is disabled")
+    for collection in ("users", "roles", "sessions", "documents", "passports", "blobs", "tombstones", "usage", "import_jobs"):
+        await db[collection].drop()
+    principal_cache.clear()
+    file_access_cache.clear()
+    # Stored files are left to scheduled reconciliation, which spares anything younger than GC_MIN_AGE_SECONDS
+    # Dropping a collection drops its indexes too
+    await ensure_indexes()
     await init_default_roles()
+    await role_registry.refresh()
     return {"message": "Database reset successfully"}
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+async def get_status_checks(
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+):
+    projection = projection_for(StatusCheck)
+    if stream:
+        return stream_ndjson(listing_db.status_checks, {}, projection, after, limit, status_check_serializer)
+    
+    status_checks, next_cursor = await fetch_page(listing_db.status_checks, {}, projection, after, limit or DEFAULT_PAGE_SIZE)
+    return status_check_serializer.page(status_checks, next_cursor)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def cache_metrics() -> List[str]:
+    lines = []
+    for name, cache in (("principal", principal_cache), ("file_access", file_access_cache)):
+        stats = cache.stats()
+        for key in ("hits", "misses", "evictions"):
+            lines.append(f'impnet_cache_{key}_total{{cache="{name}"}} {stats[key]}')
+        lines.append(f'impnet_cache_size{{cache="{name}"}} {stats["size"]}')
+    lines.append(f"impnet_bcrypt_jobs_pending {hash_jobs_pending}")
+    lines.append(f"impnet_write_behind_pending {write_behind.pending()}")
+    return lines + mongo_pool.render() + admission_control.render()
+
+metrics.registry.add_collector(cache_metrics)
+
+@app.get("/ready", include_in_schema=False)
+async def readiness():
+    """Readiness probe: MongoDB answers a ping and the connection pool has room"""
+    pool = mongo_pool.snapshot(MONGO_MAX_POOL_SIZE)
+    report = {"status": "ready", "mongo": "ok", "ping_ms": None, "pool": pool}
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), READINESS_PING_TIMEOUT)
+        report["ping_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    except Exception as e:
+        report["mongo"] = f"unavailable: {type(e).__name__}"
+        report["status"] = "unavailable"
+    # Every connection busy with callers queued behind them: route traffic elsewhere
+    if pool["saturation"] >= 1 and pool["waiting"]:
+        report["status"] = "saturated"
+    status_code = 200 if report["status"] == "ready" else 503
+    return ORJSONResponse(report, status_code=status_code)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so shed requests still get CORS headers and show up in metrics
+app.add_middleware(admission.AdmissionMiddleware, controller=admission_control)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "Server-Timing"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Configure logging
 logging.basicConfig(
@@ -637,9 +2993,26 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    await init_default_roles()
-    logger.info("Default roles initialized")
+    connect_db()
+    init_storage()
+    init_admission()
+    init_executors()
+    if SKIP_BOOTSTRAP:
+        logger.info("Skipping index creation and seeding (SKIP_BOOTSTRAP)")
+    else:
+        await ensure_indexes()
+        await init_default_roles()
+        logger.info("Default roles initialized")
+    await role_registry.refresh()
+    role_registry.start(ROLE_REFRESH_MODE, ROLE_REFRESH_INTERVAL)
+    write_behind.start()
+    storage_collector.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await role_registry.stop()
+    await write_behind.stop()
+    await storage_collector.stop()
+    if client is not None:
+        client.close()
+    shutdown_executors()
\ No newline at end of file
@@ -0,0 +1,303 @@
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+
+
+def parse_byte_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """Parse a single "bytes=" range into inclusive (start, end); None means serve the whole file"""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # Suffix range: last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """206 response streaming one byte range of a file"""
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, size: int, media_type: str, headers: Dict[str, str]):
+        super().__init__(status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async with aiofiles.open(self.path, 'rb') as f:
+            await f.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def remove_file(file_path: Path):
+    try:
+        await aiofiles.os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+# (key, size in bytes, modification time as a UNIX timestamp)
+StoredObject = Tuple[str, int, float]
+
+
+class LocalStorage:
+    """Stored files on the API host's disk; keys are paths relative to `root`"""
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    async def put_file(self, source: Path, key: str, content_type: Optional[str] = None):
+        """Move a finished local file under `key`; the rename is atomic, readers never see partial bytes"""
+        target = self.path(key)
+        await aiofiles.os.makedirs(target.parent, exist_ok=True)
+        await aiofiles.os.replace(source, target)
+
+    async def delete(self, key: str):
+        await remove_file(self.path(key))
+
+    async def delete_many(self, keys: Iterable[str]):
+        for key in keys:
+            await self.delete(key)
+
+    def _list_pages(self, prefix: str, page_size: int, exclude: Tuple[str, ...]) -> Iterator[List[StoredObject]]:
+        page = []
+        pending = [self.path(prefix)]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                key = Path(entry.path).relative_to(self.root).as_posix()
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not f"{key}/".startswith(exclude):
+                            pending.append(entry.path)
+                        continue
+                    stat_result = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if key.startswith(exclude):
+                    continue
+                page.append((key, stat_result.st_size, stat_result.st_mtime))
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def list_pages(self, prefix: str, page_size: int, exclude: Iterable[str] = ()) -> AsyncIterator[List[StoredObject]]:
+        """Stored objects under `prefix`, a page at a time, skipping keys under `exclude` prefixes.
+
+        The directory walk runs in worker threads and never descends into excluded directories.
+        """
+        return iterate_in_threadpool(self._list_pages(prefix, page_size, tuple(exclude)))
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        yield self.path(key)
+
+    async def presigned_url(self, key: str, media_type: str) -> Optional[str]:
+        return None
+
+    async def serve(self, key: str, range_header: Optional[str], media_type: str, headers: Dict[str, str]) -> Response:
+        full_path = self.path(key)
+        try:
+            stat_result = await aiofiles.os.stat(full_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        byte_range = parse_byte_range(range_header, stat_result.st_size)
+        if byte_range:
+            start, end = byte_range
+            return FileRangeResponse(full_path, start, end, stat_result.st_size, media_type, headers)
+        # FileResponse hands the path to the server (pathsend) for zero-copy delivery when supported
+        return FileResponse(full_path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+class S3Storage:
+    """Stored files in an S3-compatible bucket (AWS, MinIO, moto); keys are object keys under `prefix`.
+
+    boto3 is blocking, so every call runs in a worker thread. Uploads above the
+    multipart threshold are split into parts sent concurrently by boto3's
+    transfer manager; downloads are either redirected to a presigned URL or
+    streamed through in chunks.
+    """
+    name = "s3"
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        bucket: str,
+        tmp_dir: Path,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunk_size: int = 8 * 1024 * 1024,
+        max_concurrency: int = 8,
+        presign_expires: int = 300,
+        presigned_downloads: bool = True,
+    ):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.tmp_dir = Path(tmp_dir)
+        self.prefix = prefix
+        self.presign_expires = presign_expires
+        self.presigned_downloads = presigned_downloads
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            # Room for every concurrent part upload plus request traffic
+            config=Config(max_pool_connections=max(10, max_concurrency * 2)),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunk_size,
+            max_concurrency=max_concurrency,
+            use_threads=True,
+        )
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _is_missing(self, error) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    async def put_file(self, source: Path, key: str, content_type: Optional[str] = None):
+        extra_args = {"ContentType": content_type} if content_type else None
+        try:
+            await asyncio.to_thread(
+                self.client.upload_file, str(source), self.bucket, self.object_key(key),
+                ExtraArgs=extra_args, Config=self.transfer_config,
+            )
+        finally:
+            await remove_file(source)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+    async def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        # DeleteObjects takes up to 1000 keys per request
+        for start in range(0, len(keys), 1000):
+            objects = [{"Key": self.object_key(key)} for key in keys[start:start + 1000]]
+            await asyncio.to_thread(
+                self.client.delete_objects, Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True}
+            )
+
+    def _list_pages(self, prefix: str, page_size: int, exclude: Tuple[str, ...]) -> Iterator[List[StoredObject]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=self.object_key(prefix), PaginationConfig={"PageSize": min(page_size, 1000)}
+        )
+        for response in pages:
+            objects = [
+                (obj["Key"][len(self.prefix):], obj["Size"], obj["LastModified"].timestamp())
+                for obj in response.get("Contents", [])
+            ]
+            yield [stored for stored in objects if not stored[0].startswith(exclude)]
+
+    def list_pages(self, prefix: str, page_size: int, exclude: Iterable[str] = ()) -> AsyncIterator[List[StoredObject]]:
+        """Stored objects under `prefix`, one ListObjectsV2 page at a time, skipping keys under `exclude` prefixes"""
+        return iterate_in_threadpool(self._list_pages(prefix, page_size, tuple(exclude)))
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[Path]:
+        path = self.tmp_dir / f"{uuid.uuid4().hex}{Path(key).suffix}"
+        try:
+            await asyncio.to_thread(
+                self.client.download_file, self.bucket, self.object_key(key), str(path), Config=self.transfer_config
+            )
+            yield path
+        finally:
+            await remove_file(path)
+
+    async def presigned_url(self, key: str, media_type: str) -> Optional[str]:
+        if not self.presigned_downloads:
+            return None
+        return await asyncio.to_thread(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.object_key(key), "ResponseContentType": media_type},
+            ExpiresIn=self.presign_expires,
+        )
+
+    async def serve(self, key: str, range_header: Optional[str], media_type: str, headers: Dict[str, str]) -> Response:
+        params = {"Bucket": self.bucket, "Key": self.object_key(key)}
+        if range_header and range_header.startswith("bytes=") and "," not in range_header:
+            params["Range"] = range_header
+        try:
+            obj = await asyncio.to_thread(self.client.get_object, **params)
+        except Exception as e:
+            if self._is_missing(e):
+                raise HTTPException(status_code=404, detail="File not found")
+            if getattr(e, "response", {}).get("Error", {}).get("Code") == "InvalidRange":
+                raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            raise
+
+        headers = {**headers, "content-length": str(obj["ContentLength"])}
+        status_code = status.HTTP_200_OK
+        if obj.get("ContentRange"):
+            headers["content-range"] = obj["ContentRange"]
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+        body = obj["Body"]
+
+        async def stream():
+            try:
+                async for chunk in iterate_in_threadpool(body.iter_chunks(self.chunk_size)):
+                    yield chunk
+            finally:
+                body.close()
+
+        return StreamingResponse(stream(), status_code=status_code, media_type=media_type, headers=headers)
+
+
+def create_storage(backend: str, root: Path, tmp_dir: Path, **s3_options):
+    if backend == "s3":
+        return S3Storage(tmp_dir=tmp_dir, **s3_options)
+    if backend != "local":
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return LocalStorage(root)
@@ -0,0 +1,406 @@
+"""Load and micro-benchmarks for the impNet API.
+
+Drives the real FastAPI app in-process through an ASGI client, against
+mongomock-motor (default, fully offline) or a local mongod, and reports
+throughput, p50/p95/p99 latency and peak RSS per scenario.
+
+    python benchmarks/run.py --concurrency 20 --requests 500
+    python benchmarks/run.py --save-baseline benchmarks/baselines/local.json
+    python benchmarks/run.py --baseline benchmarks/baselines/local.json --threshold 0.2
+    python benchmarks/run.py -s me -s me_during_login_storm -s me_during_upload_flood --admission
+
+With --baseline the run exits non-zero when any scenario's p95 latency grows,
+or its throughput drops, by more than the threshold, or it returns more errors.
+"""
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+cli = typer.Typer(add_completion=False)
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class RssSampler:
+    """Samples RSS in the background to find the peak during a scenario"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_mb()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, rss_mb())
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, peak_rss: float) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "peak_rss_mb": round(peak_rss, 1),
+    }
+
+
+async def drive(request: Callable[[int], Awaitable], total: int, concurrency: int):
+    """Run request(i) for i in range(total) with at most `concurrency` in flight"""
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            response = await request(index)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, total))])
+    return latencies, errors, time.perf_counter() - start
+
+
+class Bench:
+    """Shared state between scenarios: the client, user tokens and created documents"""
+
+    def __init__(self, server, client, users: int, upload_size: int):
+        self.server = server
+        self.client = client
+        self.user_count = users
+        self.upload_size = upload_size
+        self.credentials: List[dict] = []
+        self.headers: List[dict] = []
+        self.refresh_tokens: List[str] = []
+        self.documents: List[tuple] = []
+        self.document_urls: Dict[str, str] = {}
+        self.has_passports = False
+
+    async def setup(self):
+        for index in range(self.user_count):
+            credentials = {
+                "email": f"bench{index}@impnet.ru",
+                "username": f"bench{index}",
+                "full_name": f"Bench User {index}",
+                "password": f"bench-password-{index}",
+            }
+            response = await self.client.post("/api/auth/register", json=credentials)
+            response.raise_for_status()
+            self.credentials.append({"email": credentials["email"], "password": credentials["password"]})
+            self.headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+            self.refresh_tokens.append(response.json()["refresh_token"])
+
+    async def prepare(self, name: str, total: int, concurrency: int):
+        """Create whatever a scenario reads or deletes, outside the measured window"""
+        if name in ("passport_get", "passport_update") and not self.has_passports:
+            await drive(*self.passport_create(total), concurrency)
+        if name in ("download", "delete_documents") and not self.documents:
+            await drive(*self.upload(total), concurrency)
+
+    def user_headers(self, index: int) -> dict:
+        return self.headers[index % self.user_count]
+
+    def passport_payload(self, index: int) -> dict:
+        return {
+            "first_name": f"Иван{index}",
+            "last_name": "Петров",
+            "middle_name": "Сергеевич",
+            "birth_date": "1990-05-17",
+            "birth_place": "г. Москва",
+            "gender": "М",
+            "issue_place": "МФЦ",
+        }
+
+    # Scenarios: each returns a request(i) coroutine factory and a request count
+
+    def login(self, total):
+        return lambda i: self.client.post("/api/auth/login", json=self.credentials[i % self.user_count]), total
+
+    def refresh(self, total):
+        # Tokens rotate, so one user's refreshes run one at a time
+        locks = [asyncio.Lock() for _ in range(self.user_count)]
+
+        async def request(i):
+            user = i % self.user_count
+            async with locks[user]:
+                response = await self.client.post("/api/auth/refresh", json={"refresh_token": self.refresh_tokens[user]})
+                if response.status_code == 200:
+                    self.refresh_tokens[user] = response.json()["refresh_token"]
+                return response
+        return request, total
+
+    def me(self, total):
+        return lambda i: self.client.get("/api/auth/me", headers=self.user_headers(i)), total
+
+    def upload(self, total):
+        async def request(i):
+            # Unique content per request so deduplication doesn't hide the write path
+            content = uuid.uuid4().bytes * (self.upload_size // 16)
+            response = await self.client.post(
+                "/api/documents/upload",
+                headers=self.user_headers(i),
+                files={"file": (f"scan{i}.pdf", content, "application/pdf")},
+                data={"document_type": "certificate"},
+            )
+            if response.status_code == 200:
+                self.documents.append((i % self.user_count, response.json()["id"]))
+                self.document_urls[response.json()["id"]] = response.json()["url"]
+            return response
+        return request, total
+
+    def download(self, total):
+        documents = list(self.documents)
+
+        def request(i):
+            user, document_id = documents[i % len(documents)]
+            return self.client.get(self.document_urls[document_id], headers=self.headers[user])
+        return request, total
+
+    def list_documents(self, total):
+        return lambda i: self.client.get("/api/documents", headers=self.user_headers(i)), total
+
+    def delete_documents(self, total):
+        documents = list(self.documents)
+        self.documents.clear()
+
+        def request(i):
+            user, document_id = documents[i]
+            return self.client.delete(f"/api/documents/{document_id}", headers=self.headers[user])
+        return request, len(documents)
+
+    def passport_create(self, total):
+        # One passport per user
+        self.has_passports = True
+        return lambda i: self.client.post(
+            "/api/passport", headers=self.headers[i], json=self.passport_payload(i)
+        ), self.user_count
+
+    def passport_get(self, total):
+        return lambda i: self.client.get("/api/passport", headers=self.user_headers(i)), total
+
+    def passport_update(self, total):
+        return lambda i: self.client.put(
+            "/api/passport", headers=self.user_headers(i), json=self.passport_payload(i)
+        ), total
+
+    def status_checks(self, total):
+        return lambda i: self.client.post("/api/status", json={"client_name": f"monitor{i % 50}"}), total
+
+    async def read_during_flood(self, flood, total, concurrency):
+        """Latency of a cheap read while the same number of clients hammer an expensive route.
+
+        Returns the read's (latencies, errors, elapsed) and how many flood requests were shed.
+        """
+        flood_request, _ = flood(total)
+        read_request, _ = self.me(total)
+        responses = []
+
+        async def tracked_flood_request(i):
+            response = await flood_request(i)
+            responses.append(response.status_code)
+            return response
+        storm = asyncio.ensure_future(drive(tracked_flood_request, total, concurrency))
+        result = await drive(read_request, total, concurrency)
+        await storm
+        return result, sum(code in (429, 503) for code in responses)
+
+    def me_during_login_storm(self, total, concurrency):
+        return self.read_during_flood(self.login, total, concurrency)
+
+    def me_during_upload_flood(self, total, concurrency):
+        return self.read_during_flood(self.upload, total, concurrency)
+
+
+SCENARIOS = [
+    "login", "refresh", "me", "me_during_login_storm", "me_during_upload_flood", "upload", "download",
+    "list_documents", "delete_documents", "passport_create", "passport_get", "passport_update", "status_checks",
+]
+FLOOD_SCENARIOS = ("me_during_login_storm", "me_during_upload_flood")
+
+
+def create_storage(server, backend: str, workdir: Path):
+    """Local disk under the work dir, or a bucket on moto's in-process S3 (or S3_ENDPOINT_URL if set)"""
+    from storage import LocalStorage, S3Storage
+    if backend == "local":
+        return LocalStorage(workdir)
+    bucket = f"impnet-bench-{uuid.uuid4().hex[:8]}"
+    endpoint_url = os.environ.get("S3_ENDPOINT_URL")
+    if not endpoint_url:
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+            os.environ.setdefault(name, "testing")
+        from moto import mock_aws
+        mock_aws().start()
+    s3 = S3Storage(
+        bucket,
+        server.UPLOAD_TMP_DIR,
+        endpoint_url=endpoint_url,
+        region="us-east-1",
+        multipart_threshold=server.S3_MULTIPART_THRESHOLD,
+        multipart_chunk_size=server.S3_MULTIPART_CHUNK_SIZE,
+        max_concurrency=server.S3_MAX_CONCURRENCY,
+        presigned_downloads=server.S3_PRESIGNED_DOWNLOADS,
+    )
+    s3.client.create_bucket(Bucket=bucket)
+    return s3
+
+
+async def run_benchmarks(scenarios: List[str], concurrency: int, total: int, users: int, upload_size: int, mongo_url: Optional[str], storage: str = "local", admission: bool = False):
+    db_name = f"impnet_bench_{uuid.uuid4().hex[:8]}"
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("MONGO_URL", mongo_url or "mongodb://localhost:27017")
+    os.environ.setdefault("ROLE_REFRESH_MODE", "off")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    import server
+
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[db_name]
+
+    # Keep benchmark uploads out of the source tree
+    workdir = Path(tempfile.mkdtemp(prefix="impnet-bench-"))
+    server.ROOT_DIR = workdir
+    server.UPLOAD_DIR = workdir / "uploads"
+    server.BLOB_DIR = server.UPLOAD_DIR / "blobs"
+    server.UPLOAD_TMP_DIR = server.UPLOAD_DIR / "tmp"
+    server.BLOB_DIR.mkdir(parents=True)
+    server.UPLOAD_TMP_DIR.mkdir(parents=True)
+    server.file_storage = create_storage(server, storage, workdir)
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await server.startup_event()
+        try:
+            # Every request comes from one address; register the users before limits apply
+            limiter, server.admission_control.limiter = server.admission_control.limiter, None
+            bench = Bench(server, client, users, upload_size)
+            await bench.setup()
+            if admission:
+                server.admission_control.limiter = limiter
+            else:
+                for route_class in server.admission_control.route_classes:
+                    route_class.max_concurrency = 0
+            for name in scenarios:
+                await bench.prepare(name, total, concurrency)
+                shed = None
+                with RssSampler() as sampler:
+                    if name in FLOOD_SCENARIOS:
+                        (latencies, errors, elapsed), shed = await getattr(bench, name)(total, concurrency)
+                    else:
+                        request, count = getattr(bench, name)(total)
+                        latencies, errors, elapsed = await drive(request, count, concurrency)
+                results[name] = summarize(latencies, errors, elapsed, sampler.peak)
+                if shed is not None:
+                    results[name]["flood_shed"] = shed
+                typer.echo(f"{name:24s} " + " ".join(f"{key}={value}" for key, value in results[name].items()))
+        finally:
+            if mongo_url:
+                await server.client.drop_database(db_name)
+            await server.shutdown_db_client()
+    results["_process"] = {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if name.startswith("_") or not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+    return regressions
+
+
+@cli.command()
+def main(
+    scenario: List[str] = typer.Option(SCENARIOS, "--scenario", "-s", help="Scenario to run (repeatable)"),
+    concurrency: int = typer.Option(10, help="Requests in flight per scenario"),
+    requests: int = typer.Option(200, help="Requests per scenario"),
+    users: int = typer.Option(10, help="Users registered up front; passport_create runs once per user"),
+    upload_size: int = typer.Option(256 * 1024, help="Bytes per uploaded document"),
+    mongo_url: Optional[str] = typer.Option(None, help="Use a real mongod instead of mongomock-motor"),
+    storage: str = typer.Option("local", help="Storage backend: local, or s3 (moto in-process unless S3_ENDPOINT_URL is set)"),
+    bcrypt_rounds: int = typer.Option(12, help="bcrypt cost factor used for the run"),
+    output: Optional[Path] = typer.Option(None, help="Write results JSON here"),
+    save_baseline: Optional[Path] = typer.Option(None, help="Store results as a baseline"),
+    baseline: Optional[Path] = typer.Option(None, help="Compare against a stored baseline"),
+    threshold: float = typer.Option(0.2, help="Allowed relative regression before failing"),
+    admission: bool = typer.Option(False, help="Apply rate limits and concurrency caps (RATE_LIMIT_*, *_MAX_CONCURRENCY)"),
+):
+    unknown = set(scenario) - set(SCENARIOS)
+    if unknown:
+        raise typer.BadParameter(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    os.environ["BCRYPT_ROUNDS"] = str(bcrypt_rounds)
+    if storage not in ("local", "s3"):
+        raise typer.BadParameter("Storage must be local or s3")
+    results = asyncio.run(run_benchmarks(scenario, concurrency, requests, users, upload_size, mongo_url, storage, admission))
+    results["_config"] = {
+        "concurrency": concurrency, "requests": requests, "users": users,
+        "upload_size": upload_size, "bcrypt_rounds": bcrypt_rounds, "backend": "mongod" if mongo_url else "mongomock",
+        "storage": storage, "admission": admission,
+    }
+
+    for path in (output, save_baseline):
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2))
+    if baseline:
+        regressions = compare(results, json.loads(baseline.read_text()), threshold)
+        for regression in regressions:
+            typer.echo(f"REGRESSION {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,185 @@
+"""Latency of citizen search over a large synthetic population.
+
+Seeds users (each with a passport) straight into the database, then queries
+/api/citizens/search through an ASGI client as an admin: name, email and
+username prefixes, an exact passport lookup and keyset paging through a
+common surname. Against mongod the winning plan of every query is printed too,
+which should be an IXSCAN on the search indexes, never a COLLSCAN.
+mongomock-motor has no indexes, so offline runs only check correctness.
+
+    python benchmarks/search.py --mongo-url mongodb://localhost:27017 --citizens 1000000
+    python benchmarks/search.py --citizens 5000 --queries 50
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+SURNAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов", "Новиков", "Фёдоров",
+            "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров", "Павлов", "Козлов", "Степанов", "Николаев"]
+FIRST_NAMES = ["Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Артём", "Илья", "Кирилл", "Михаил"]
+PATRONYMICS = ["Александрович", "Дмитриевич", "Сергеевич", "Андреевич", "Иванович", "Петрович", "Николаевич", "Олегович"]
+
+cli = typer.Typer(add_completion=False)
+
+
+def citizen(server, index: int, role_id: str, now: datetime) -> tuple:
+    full_name = (
+        f"{SURNAMES[index % len(SURNAMES)]} {FIRST_NAMES[index // len(SURNAMES) % len(FIRST_NAMES)]} "
+        f"{PATRONYMICS[index // 7 % len(PATRONYMICS)]}"
+    )
+    user_id = str(uuid.uuid4())
+    user = server.with_search_keys({
+        "id": user_id, "email": f"citizen{index}@impnet.ru", "username": f"citizen{index}", "full_name": full_name,
+        "role_id": role_id, "hashed_password": "x", "is_active": True, "created_at": now, "profile_data": {},
+    })
+    last_name, first_name, middle_name = full_name.split()
+    passport = {
+        "id": str(uuid.uuid4()), "user_id": user_id, "series": f"{4500 + index // 1_000_000:04d}",
+        "number": f"{index % 1_000_000:06d}", "issue_date": now, "issue_place": "МФЦ",
+        "first_name": first_name, "last_name": last_name, "middle_name": middle_name,
+        "birth_date": datetime(1970 + index % 40, 1 + index % 12, 1 + index % 28), "birth_place": "г. Москва",
+        "gender": "М", "created_at": now, "updated_at": now,
+    }
+    return user, passport
+
+
+async def seed(server, count: int, batch_size: int):
+    role_id = server.role_registry.get_by_name("citizen").id
+    now = datetime.utcnow()
+    for start in range(0, count, batch_size):
+        pairs = [citizen(server, index, role_id, now) for index in range(start, min(start + batch_size, count))]
+        await server.db.users.insert_many([user for user, _ in pairs], ordered=False)
+        await server.db.passports.insert_many([passport for _, passport in pairs], ordered=False)
+
+
+def summarize(latencies: List[float]) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 3),
+        "p50_ms": round(values[len(values) // 2] * 1000, 3),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def winning_plan(server, field: str, prefix: str) -> str:
+    """Stages of the plan mongod picks for a search's $match + $sort"""
+    bounds = {"$gte": prefix, "$lt": prefix + "\U0010ffff"}
+    citizen = {"role_id": server.role_registry.get_by_name("citizen").id}
+    if field == "name":
+        cursor = server.db.users.find({"search.name_tokens": {"$elemMatch": bounds}, **citizen}).sort("_id", 1)
+    else:
+        cursor = server.db.users.find({f"search.{field}": bounds, **citizen}).sort([(f"search.{field}", 1), ("_id", 1)])
+    explain = await cursor.limit(21).explain()
+    stages, plan = [], explain["queryPlanner"]["winningPlan"]
+    while plan:
+        stages.append(plan["stage"] + (f"({plan['indexName']})" if "indexName" in plan else ""))
+        plan = plan.get("inputStage")
+    return " <- ".join(stages)
+
+
+async def run(citizens: int, queries: int, page_size: int, batch_size: int, mongo_url: Optional[str]) -> dict:
+    db_name = f"impnet_search_{uuid.uuid4().hex[:8]}"
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("MONGO_URL", mongo_url or "mongodb://localhost:27017")
+    os.environ.setdefault("ROLE_REFRESH_MODE", "off")
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+    os.environ.setdefault("GC_RECONCILE_INTERVAL", "0")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    import server
+
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[db_name]
+
+    results = {}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await server.startup_event()
+        try:
+            start = time.perf_counter()
+            await seed(server, citizens, batch_size)
+            typer.echo(f"seeded {citizens} citizens in {time.perf_counter() - start:.1f}s")
+            response = await client.post(
+                "/api/auth/login", json={"email": server.DEFAULT_ADMIN["email"], "password": server.DEFAULT_ADMIN_PASSWORD}
+            )
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            cases = {
+                "name_prefix": lambda i: {"q": SURNAMES[i % len(SURNAMES)][:4].lower()},
+                "full_name_prefix": lambda i: {"q": f"{SURNAMES[i % len(SURNAMES)]} {FIRST_NAMES[i % len(FIRST_NAMES)][:3]}"},
+                "patronymic_prefix": lambda i: {"q": PATRONYMICS[i % len(PATRONYMICS)][:6]},
+                "email_prefix": lambda i: {"q": f"citizen{(i * 7919) % citizens}@"},
+                "username_prefix": lambda i: {"q": f"CITIZEN{(i * 7919) % citizens}", "field": "username"},
+                "passport_exact": lambda i: {"series": f"{4500 + (i * 7919) % citizens // 1_000_000:04d}", "number": f"{(i * 7919) % citizens % 1_000_000:06d}"},
+            }
+            for name, params in cases.items():
+                latencies = []
+                for i in range(queries):
+                    start = time.perf_counter()
+                    response = await client.get("/api/citizens/search", params={**params(i), "limit": page_size}, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+                    assert response.json(), f"{name} found nothing for {params(i)}"
+                results[name] = summarize(latencies)
+
+            # Keyset paging: every page is one index range, however deep
+            latencies, cursor = [], None
+            for _ in range(queries):
+                params = {"q": "иванов", "limit": page_size, **({"after": cursor} if cursor else {})}
+                start = time.perf_counter()
+                response = await client.get("/api/citizens/search", params=params, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+                cursor = response.headers.get(server.NEXT_CURSOR_HEADER)
+                if not cursor:
+                    break
+            results["name_paging"] = summarize(latencies)
+
+            for name, value in results.items():
+                typer.echo(f"{name:18s} " + " ".join(f"{key}={item}" for key, item in value.items()))
+            if mongo_url:
+                for field, prefix in (("name", "иван"), ("name", "олегович"), ("email", "citizen42@"), ("username", "citizen42")):
+                    typer.echo(f"plan {field:8s} {await winning_plan(server, field, prefix)}")
+        finally:
+            if mongo_url:
+                await server.client.drop_database(db_name)
+            await server.shutdown_db_client()
+    return results
+
+
+@cli.command()
+def main(
+    citizens: int = typer.Option(1_000_000, help="Synthetic users seeded, each with a passport"),
+    queries: int = typer.Option(200, help="Requests per query shape"),
+    page_size: int = typer.Option(20, help="limit= per search request"),
+    batch_size: int = typer.Option(10_000, help="Users inserted per batch while seeding"),
+    mongo_url: Optional[str] = typer.Option(None, help="Use a real mongod instead of mongomock-motor"),
+    output: Optional[Path] = typer.Option(None, help="Write results JSON here"),
+):
+    results = asyncio.run(run(citizens, queries, page_size, batch_size, mongo_url))
+    results["_config"] = {
+        "citizens": citizens, "queries": queries, "page_size": page_size,
+        "backend": "mongod" if mongo_url else "mongomock",
+    }
+    if output:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
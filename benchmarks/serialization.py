@@ -0,0 +1,116 @@
+"""Per-item response serialization cost, before and after the precompiled serializers.
+
+"legacy" reproduces the old path: build a response model per record in a
+Python loop (deriving URLs from file paths), then let FastAPI validate and
+encode the list again for response_model and render it with the stdlib json
+module. "serializer" is what the listing endpoints do now: one pydantic-core
+validate + dump over the stored records.
+
+    python benchmarks/serialization.py --items 100 --items 1000 --repeat 50
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+cli = typer.Typer(add_completion=False)
+
+
+def make_documents(count: int) -> List[dict]:
+    docs = []
+    for index in range(count):
+        sha = uuid.uuid4().hex * 2
+        file_path = f"uploads/blobs/{sha[:2]}/{sha}-{index:08x}.jpg"
+        thumbnail_path = f"uploads/blobs/{sha[:2]}/{sha}-{index:08x}.thumb.webp"
+        docs.append({
+            "id": str(uuid.uuid4()), "type": "photo", "filename": file_path.split("/")[-1],
+            "original_name": f"scan{index}.jpg", "file_size": 250_000 + index, "mime_type": "image/jpeg",
+            "created_at": datetime.utcnow(), "description": None,
+            "file_path": file_path, "thumbnail_path": thumbnail_path,
+            "url": f"/api/files/{file_path.split('uploads/')[-1]}",
+            "thumbnail_url": f"/api/files/{thumbnail_path.split('uploads/')[-1]}",
+        })
+    return docs
+
+
+def make_users(count: int) -> List[dict]:
+    return [{
+        "id": str(uuid.uuid4()), "email": f"user{index}@impnet.ru", "username": f"user{index}",
+        "full_name": f"User {index}", "role_id": str(uuid.uuid4()), "is_active": True,
+        "avatar_url": None, "created_at": datetime.utcnow(), "last_login": None,
+    } for index in range(count)]
+
+
+def time_per_item(func, items: int, repeat: int) -> float:
+    """Best-of-repeat wall time per item, in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best / items * 1_000_000
+
+
+@cli.command()
+def main(
+    items: List[int] = typer.Option([100, 1000], help="Records per response (repeatable)"),
+    repeat: int = typer.Option(30, help="Runs per measurement; the fastest is reported"),
+):
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "impnet_bench")
+    sys.path.insert(0, str(BACKEND_DIR))
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    import server
+
+    loop = asyncio.new_event_loop()
+
+    def legacy(model, to_model):
+        field = create_response_field(name="response", type_=List[model])
+
+        def run(records):
+            content = [to_model(record) for record in records]
+            encoded = loop.run_until_complete(
+                serialize_response(field=field, response_content=content, is_coroutine=True)
+            )
+            return JSONResponse(encoded).body
+        return run
+
+    def legacy_document(doc):
+        thumbnail_path = doc.get("thumbnail_path")
+        return server.DocumentResponse(
+            **{k: v for k, v in doc.items() if k not in ("url", "thumbnail_url")},
+            url=server.upload_url(doc["file_path"]),
+            thumbnail_url=server.upload_url(thumbnail_path) if thumbnail_path else None
+        )
+
+    cases = {
+        "documents": (make_documents, legacy(server.DocumentResponse, legacy_document), server.document_serializer),
+        "users": (make_users, legacy(server.UserResponse, lambda user: server.UserResponse(**user)), server.user_serializer),
+    }
+    for name, (factory, legacy_run, serializer) in cases.items():
+        for count in items:
+            records = factory(count)
+            # Same bytes on the wire, modulo whitespace
+            assert json.loads(legacy_run(records)) == json.loads(serializer.dump_many(records))
+            before = time_per_item(lambda: legacy_run(records), count, repeat)
+            after = time_per_item(lambda: serializer.dump_many(records), count, repeat)
+            typer.echo(
+                f"{name:10s} items={count:<6d} legacy_us_per_item={before:.2f} "
+                f"serializer_us_per_item={after:.2f} speedup={before / after:.1f}x"
+            )
+    loop.close()
+
+
+if __name__ == "__main__":
+    cli()
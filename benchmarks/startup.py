@@ -0,0 +1,161 @@
+"""Cold-start benchmark: module import, startup_event and time to first request.
+
+Each run is a fresh interpreter, as when an autoscaler adds a worker. The
+child imports the app, runs startup, serves one request through an ASGI client
+and reports its timings; the parent also measures wall time from spawn to that
+first response.
+
+    python benchmarks/startup.py --runs 5                  # empty database: full bootstrap
+    python benchmarks/startup.py --runs 5 --warm           # already seeded database
+    python benchmarks/startup.py --runs 5 --skip-bootstrap
+    python benchmarks/startup.py --save-baseline benchmarks/baselines/startup.json
+    python benchmarks/startup.py --baseline benchmarks/baselines/startup.json --threshold 0.2
+"""
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+METRICS = ("import_s", "startup_s", "first_request_s", "time_to_first_request_s")
+
+cli = typer.Typer(add_completion=False)
+
+
+async def child(mongo: bool, warm: bool) -> dict:
+    start = time.perf_counter()
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    imported = time.perf_counter()
+
+    if not mongo:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[server.DB_NAME]
+        if warm:
+            # What a previous instance leaves behind, written without touching bcrypt or passlib
+            await server.ensure_indexes()
+            await server.db.roles.insert_many([
+                {**role, "id": str(uuid.uuid4()), "created_at": server.datetime.utcnow(), "created_by": "system"}
+                for role in server.DEFAULT_ROLES
+            ])
+
+    import httpx
+    before_startup = time.perf_counter()
+    await server.startup_event()
+    started = time.perf_counter()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.get("/api/status", params={"limit": 1})
+        response.raise_for_status()
+    served = time.perf_counter()
+    served_at = time.time()
+    await server.shutdown_db_client()
+    return {
+        "import_s": imported - start,
+        "startup_s": started - before_startup,
+        "first_request_s": served - started,
+        "served_at": served_at,
+    }
+
+
+def spawn(env: dict) -> dict:
+    spawned_at = time.time()
+    output = subprocess.run(
+        [sys.executable, __file__, "--child"], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["time_to_first_request_s"] = result.pop("served_at") - spawned_at
+    return result
+
+
+@cli.command()
+def main(
+    runs: int = typer.Option(5, help="Fresh processes to start"),
+    warm: bool = typer.Option(False, help="Start against a database that is already seeded"),
+    skip_bootstrap: bool = typer.Option(False, help="Run with SKIP_BOOTSTRAP=true"),
+    mongo_url: Optional[str] = typer.Option(None, help="Use a real mongod instead of mongomock-motor"),
+    bcrypt_rounds: int = typer.Option(12, help="bcrypt cost factor used when seeding the admin"),
+    output: Optional[Path] = typer.Option(None, help="Write results JSON here"),
+    save_baseline: Optional[Path] = typer.Option(None, help="Store results as a baseline"),
+    baseline: Optional[Path] = typer.Option(None, help="Compare against a stored baseline"),
+    threshold: float = typer.Option(0.2, help="Allowed relative regression before failing"),
+    is_child: bool = typer.Option(False, "--child", hidden=True),
+):
+    if is_child:
+        result = asyncio.run(child(bool(os.environ.get("BENCH_MONGO")), bool(os.environ.get("BENCH_WARM"))))
+        print(json.dumps(result))
+        return
+
+    db_name = f"impnet_startup_{uuid.uuid4().hex[:8]}"
+    env = {
+        **os.environ,
+        "MONGO_URL": mongo_url or "mongodb://localhost:27017",
+        "DB_NAME": db_name,
+        "ROLE_REFRESH_MODE": "off",
+        "BCRYPT_ROUNDS": str(bcrypt_rounds),
+        "SKIP_BOOTSTRAP": "true" if skip_bootstrap else "false",
+    }
+    if mongo_url:
+        env["BENCH_MONGO"] = "1"
+    if warm:
+        env["BENCH_WARM"] = "1"
+        if mongo_url:
+            # One untimed start seeds the shared database
+            spawn({**env, "SKIP_BOOTSTRAP": "false"})
+
+    try:
+        samples = []
+        for index in range(runs):
+            if mongo_url and not warm:
+                env["DB_NAME"] = f"{db_name}_{index}"
+            samples.append(spawn(env))
+    finally:
+        if mongo_url:
+            from pymongo import MongoClient
+            with MongoClient(mongo_url) as mongo:
+                for name in mongo.list_database_names():
+                    if name.startswith(db_name):
+                        mongo.drop_database(name)
+
+    results = {
+        key: {
+            "median_ms": round(statistics.median(sample[key] for sample in samples) * 1000, 1),
+            "max_ms": round(max(sample[key] for sample in samples) * 1000, 1),
+        }
+        for key in METRICS
+    }
+    for key, value in results.items():
+        typer.echo(f"{key:26s} median_ms={value['median_ms']} max_ms={value['max_ms']}")
+    results["_config"] = {
+        "runs": runs, "warm": warm, "skip_bootstrap": skip_bootstrap,
+        "bcrypt_rounds": bcrypt_rounds, "backend": "mongod" if mongo_url else "mongomock",
+    }
+
+    for path in (output, save_baseline):
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2))
+    if baseline:
+        previous = json.loads(baseline.read_text())
+        regressions = [
+            f"{key}: {previous[key]['median_ms']}ms -> {results[key]['median_ms']}ms"
+            for key in METRICS
+            if key in previous and results[key]["median_ms"] > previous[key]["median_ms"] * (1 + threshold)
+        ]
+        for regression in regressions:
+            typer.echo(f"REGRESSION {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,138 @@
+"""Peak RSS of concurrent large uploads, streamed versus buffered in memory.
+
+Each pipeline runs in a fresh process, driving /api/documents/upload through an
+ASGI client against mongomock-motor and local storage in a temp dir. Request
+bodies are streamed from a file on disk, so the client adds no copy of its own.
+"streaming" is the current save_uploaded_file; "buffered" reads the whole upload
+into memory first and keeps it until the request is done, as the pipeline did
+before uploads were streamed. The report gives each run's RSS growth over its
+baseline.
+
+    python benchmarks/upload_memory.py --uploads 50 --size-mb 10
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from run import RssSampler, rss_mb
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+PIPELINES = ("buffered", "streaming")
+
+cli = typer.Typer(add_completion=False)
+
+
+def buffered(save_uploaded_file):
+    """The pre-streaming memory profile: the whole file is held while it is stored"""
+    async def save(file):
+        content = await file.read()
+        await file.seek(0)
+        try:
+            return await save_uploaded_file(file)
+        finally:
+            del content
+    return save
+
+
+async def measure(pipeline: str, uploads: int, size_mb: int) -> dict:
+    db_name = f"impnet_upload_{uuid.uuid4().hex[:8]}"
+    os.environ["DB_NAME"] = db_name
+    os.environ.setdefault("ROLE_REFRESH_MODE", "off")
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "off")
+    os.environ.setdefault("GC_RECONCILE_INTERVAL", "0")
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    import server
+    from mongomock_motor import AsyncMongoMockClient
+    from storage import LocalStorage
+
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[db_name]
+    workdir = Path(tempfile.mkdtemp(prefix="impnet-upload-"))
+    server.ROOT_DIR = workdir
+    server.UPLOAD_TMP_DIR = workdir / "uploads" / "tmp"
+    server.UPLOAD_TMP_DIR.mkdir(parents=True)
+    server.file_storage = LocalStorage(workdir)
+    if pipeline == "buffered":
+        server.save_uploaded_file = buffered(server.save_uploaded_file)
+
+    source = workdir / "scan.pdf"
+    with open(source, "wb") as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await server.startup_event()
+        try:
+            for route_class in server.admission_control.route_classes:
+                route_class.max_concurrency = 0
+            # One user takes every upload, so lift the citizen quota
+            await server.db.roles.update_one({"name": "citizen"}, {"$set": {"storage_quota_bytes": 0, "document_quota": 0}})
+            await server.role_registry.refresh()
+            response = await client.post("/api/auth/register", json={
+                "email": "upload@impnet.ru", "username": "upload", "full_name": "Upload Bench", "password": "upload-password",
+            })
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            async def upload(i):
+                with open(source, "rb") as body:
+                    return await client.post(
+                        "/api/documents/upload", headers=headers,
+                        files={"file": (f"scan{i}.pdf", body, "application/pdf")}, data={"document_type": "certificate"},
+                    )
+
+            baseline = rss_mb()
+            start = time.perf_counter()
+            with RssSampler() as sampler:
+                responses = await asyncio.gather(*(upload(i) for i in range(uploads)))
+            elapsed = time.perf_counter() - start
+        finally:
+            await server.shutdown_db_client()
+    return {
+        "uploads": uploads,
+        "errors": sum(response.status_code != 200 for response in responses),
+        "elapsed_s": round(elapsed, 2),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(sampler.peak, 1),
+        "growth_mb": round(sampler.peak - baseline, 1),
+    }
+
+
+@cli.command()
+def main(
+    uploads: int = typer.Option(50, help="Uploads sent at once"),
+    size_mb: int = typer.Option(10, help="Size of each upload in MB; at most the 10 MB upload limit"),
+    pipeline: Optional[str] = typer.Option(None, help="Measure one pipeline in this process (used internally)"),
+    output: Optional[Path] = typer.Option(None, help="Write results JSON here"),
+):
+    if pipeline:
+        typer.echo(json.dumps(asyncio.run(measure(pipeline, uploads, size_mb))))
+        return
+    results = {}
+    for name in PIPELINES:
+        # A fresh process per pipeline, as RSS never shrinks back to a clean baseline
+        completed = subprocess.run(
+            [sys.executable, __file__, "--pipeline", name, "--uploads", str(uploads), "--size-mb", str(size_mb)],
+            check=True, capture_output=True, text=True,
+        )
+        results[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+        typer.echo(f"{name:10s} " + " ".join(f"{key}={value}" for key, value in results[name].items()))
+    results["_config"] = {"uploads": uploads, "size_mb": size_mb}
+    if output:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    cli()
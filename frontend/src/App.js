@@ -1,4 +1,4 @@
-import React, { useEffect, useState, createContext, useContext } from "react";
+import React, { useEffect, useRef, useState, createContext, useContext } from "react";
 import "./App.css";
 import "./components/Components.css";
 import { BrowserRouter, Routes, Route, Navigate } from "react-router-dom";
@@ -58,11 +58,71 @@ const ThemeProvider = ({ children }) => {
   );
 };
 
+// Один запрос обновления на все параллельные 401
+let refreshPromise = null;
+
+const refreshSession = () => {
+  if (!refreshPromise) {
+    const refreshToken = localStorage.getItem('refreshToken');
+    refreshPromise = (refreshToken
+      ? axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+      : Promise.reject(new Error('No refresh token'))
+    ).finally(() => {
+      refreshPromise = null;
+    });
+  }
+  return refreshPromise;
+};
+
 // Provider для аутентификации
 const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('token'));
   const [loading, setLoading] = useState(true);
+  // Refresh token этой вкладки; другие вкладки могут заменить его в localStorage
+  const tabRefreshToken = useRef(localStorage.getItem('refreshToken'));
+
+  const saveSession = (accessToken, refreshToken) => {
+    localStorage.setItem('token', accessToken);
+    if (refreshToken) {
+      localStorage.setItem('refreshToken', refreshToken);
+      tabRefreshToken.current = refreshToken;
+    }
+    axios.defaults.headers.common['Authorization'] = `Bearer ${accessToken}`;
+    setToken(accessToken);
+  };
+
+  // Истёкший access token обновляется по refresh token без повторного входа
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        if (
+          error.response?.status !== 401 ||
+          !original ||
+          original._retried ||
+          original.url?.includes('/auth/')
+        ) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          const response = await refreshSession();
+          const { access_token, refresh_token, user: userData } = response.data;
+          saveSession(access_token, refresh_token);
+          setUser(userData);
+          original.headers['Authorization'] = `Bearer ${access_token}`;
+          return axios(original);
+        } catch (refreshError) {
+          // Сессия уже недействительна на сервере: отзывать нечего
+          clearSession();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
 
   useEffect(() => {
     if (token) {
@@ -75,11 +135,21 @@ const AuthProvider = ({ children }) => {
 
   const fetchCurrentUser = async () => {
     try {
-      const response = await axios.get(`${API}/auth/me`);
+      let response;
+      try {
+        response = await axios.get(`${API}/auth/me`);
+      } catch (error) {
+        if (error.response?.status !== 401) {
+          throw error;
+        }
+        const refreshed = await refreshSession();
+        saveSession(refreshed.data.access_token, refreshed.data.refresh_token);
+        response = { data: refreshed.data.user };
+      }
       setUser(response.data);
     } catch (error) {
       console.error('Error fetching current user:', error);
-      logout();
+      clearSession();
     } finally {
       setLoading(false);
     }
@@ -88,12 +158,10 @@ const AuthProvider = ({ children }) => {
   const login = async (email, password) => {
     try {
       const response = await axios.post(`${API}/auth/login`, { email, password });
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
-      localStorage.setItem('token', access_token);
-      setToken(access_token);
+      saveSession(access_token, refresh_token);
       setUser(userData);
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
       
       return { success: true };
     } catch (error) {
@@ -107,12 +175,10 @@ const AuthProvider = ({ children }) => {
   const register = async (userData) => {
     try {
       const response = await axios.post(`${API}/auth/register`, userData);
-      const { access_token, user: newUser } = response.data;
+      const { access_token, refresh_token, user: newUser } = response.data;
       
-      localStorage.setItem('token', access_token);
-      setToken(access_token);
+      saveSession(access_token, refresh_token);
       setUser(newUser);
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
       
       return { success: true };
     } catch (error) {
@@ -123,13 +189,24 @@ const AuthProvider = ({ children }) => {
     }
   };
 
-  const logout = () => {
+  const clearSession = () => {
     localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
+    tabRefreshToken.current = null;
     setToken(null);
     setUser(null);
     delete axios.defaults.headers.common['Authorization'];
   };
 
+  // Явный выход: отзывается только токен этой вкладки, а не сменённый другой вкладкой
+  const logout = () => {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken && refreshToken === tabRefreshToken.current) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
+    clearSession();
+  };
+
   return (
     <AuthContext.Provider value={{ user, login, register, logout, loading }}>
       {children}
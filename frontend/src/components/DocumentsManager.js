@@ -5,10 +5,15 @@ import { useAuth } from '../App';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// File URLs come back signed for the current user, so <img>/<a> can load them without headers
+const fileUrl = (path) => `${BACKEND_URL}${path}`;
+
 const DocumentsManager = () => {
   const { user } = useAuth();
   const [documents, setDocuments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [uploadProgress, setUploadProgress] = useState(0);
   const [isDragging, setIsDragging] = useState(false);
 
@@ -20,6 +25,7 @@ const DocumentsManager = () => {
     try {
       const response = await axios.get(`${API}/documents`);
       setDocuments(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error fetching documents:', error);
     } finally {
@@ -27,6 +33,20 @@ const DocumentsManager = () => {
     }
   };
 
+  // The list is paged; X-Next-Cursor is set while more documents remain
+  const loadMoreDocuments = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/documents`, { params: { after: nextCursor } });
+      setDocuments(prev => [...prev, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Error fetching documents:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleFileUpload = async (files, documentType = 'document') => {
     for (const file of files) {
       const formData = new FormData();
@@ -171,7 +191,7 @@ const DocumentsManager = () => {
               <div className="document-preview">
                 {doc.mime_type?.startsWith('image/') ? (
                   <img 
-                    src={`${BACKEND_URL}${doc.url}`} 
+                    src={fileUrl(doc.thumbnail_url || doc.url)} 
                     alt={doc.original_name}
                     className="document-image"
                   />
@@ -195,7 +215,7 @@ const DocumentsManager = () => {
               
               <div className="document-actions">
                 <a 
-                  href={`${BACKEND_URL}${doc.url}`}
+                  href={fileUrl(doc.url)}
                   target="_blank"
                   rel="noopener noreferrer"
                   className="action-btn view-btn"
@@ -213,6 +233,14 @@ const DocumentsManager = () => {
           ))
         )}
       </div>
+
+      {nextCursor && (
+        <div className="load-more">
+          <button onClick={loadMoreDocuments} disabled={loadingMore} className="load-more-btn">
+            {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
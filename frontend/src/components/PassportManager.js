@@ -5,6 +5,9 @@ import { useAuth } from '../App';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// File URLs come back signed for the current user, so <img>/<a> can load them without headers
+const fileUrl = (path) => `${BACKEND_URL}${path}`;
+
 const PassportManager = () => {
   const { user } = useAuth();
   const [passport, setPassport] = useState(null);
@@ -50,8 +53,15 @@ const PassportManager = () => {
 
   const fetchDocuments = async () => {
     try {
-      const response = await axios.get(`${API}/documents`);
-      setDocuments(response.data.filter(doc => doc.mime_type?.startsWith('image/')));
+      // Follow X-Next-Cursor so photos past the first page can be picked too
+      const images = [];
+      let after = null;
+      do {
+        const response = await axios.get(`${API}/documents`, { params: after ? { after } : {} });
+        images.push(...response.data.filter(doc => doc.mime_type?.startsWith('image/')));
+        after = response.headers['x-next-cursor'];
+      } while (after);
+      setDocuments(images);
     } catch (error) {
       console.error('Error fetching documents:', error);
     }
@@ -165,7 +175,7 @@ const PassportManager = () => {
                 <div className="passport-photo">
                   {passport.photo_url ? (
                     <img 
-                      src={`${BACKEND_URL}${passport.photo_url}`} 
+                      src={fileUrl(passport.photo_url)} 
                       alt="Фото паспорта"
                       className="passport-photo-img"
                     />
@@ -262,7 +272,7 @@ const PassportManager = () => {
                     {documents.map(doc => (
                       <div key={doc.id} className="photo-option">
                         <img 
-                          src={`${BACKEND_URL}${doc.url}`} 
+                          src={fileUrl(doc.thumbnail_url || doc.url)} 
                           alt={doc.original_name}
                           className="photo-thumbnail"
                         />
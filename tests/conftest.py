@@ -0,0 +1,106 @@
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """An empty in-memory database installed as server.db (and listing_db) for the test"""
+    from mongomock_motor import AsyncMongoMockClient
+
+    previous = server.client, server.db, server.listing_db
+    server.client = AsyncMongoMockClient()
+    server.db = server.listing_db = server.client[f"test_{uuid.uuid4().hex}"]
+    yield server.db
+    server.client, server.db, server.listing_db = previous
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """A hand-driven clock for components that take one"""
+    return FakeClock(1_700_000_000.0)
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    """Frozen time.monotonic for the synchronous cache tests; advance it by hand"""
+    clock = FakeClock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def seeded(db, monkeypatch):
+    """Indexes, default roles and the admin account in the test database, with cheap bcrypt"""
+    import asyncio
+
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 4)
+    server.password_context.cache_clear()
+    server.principal_cache.clear()
+    server.file_access_cache.clear()
+
+    async def seed():
+        await server.ensure_indexes()
+        await server.init_default_roles()
+        await server.role_registry.refresh()
+
+    asyncio.run(seed())
+    yield db
+    server.password_context.cache_clear()
+    server.principal_cache.clear()
+    server.file_access_cache.clear()
+
+
+@pytest.fixture
+def file_store(tmp_path, monkeypatch):
+    """Local storage rooted at tmp_path installed as server.file_storage, uploads spooled under it"""
+    from storage import LocalStorage
+
+    tmp_dir = tmp_path / "uploads" / "tmp"
+    tmp_dir.mkdir(parents=True)
+    monkeypatch.setattr(server, "UPLOAD_TMP_DIR", tmp_dir)
+    monkeypatch.setattr(server, "file_storage", LocalStorage(tmp_path))
+    return server.file_storage
+
+
+def api_client(**kwargs) -> httpx.AsyncClient:
+    """An HTTP client calling the app in-process; use it inside the test's event loop"""
+    transport = httpx.ASGITransport(app=server.app, **kwargs)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+async def login(http: httpx.AsyncClient, email: str = server.DEFAULT_ADMIN["email"], password: str = server.DEFAULT_ADMIN_PASSWORD) -> dict:
+    response = await http.post("/api/auth/login", json={"email": email, "password": password})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def bearer(token: dict) -> dict:
+    return {"Authorization": f"Bearer {token['access_token']}"}
+
+
+CITIZEN = {"email": "citizen@impnet.ru", "username": "citizen", "full_name": "Иванов Иван Иванович", "password": "secret"}
+
+
+async def register(http: httpx.AsyncClient, **fields) -> dict:
+    response = await http.post("/api/auth/register", json={**CITIZEN, **fields})
+    assert response.status_code == 200, response.text
+    return response.json()
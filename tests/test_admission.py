@@ -0,0 +1,234 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+import server
+
+
+def take(limiter, key: str = "auth:ip:10.0.0.1", rate: float = 2, burst: int = 3, times: int = 1):
+    async def acquire():
+        return [await limiter.acquire(key, rate, burst) for _ in range(times)]
+
+    return asyncio.run(acquire())
+
+
+def controller(clock, max_concurrency: int = 0, rate: float = 0.1, burst: int = 1, max_body_size: int = 0, **options):
+    route_class = admission.RouteClass(
+        "auth", [("POST", "/login")], rate, burst, max_concurrency, key_by_user=options.pop("key_by_user", False), max_body_size=max_body_size
+    )
+    return admission.AdmissionController([route_class], limiter=admission.LocalRateLimiter(clock=clock), **options)
+
+
+async def ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def post(app, path: str = "/login", client=("10.0.0.1", 5000), **kwargs) -> httpx.Response:
+    async def request():
+        transport = httpx.ASGITransport(app=app, client=client)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await http.post(path, **kwargs)
+
+    return asyncio.run(request())
+
+
+@pytest.fixture(params=["local", "mongo"])
+def limiter_factory(request, clock):
+    if request.param == "local":
+        return lambda: admission.LocalRateLimiter(clock=clock)
+    database = request.getfixturevalue("db")
+    return lambda: admission.MongoRateLimiter(database.rate_limits, clock=clock)
+
+
+def test_burst_is_admitted_then_refused_until_a_token_refills(limiter_factory, clock):
+    limiter = limiter_factory()
+    assert take(limiter, times=3) == [0, 0, 0]
+    assert take(limiter) == [pytest.approx(0.5)]
+    # A refused request takes nothing
+    assert take(limiter) == [pytest.approx(0.5)]
+    clock.advance(0.5)
+    assert take(limiter) == [0]
+    assert take(limiter) == [pytest.approx(0.5)]
+
+
+def test_idle_bucket_refills_to_the_full_burst(limiter_factory, clock):
+    limiter = limiter_factory()
+    take(limiter, times=3)
+    clock.advance(60)
+    assert take(limiter, times=3) == [0, 0, 0]
+    assert take(limiter)[0] > 0
+
+
+def test_buckets_are_per_key(limiter_factory):
+    limiter = limiter_factory()
+    take(limiter, key="a", times=3)
+    assert take(limiter, key="a")[0] > 0
+    assert take(limiter, key="b") == [0]
+
+
+def test_mongo_buckets_are_shared_by_workers(db, clock):
+    workers = [admission.MongoRateLimiter(db.rate_limits, clock=clock) for _ in range(2)]
+    assert take(workers[0], times=2) + take(workers[1]) == [0, 0, 0]
+    assert take(workers[1])[0] == pytest.approx(0.5)
+    assert take(workers[0])[0] == pytest.approx(0.5)
+
+
+def test_local_limiter_forgets_least_recently_seen_keys(clock):
+    limiter = admission.LocalRateLimiter(max_keys=2, clock=clock)
+    take(limiter, key="a", times=3)
+    take(limiter, key="b")
+    take(limiter, key="c")
+    assert take(limiter, key="a", times=3) == [0, 0, 0]
+
+
+def test_over_the_rate_gets_429_with_retry_after(clock):
+    app = admission.AdmissionMiddleware(ok, controller(clock, rate=0.1, burst=1))
+    assert post(app).status_code == 200
+    response = post(app)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+    clock.advance(4.5)
+    assert post(app).headers["Retry-After"] == "6"
+    clock.advance(5.5)
+    assert post(app).status_code == 200
+
+
+def test_other_routes_and_clients_are_not_limited(clock):
+    app = admission.AdmissionMiddleware(ok, controller(clock))
+    assert post(app).status_code == 200
+    assert post(app).status_code == 429
+    assert post(app, path="/other").status_code == 200
+    assert post(app, client=("10.0.0.2", 5000)).status_code == 200
+
+
+def test_forwarded_client_is_counted_from_the_trusted_proxies(clock):
+    # The ingress appends the address it saw; anything to its left came from the client
+    for trusted_proxies, second_status in ((1, 200), (2, 429), (0, 429)):
+        app = admission.AdmissionMiddleware(ok, controller(clock, trusted_proxies=trusted_proxies))
+        assert post(app, headers={"X-Forwarded-For": "spoofed, 192.0.2.1, 10.0.0.9"}).status_code == 200
+        assert post(app, headers={"X-Forwarded-For": "spoofed, 192.0.2.1, 10.0.0.8"}).status_code == second_status
+
+
+def test_short_forwarded_chain_falls_back_to_its_first_address(clock):
+    admission_control = controller(clock, trusted_proxies=3)
+    assert admission_control.client_ip({"headers": [(b"x-forwarded-for", b"192.0.2.1, 10.0.0.9")], "client": ("10.0.0.1", 1)}) == "192.0.2.1"
+    assert admission_control.client_ip({"headers": [], "client": ("10.0.0.1", 1)}) == "10.0.0.1"
+
+
+def test_user_keyed_buckets(clock):
+    identify = lambda scope: dict(scope["headers"]).get(b"x-user", b"").decode() or None  # noqa: E731
+    app = admission.AdmissionMiddleware(ok, controller(clock, key_by_user=True, identify_user=identify))
+    assert post(app, headers={"X-User": "alice"}).status_code == 200
+    assert post(app, headers={"X-User": "alice"}).status_code == 429
+    assert post(app, headers={"X-User": "bob"}).status_code == 200
+
+
+def test_failing_limiter_admits(clock):
+    class Broken:
+        async def acquire(self, key, rate, burst):
+            raise ConnectionError("mongo down")
+
+    admission_control = controller(clock)
+    admission_control.limiter = Broken()
+    app = admission.AdmissionMiddleware(ok, admission_control)
+    assert [post(app).status_code for _ in range(3)] == [200, 200, 200]
+    assert admission_control.route_classes[0].in_flight == 0
+
+
+def test_over_the_concurrency_cap_gets_503(clock):
+    admission_control = controller(clock, max_concurrency=1, rate=0)
+    route_class = admission_control.route_classes[0]
+
+    async def scenario():
+        entered, release = asyncio.Event(), asyncio.Event()
+
+        async def slow(scope, receive, send):
+            entered.set()
+            await release.wait()
+            await ok(scope, receive, send)
+
+        app = admission.AdmissionMiddleware(slow, admission_control)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            first = asyncio.create_task(http.post("/login"))
+            await entered.wait()
+            shed = await http.post("/login")
+            in_flight = route_class.in_flight
+            release.set()
+            return shed, in_flight, await first
+
+    shed, in_flight, first = asyncio.run(scenario())
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "1"
+    assert in_flight == 1
+    assert first.status_code == 200
+    assert route_class.in_flight == 0
+
+
+def test_slot_is_released_at_the_final_body_before_background_work(clock):
+    admission_control = controller(clock, max_concurrency=1, rate=0)
+    route_class = admission_control.route_classes[0]
+    seen = []
+
+    async def with_background(scope, receive, send):
+        await ok(scope, receive, send)
+        # Work after the response, like BackgroundTasks
+        seen.append(route_class.in_flight)
+
+    post(admission.AdmissionMiddleware(with_background, admission_control))
+    assert seen == [0]
+    assert route_class.in_flight == 0
+
+
+def test_declared_oversize_body_gets_413_without_a_slot(clock):
+    admission_control = controller(clock, max_concurrency=1, rate=0, max_body_size=10)
+    app = admission.AdmissionMiddleware(ok, admission_control)
+    assert post(app, content=b"x" * 11).status_code == 413
+    assert post(app, content=b"x" * 10).status_code == 200
+    assert admission_control.route_classes[0].in_flight == 0
+
+
+def login_admission(clock, trusted_proxies: int = 1):
+    """The server's own auth route class behind one proxy, echoing the body it was handed"""
+    async def echo(scope, receive, send):
+        message = await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": message["body"]})
+
+    auth = next(route_class for route_class in server.admission_control.route_classes if route_class.name == "auth")
+    admission_control = admission.AdmissionController([auth], limiter=admission.LocalRateLimiter(clock=clock), trusted_proxies=trusted_proxies)
+    return admission.AdmissionMiddleware(echo, admission_control), auth
+
+
+def test_accounts_behind_one_proxy_address_do_not_share_a_bucket(clock):
+    app, auth = login_admission(clock)
+    proxied = {"X-Forwarded-For": "192.0.2.1", "Content-Type": "application/json"}
+    login = lambda email: post(app, path="/api/auth/login", client=("10.0.0.1", 5000), headers=proxied, json={"email": email, "password": "x"})  # noqa: E731
+    statuses = [login("alice@impnet.ru").status_code for _ in range(auth.burst + 1)]
+    assert statuses == [200] * auth.burst + [429]
+    assert login("ALICE@impnet.ru ").status_code == 429
+    response = login("bob@impnet.ru")
+    assert response.status_code == 200
+    # The app still gets the body the middleware read
+    assert response.json() == {"email": "bob@impnet.ru", "password": "x"}
+
+
+def test_oversize_login_body_is_refused_while_reading(clock):
+    app, auth = login_admission(clock)
+
+    async def chunked():
+        yield b"x" * auth.max_body_size
+        yield b"x"
+
+    assert post(app, path="/api/auth/login", content=chunked()).status_code == 413
+    assert auth.in_flight == 0
+
+
+def test_login_account():
+    assert server.login_account(b'{"email": " Alice@Impnet.ru", "password": "x"}') == "alice@impnet.ru"
+    assert server.login_account(b'{"username": "Bob", "password": "x"}') == "bob"
+    for body in (b"", b"not json", b"[]", b'{"email": 1}'):
+        assert server.login_account(body) is None
@@ -0,0 +1,95 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+
+import server
+from tests.conftest import api_client, bearer, login
+
+CITIZENS = 10
+USER_COLUMNS = list(server.EXPORT_DATASETS["users"]["fields"])
+
+
+@pytest.fixture
+def citizens(seeded, monkeypatch):
+    """Ten citizens with a document each, exported in chunks of three"""
+    monkeypatch.setattr(server, "EXPORT_CHUNK_SIZE", 3)
+    role_id = server.role_registry.get_by_name("citizen").id
+
+    async def seed():
+        users = [
+            server.with_search_keys(server.User(
+                email=f"citizen{index}@impnet.ru", username=f"citizen{index}", full_name=f"Гражданин {index}",
+                role_id=role_id, hashed_password="$2b$04$secret", profile_data={"city": "Москва"},
+            ).dict())
+            for index in range(CITIZENS)
+        ]
+        await server.db.users.insert_many(users)
+        await server.db.documents.insert_many([
+            {"id": f"doc{index}", "user_id": user["id"], "type": "other", "filename": "a.pdf", "file_size": index,
+             "file_path": "uploads/a.pdf", "created_at": datetime(2025, 1, 1)}
+            for index, user in enumerate(users)
+        ])
+        return {user["id"] for user in users}
+
+    return asyncio.run(seed())
+
+
+def export(path: str, **params) -> bytes:
+    async def scenario():
+        async with api_client() as http:
+            response = await http.get(path, params=params, headers=bearer(await login(http)))
+            assert response.status_code == 200, response.text
+            return response
+
+    return asyncio.run(scenario())
+
+
+def check_users(rows: list, columns: list, citizens: set):
+    assert columns == USER_COLUMNS
+    assert "hashed_password" not in columns and "search" not in columns
+    ids = [row["id"] for row in rows]
+    # Admin plus every citizen, each once, across chunk boundaries
+    assert len(ids) == len(set(ids)) == CITIZENS + 1
+    assert citizens < set(ids)
+
+
+def test_ndjson_export(citizens):
+    response = export("/api/admin/export/users", format="ndjson")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    check_users(rows, list(rows[0]), citizens)
+    citizen = next(row for row in rows if row["username"] == "citizen0")
+    assert json.loads(citizen["profile_data"]) == {"city": "Москва"}
+    assert datetime.fromisoformat(citizen["created_at"])
+
+
+def test_csv_export_has_one_header(citizens):
+    response = export("/api/admin/export/users", format="csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="users.csv"'
+    reader = csv.DictReader(io.StringIO(response.text))
+    rows = list(reader)
+    check_users(rows, reader.fieldnames, citizens)
+    assert all(row["id"] != "id" for row in rows)
+
+
+def test_parquet_export(citizens):
+    pq = pytest.importorskip("pyarrow.parquet")
+    parquet = pq.ParquetFile(io.BytesIO(export("/api/admin/export/users", format="parquet").content))
+    # One row group per chunk
+    assert parquet.num_row_groups == 4
+    table = parquet.read()
+    check_users(table.to_pylist(), table.column_names, citizens)
+
+
+def test_export_filtered_by_owner_role(citizens):
+    response = export("/api/admin/export/documents", format="ndjson", role="citizen")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(row["id"] for row in rows) == [f"doc{index}" for index in range(CITIZENS)]
+    assert list(rows[0]) == list(server.EXPORT_DATASETS["documents"]["fields"])
+    assert export("/api/admin/export/documents", format="csv", role="super_admin").text.splitlines() == [
+        ",".join(server.EXPORT_DATASETS["documents"]["fields"])
+    ]
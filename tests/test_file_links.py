@@ -0,0 +1,92 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import server
+from tests.conftest import api_client, bearer, login, register
+
+URL = "/api/files/blobs/ab/abcdef-1234.jpg"
+
+
+def signed_query(url: str) -> dict:
+    return {name: values[0] for name, values in parse_qs(urlsplit(url).query).items()}
+
+
+def test_signed_url_verifies_for_its_owner_and_path():
+    query = signed_query(server.sign_file_url(URL, "user-1"))
+    assert query["uid"] == "user-1"
+    assert server.verify_file_url(URL, "user-1", int(query["expires"]), query["signature"])
+
+
+def test_signature_is_scoped_to_user_path_and_expiry():
+    query = signed_query(server.sign_file_url(URL, "user-1"))
+    expires, signature = int(query["expires"]), query["signature"]
+    assert not server.verify_file_url(URL, "user-2", expires, signature)
+    assert not server.verify_file_url(URL.replace(".jpg", ".thumb.webp"), "user-1", expires, signature)
+    assert not server.verify_file_url(URL, "user-1", expires + server.FILE_URL_WINDOW_SECONDS, signature)
+
+
+def test_url_is_stable_within_a_window_and_expires(monkeypatch):
+    window = server.FILE_URL_WINDOW_SECONDS
+    now = 100 * window + 10
+    monkeypatch.setattr(server.time, "time", lambda: now)
+    url = server.sign_file_url(URL, "user-1")
+    now += window - 20
+    assert server.sign_file_url(URL, "user-1") == url
+
+    query = signed_query(url)
+    assert int(query["expires"]) == 102 * window
+    now = 102 * window + 1
+    assert not server.verify_file_url(URL, "user-1", int(query["expires"]), query["signature"])
+
+
+def test_file_access_cache_invalidates_one_pair(monotonic):
+    cache = server.TTLCache(maxsize=10, ttl=300)
+    cache.put(("user-1", "uploads/a.jpg"), "image/jpeg")
+    cache.put(("user-1", "uploads/b.jpg"), "image/jpeg")
+    cache.invalidate(("user-1", "uploads/a.jpg"))
+    assert cache.get(("user-1", "uploads/a.jpg")) is None
+    assert cache.get(("user-1", "uploads/b.jpg")) == "image/jpeg"
+    monotonic.advance(301)
+    assert cache.get(("user-1", "uploads/b.jpg")) is None
+
+
+def signed_download(deactivate, advance=None):
+    """Upload as a citizen, fetch the signed link, deactivate the owner with `deactivate(http, user_id)` and fetch it again"""
+    async def scenario():
+        async with api_client() as http:
+            token = await register(http)
+            headers = bearer(token)
+            response = await http.post(
+                "/api/documents/upload", files={"file": ("scan.pdf", b"%PDF-1.4", "application/pdf")},
+                data={"document_type": "other"}, headers=headers,
+            )
+            document = response.json()
+            before = await http.get(document["url"])
+            await deactivate(http, token["user"]["id"])
+            statuses = [(await http.get(document["url"])).status_code]
+            if advance is not None:
+                advance()
+                statuses.append((await http.get(document["url"])).status_code)
+            return before, statuses
+
+    return asyncio.run(scenario())
+
+
+def test_signed_link_stops_working_when_the_owner_is_deactivated(seeded, file_store):
+    async def deactivate(http, user_id):
+        response = await http.patch(f"/api/users/{user_id}", json={"is_active": False}, headers=bearer(await login(http)))
+        assert response.status_code == 200
+
+    before, statuses = signed_download(deactivate)
+    assert before.status_code == 200
+    assert before.content == b"%PDF-1.4"
+    assert statuses == [403]
+
+
+def test_deactivation_by_another_worker_reaches_links_within_the_cache_ttl(seeded, file_store, monotonic):
+    async def deactivate_elsewhere(http, user_id):
+        await server.db.users.update_one({"id": user_id}, {"$set": {"is_active": False}})
+
+    before, statuses = signed_download(deactivate_elsewhere, advance=lambda: monotonic.advance(server.PRINCIPAL_CACHE_TTL + 1))
+    assert before.status_code == 200
+    assert statuses == [200, 403]
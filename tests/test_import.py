@@ -0,0 +1,119 @@
+import asyncio
+import io
+import json
+
+import server
+from tests.conftest import api_client, bearer, login
+
+CSV = """email,username,full_name,password,role
+first@impnet.ru,first,Первый Пользователь,secret,
+admin@impnet.ru,taken-email,Дубликат Почты,secret,
+second@impnet.ru,second,Второй Пользователь,secret,mfc_employee
+not-an-email,broken,Сломанная Строка,secret,
+first@impnet.ru,again,Дубликат В Файле,secret,
+third@impnet.ru,third,Третий Пользователь,secret,no_such_role
+fourth@impnet.ru,fourth,Четвёртый Пользователь,secret,
+"""
+
+
+def import_csv(text: str, batch_size: int = 2) -> server.ImportReport:
+    return asyncio.run(server.import_users(server.iter_import_rows(io.StringIO(text), "csv"), batch_size=batch_size))
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(seeded):
+    report = import_csv(CSV)
+    assert report.processed == 7
+    assert report.inserted == 3
+    errors = {error.row: error.error for error in report.errors}
+    assert sorted(errors) == [2, 4, 5, 6]
+    assert errors[2].startswith("Duplicate") and errors[5].startswith("Duplicate")
+    assert "Unknown role" in errors[6]
+
+    usernames = asyncio.run(server.db.users.distinct("username"))
+    assert sorted(usernames) == ["admin", "first", "fourth", "second"]
+
+
+def test_imported_users_get_the_default_role_unless_one_is_named(seeded):
+    import_csv(CSV)
+
+    async def roles():
+        return {user["username"]: user["role_id"] async for user in server.db.users.find({}, {"username": 1, "role_id": 1})}
+
+    role_ids = asyncio.run(roles())
+    citizen = server.role_registry.get_by_name("citizen").id
+    assert role_ids["first"] == role_ids["fourth"] == citizen
+    assert role_ids["second"] == server.role_registry.get_by_name("mfc_employee").id
+
+
+def test_imported_users_can_log_in_and_are_searchable(seeded):
+    import_csv(CSV)
+
+    async def scenario():
+        async with api_client() as http:
+            return await login(http, "fourth@impnet.ru", "secret"), await server.db.users.find_one({"username": "fourth"})
+
+    token, user = asyncio.run(scenario())
+    assert token["user"]["username"] == "fourth"
+    assert user["search"]["name_tokens"] == ["пользователь", "четвертый пользователь"]
+
+
+def post_import(content: str = CSV, filename: str = "citizens.csv"):
+    """Queue an import as the admin; the background job runs before the client gets the response back"""
+    async def scenario():
+        async with api_client() as http:
+            headers = bearer(await login(http))
+            queued = await http.post("/api/users/import", files={"file": (filename, content.encode())}, headers=headers)
+            polled = await http.get(f"/api/users/import/{queued.json()['id']}", headers=headers)
+            return queued, polled
+
+    return asyncio.run(scenario())
+
+
+def test_import_job_moves_from_queued_through_running_to_completed(seeded, file_store, monkeypatch):
+    seen = []
+    import_users = server.import_users
+
+    async def observed(rows, create_passports, progress=None):
+        seen.append((await server.db.import_jobs.find_one({}))["status"])
+
+        async def record(report):
+            seen.append(report.processed)
+            await progress(report)
+
+        return await import_users(rows, create_passports, batch_size=3, progress=record)
+
+    monkeypatch.setattr(server, "import_users", observed)
+    queued, polled = post_import()
+    assert queued.status_code == 202
+    assert queued.json()["status"] == "queued"
+    assert seen == ["running", 3, 6, 7]
+    job = polled.json()
+    assert job["status"] == "completed"
+    assert job["report"]["inserted"] == 3
+    assert sorted(error["row"] for error in job["report"]["errors"]) == [2, 4, 5, 6]
+    assert list(file_store.root.joinpath("uploads", "tmp").iterdir()) == []
+
+
+def test_failed_import_job_records_the_error(seeded, file_store, monkeypatch):
+    async def broken(rows, create_passports, progress=None):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(server, "import_users", broken)
+    queued, polled = post_import()
+    job = polled.json()
+    assert job["status"] == "failed"
+    assert job["error"] == "database went away"
+    assert list(file_store.root.joinpath("uploads", "tmp").iterdir()) == []
+
+
+def test_ndjson_import_reports_unparseable_lines(seeded, file_store):
+    lines = [
+        json.dumps({"email": "n1@impnet.ru", "username": "n1", "full_name": "Эн Один", "password": "secret"}),
+        "{not json",
+        json.dumps({"email": "n2@impnet.ru", "username": "n2", "full_name": "Эн Два", "password": "secret"}),
+    ]
+    _, polled = post_import(content="\n".join(lines), filename="citizens.ndjson")
+    job = polled.json()
+    assert job["format"] == "ndjson"
+    assert job["report"]["inserted"] == 2
+    assert [error["row"] for error in job["report"]["errors"]] == [2]
@@ -0,0 +1,104 @@
+import asyncio
+import math
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from tests.conftest import api_client, bearer, register
+
+Allocator = server.PassportNumberAllocator
+
+
+def test_sequence_mapping_is_a_permutation():
+    assert math.gcd(Allocator.MULTIPLIER, Allocator.SPACE) == 1
+    count = 100_000
+    numbers = {(sequence * Allocator.MULTIPLIER + Allocator.OFFSET) % Allocator.SPACE for sequence in range(count)}
+    assert len(numbers) == count
+
+
+def test_consecutive_numbers_are_spread():
+    first, second = ((sequence * Allocator.MULTIPLIER + Allocator.OFFSET) % Allocator.SPACE for sequence in (0, 1))
+    assert abs(first - second) > 10**6
+
+
+def test_workers_sharing_the_counter_never_repeat(db):
+    async def allocate():
+        workers = [Allocator(block_size=7) for _ in range(3)]
+        return await asyncio.gather(*(worker.allocate() for worker in workers for _ in range(50)))
+
+    pairs = asyncio.run(allocate())
+    assert len(set(pairs)) == len(pairs) == 150
+    for series, number in pairs:
+        assert len(series) == 4 and len(number) == 6
+        assert (series + number).isdigit()
+
+
+def test_blocks_are_leased_with_one_counter_update(db):
+    async def allocate():
+        allocator = Allocator(block_size=10)
+        for _ in range(25):
+            await allocator.allocate()
+        return await db.counters.find_one({"_id": "passport_number"})
+
+    assert asyncio.run(allocate())["value"] == 30
+
+
+def test_exhausted_space_is_refused(db):
+    async def allocate():
+        await db.counters.insert_one({"_id": "passport_number", "value": Allocator.SPACE})
+        await Allocator(block_size=1).allocate()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(allocate())
+    assert error.value.status_code == 503
+
+
+PASSPORT = {
+    "first_name": "Иван", "last_name": "Иванов", "middle_name": "Иванович", "birth_date": "1990-01-01",
+    "birth_place": "г. Москва", "gender": "М", "issue_place": "МФЦ",
+}
+
+
+def number_for(sequence: int) -> tuple:
+    digits = f"{(sequence * Allocator.MULTIPLIER + Allocator.OFFSET) % Allocator.SPACE:010d}"
+    return digits[:4], digits[4:]
+
+
+def create_passport(legacy_sequences) -> tuple:
+    """Seed legacy passports on the numbers of the given sequence values, then create a passport twice for one user"""
+    async def scenario():
+        for sequence in legacy_sequences:
+            series, number = number_for(sequence)
+            await server.db.passports.insert_one({"id": f"legacy{sequence}", "user_id": f"legacy{sequence}", "series": series, "number": number})
+        async with api_client() as http:
+            headers = bearer(await register(http))
+            return await http.post("/api/passport", json=PASSPORT, headers=headers), await http.post("/api/passport", json=PASSPORT, headers=headers)
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def fresh_allocator(seeded, monkeypatch):
+    monkeypatch.setattr(server, "passport_numbers", Allocator(block_size=10))
+
+
+def test_passport_gets_the_first_allocated_number(fresh_allocator):
+    created, again = create_passport([])
+    assert created.status_code == 200
+    assert (created.json()["series"], created.json()["number"]) == number_for(0)
+    assert again.status_code == 400
+
+
+def test_legacy_number_collision_takes_the_next_number(fresh_allocator, caplog):
+    created, again = create_passport([0, 1])
+    assert created.status_code == 200
+    assert (created.json()["series"], created.json()["number"]) == number_for(2)
+    assert again.status_code == 400
+    collisions = [record for record in caplog.records if "legacy passport" in record.getMessage()]
+    assert [record.getMessage().split()[2:4] for record in collisions] == [list(number_for(0)), list(number_for(1))]
+
+
+def test_collisions_past_the_attempt_limit_are_503(fresh_allocator):
+    created, _ = create_passport(range(server.PASSPORT_NUMBER_ATTEMPTS))
+    assert created.status_code == 503
@@ -0,0 +1,45 @@
+import server
+
+
+def principal(user_id: str, email: str) -> server.Principal:
+    user = server.User(id=user_id, email=email, username=email.split("@")[0], full_name="Test User", role_id="role", hashed_password="x")
+    return server.Principal(user=user, permissions=frozenset({"user"}))
+
+
+def test_cached_principal_expires_after_ttl(monotonic):
+    cache = server.PrincipalCache(maxsize=10, ttl=60)
+    cache.put("a@impnet.ru", principal("1", "a@impnet.ru"))
+    monotonic.advance(59)
+    assert cache.get("a@impnet.ru").user.id == "1"
+    monotonic.advance(2)
+    assert cache.get("a@impnet.ru") is None
+    assert cache.stats()["size"] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_principal_is_evicted(monotonic):
+    cache = server.PrincipalCache(maxsize=2, ttl=60)
+    cache.put("a@impnet.ru", principal("1", "a@impnet.ru"))
+    cache.put("b@impnet.ru", principal("2", "b@impnet.ru"))
+    cache.get("a@impnet.ru")
+    cache.put("c@impnet.ru", principal("3", "c@impnet.ru"))
+    assert cache.get("b@impnet.ru") is None
+    assert cache.get("a@impnet.ru") is not None
+    assert cache.evictions == 1
+
+
+def test_invalidate_user_id_drops_every_subject_of_that_user(monotonic):
+    cache = server.PrincipalCache(maxsize=10, ttl=60)
+    cache.put("old@impnet.ru", principal("1", "old@impnet.ru"))
+    cache.put("new@impnet.ru", principal("1", "new@impnet.ru"))
+    cache.put("other@impnet.ru", principal("2", "other@impnet.ru"))
+    cache.invalidate_user_id("1")
+    assert cache.get("old@impnet.ru") is None
+    assert cache.get("new@impnet.ru") is None
+    assert cache.get("other@impnet.ru").user.id == "2"
+
+
+def test_zero_size_disables_caching(monotonic):
+    cache = server.PrincipalCache(maxsize=0, ttl=60)
+    cache.put("a@impnet.ru", principal("1", "a@impnet.ru"))
+    assert cache.get("a@impnet.ru") is None
@@ -0,0 +1,50 @@
+import asyncio
+
+import server
+from tests.conftest import api_client, bearer, login, register
+
+
+def reset(caller: str):
+    """POST /api/reset-database as "anonymous", "citizen" or "admin"; returns the response and the user count after"""
+    async def scenario():
+        async with api_client() as http:
+            headers = {}
+            if caller == "citizen":
+                headers = bearer(await register(http))
+            elif caller == "admin":
+                headers = bearer(await login(http))
+            response = await http.post("/api/reset-database", headers=headers)
+            return response, await server.db.users.count_documents({})
+
+    return asyncio.run(scenario())
+
+
+def test_anonymous_reset_is_refused(seeded, monkeypatch):
+    monkeypatch.setattr(server, "ALLOW_DATABASE_RESET", True)
+    response, users = reset("anonymous")
+    assert response.status_code in (401, 403)
+    assert users == 1
+
+
+def test_non_admin_reset_is_refused(seeded, monkeypatch):
+    monkeypatch.setattr(server, "ALLOW_DATABASE_RESET", True)
+    response, users = reset("citizen")
+    assert response.status_code == 403
+    assert users == 2
+
+
+def test_reset_is_off_unless_allowed(seeded):
+    response, users = reset("admin")
+    assert response.status_code == 403
+    assert users == 1
+
+
+def test_allowed_admin_reset_leaves_stored_files_to_reconciliation(seeded, monkeypatch):
+    monkeypatch.setattr(server, "ALLOW_DATABASE_RESET", True)
+    reconciled = []
+    monkeypatch.setattr(server.storage_collector, "reconcile", lambda *args: reconciled.append(args))
+    response, users = reset("admin")
+    assert response.status_code == 200
+    # Only the re-seeded admin is left
+    assert users == 1
+    assert reconciled == []
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+import server
+from tests.conftest import api_client, bearer, login, register
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Иванов", "иванов"),
+    ("ФЁДОРОВ Пётр", "федоров петр"),
+    ("  Анна\t Мария\n", "анна мария"),
+    ("Ｉｖａｎｏｖ", "ivanov"),
+    ("Straße", "strasse"),
+])
+def test_normalize_search_text(text, expected):
+    assert server.normalize_search_text(text) == expected
+
+
+def test_name_tokens_start_at_every_word():
+    assert server.name_search_tokens("Семёнов  Илья Олегович") == [
+        "илья олегович", "олегович", "семенов илья олегович",
+    ]
+
+
+def test_repeated_words_give_one_token_each():
+    assert server.name_search_tokens("Анна Анна") == ["анна", "анна анна"]
+
+
+@pytest.mark.parametrize("key", ["иванов иван", "citizen42@impnet.ru", None])
+def test_cursor_round_trip(key):
+    object_id = ObjectId()
+    cursor = server.encode_search_cursor(key, object_id)
+    assert server.decode_search_cursor(cursor) == (key, object_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "junk", "WyJ4Il0=", "WyJ4IiwgIm5vdC1hbi1pZCJd"])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        server.decode_search_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_backfill_adds_name_tokens_to_old_users(db):
+    async def scenario():
+        await db.users.insert_many([
+            {"email": "Old@Impnet.ru", "username": "Old", "full_name": "Пётр Старый", "search": {"name": "петр старый"}},
+            server.with_search_keys({"email": "new@impnet.ru", "username": "new", "full_name": "Новый"}),
+        ])
+        updated = await server.backfill_search_keys(batch_size=1)
+        return updated, await db.users.find_one({"username": "Old"})
+
+    updated, user = asyncio.run(scenario())
+    assert updated == 1
+    assert user["search"] == {"name_tokens": ["петр старый", "старый"], "email": "old@impnet.ru", "username": "old"}
+
+
+PASSPORT = {
+    "first_name": "Мария", "last_name": "Иванова", "birth_date": "1985-05-05",
+    "birth_place": "г. Москва", "gender": "Ж", "issue_place": "МФЦ",
+}
+
+
+def test_search_returns_citizens_but_not_staff(seeded):
+    async def scenario():
+        async with api_client() as http:
+            await register(http)
+            staff_token = await register(http, email="staff@impnet.ru", username="staff", full_name="Иванова Мария Петровна")
+            passport = (await http.post("/api/passport", json=PASSPORT, headers=bearer(staff_token))).json()
+            employee = server.role_registry.get_by_name("mfc_employee")
+            await server.db.users.update_one({"id": staff_token["user"]["id"]}, {"$set": {"role_id": employee.id}})
+
+            headers = bearer(await login(http))
+            searches = [
+                {"q": "иванов"},
+                {"q": "staff@", "field": "email"},
+                {"q": "sta", "field": "username"},
+                {"q": "админ"},
+                {"series": passport["series"], "number": passport["number"]},
+            ]
+            results = []
+            for params in searches:
+                response = await http.get("/api/citizens/search", params=params, headers=headers)
+                assert response.status_code == 200, response.text
+                results.append([user["email"] for user in response.json()])
+            return results
+
+    names, emails, usernames, admins, passports = asyncio.run(scenario())
+    assert names == ["citizen@impnet.ru"]
+    assert emails == usernames == admins == passports == []
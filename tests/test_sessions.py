@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from tests.conftest import api_client, login
+
+
+async def refresh(http, token: str):
+    return await http.post("/api/auth/refresh", json={"refresh_token": token})
+
+
+def run(scenario):
+    async def with_client():
+        async with api_client() as http:
+            return await scenario(http)
+
+    return asyncio.run(with_client())
+
+
+def test_refresh_rotates_the_token(seeded):
+    async def scenario(http):
+        first = (await login(http))["refresh_token"]
+        rotated = await refresh(http, first)
+        return first, rotated, await refresh(http, first), await refresh(http, rotated.json()["refresh_token"])
+
+    first, rotated, replayed, next_rotation = run(scenario)
+    assert rotated.status_code == 200
+    assert rotated.json()["refresh_token"] != first
+    assert rotated.json()["access_token"]
+    assert replayed.status_code == 401
+    # Inside the grace window a replay is refused but the session lives on
+    assert next_rotation.status_code == 200
+
+
+def test_reused_token_revokes_the_session(seeded, monkeypatch):
+    monkeypatch.setattr(server, "REFRESH_REUSE_GRACE_SECONDS", 0)
+
+    async def scenario(http):
+        first = (await login(http))["refresh_token"]
+        current = (await refresh(http, first)).json()["refresh_token"]
+        replayed = await refresh(http, first)
+        return replayed, await refresh(http, current), await server.db.sessions.find_one({})
+
+    replayed, current, session = run(scenario)
+    assert replayed.status_code == 401
+    assert current.status_code == 401
+    assert session["revoked_at"] is not None
+
+
+def test_expired_session_is_refused(seeded):
+    async def scenario(http):
+        token = (await login(http))["refresh_token"]
+        await server.db.sessions.update_many({}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        return await refresh(http, token)
+
+    assert run(scenario).status_code == 401
+
+
+def test_inactive_user_cannot_refresh(seeded):
+    async def scenario(http):
+        token = (await login(http))["refresh_token"]
+        await server.db.users.update_many({}, {"$set": {"is_active": False}})
+        server.principal_cache.clear()
+        return await refresh(http, token), await server.db.sessions.find_one({})
+
+    response, session = run(scenario)
+    assert response.status_code == 401
+    assert session["revoked_at"] is not None
+
+
+def test_logout_revokes_only_that_session(seeded):
+    async def scenario(http):
+        laptop = (await login(http))["refresh_token"]
+        phone = (await login(http))["refresh_token"]
+        logout = await http.post("/api/auth/logout", json={"refresh_token": laptop})
+        return logout, await refresh(http, laptop), await refresh(http, phone)
+
+    logout, laptop, phone = run(scenario)
+    assert logout.status_code == 200
+    assert laptop.status_code == 401
+    assert phone.status_code == 200
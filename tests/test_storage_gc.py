@@ -0,0 +1,171 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+import server
+from tests.conftest import FakeClock
+
+BLOB_ID = "ab" * 32
+BLOB_KEY = f"uploads/blobs/ab/{BLOB_ID}-0001.pdf"
+THUMBNAIL_KEY = f"uploads/blobs/ab/{BLOB_ID}-0001.thumb.webp"
+LEGACY_KEY = "uploads/owner/legacy.pdf"
+ORPHAN_KEY = "uploads/owner/orphan.pdf"
+
+
+@pytest.fixture
+def wall_clock():
+    return FakeClock(time.time())
+
+
+@pytest.fixture
+def collector(db, file_store, wall_clock):
+    return server.StorageCollector(
+        server.IOBudget(0), batch_size=2, reaper_interval=1, reconcile_interval=0,
+        lease_seconds=300, min_age_seconds=3600, clock=wall_clock,
+    )
+
+
+def store(file_store, *keys):
+    for key in keys:
+        path = file_store.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"content")
+
+
+def exists(file_store, key) -> bool:
+    return file_store.path(key).exists()
+
+
+def document(document_id: str, **fields) -> dict:
+    return {"id": document_id, "user_id": "owner", "file_size": 7, **fields}
+
+
+async def seed_blob(db, ref_count: int, **fields):
+    await db.blobs.insert_one({
+        "_id": BLOB_ID, "file_path": BLOB_KEY, "derivatives": {"thumbnail": THUMBNAIL_KEY},
+        "ref_count": ref_count, "file_size": 7, "created_at": datetime.utcnow(), **fields,
+    })
+
+
+def test_referenced_files_survive_reconciliation(db, file_store, collector, wall_clock):
+    store(file_store, BLOB_KEY, THUMBNAIL_KEY, LEGACY_KEY, ORPHAN_KEY, "uploads/tmp/upload.part")
+
+    async def scenario():
+        await db.users.insert_one({"id": "owner"})
+        await seed_blob(db, 1)
+        await db.documents.insert_many([
+            document("blobbed", blob_id=BLOB_ID, file_path=BLOB_KEY),
+            document("legacy", file_path=LEGACY_KEY),
+        ])
+        wall_clock.advance(2 * 3600)
+        return await collector.reconcile()
+
+    report = asyncio.run(scenario())
+    assert report["orphaned_files"] == 1
+    assert report["blobs_reclaimed"] == report["blobs_repaired"] == 0
+    assert not exists(file_store, ORPHAN_KEY)
+    for key in (BLOB_KEY, THUMBNAIL_KEY, LEGACY_KEY, "uploads/tmp/upload.part"):
+        assert exists(file_store, key)
+
+
+def test_reconciliation_spares_young_files(db, file_store, collector, wall_clock):
+    store(file_store, ORPHAN_KEY)
+
+    async def scenario():
+        young = await collector.reconcile()
+        wall_clock.advance(3600 + 1)
+        return young, await collector.reconcile()
+
+    young, old = asyncio.run(scenario())
+    assert young["files_scanned"] == 1 and young["orphaned_files"] == 0
+    assert old["orphaned_files"] == 1
+    assert not exists(file_store, ORPHAN_KEY)
+
+
+def test_recently_referenced_blob_without_documents_waits_for_the_age_threshold(db, file_store, collector, wall_clock):
+    store(file_store, BLOB_KEY, THUMBNAIL_KEY)
+
+    async def scenario():
+        # An upload has taken the reference but not inserted its document yet
+        await seed_blob(db, 1, referenced_at=datetime.utcnow())
+        spared = await collector.reconcile()
+        wall_clock.advance(3600 + 1)
+        return spared, await collector.reconcile()
+
+    spared, reclaimed = asyncio.run(scenario())
+    assert spared["blobs_reclaimed"] == 0
+    assert reclaimed["blobs_reclaimed"] == 1
+    assert not exists(file_store, BLOB_KEY) and not exists(file_store, THUMBNAIL_KEY)
+
+
+def test_blob_referenced_again_before_the_sweep_survives(db, file_store):
+    store(file_store, BLOB_KEY, THUMBNAIL_KEY)
+
+    async def scenario():
+        await seed_blob(db, 1)
+        # Marked: the last reference is dropped...
+        marked = await db.blobs.find_one_and_update(
+            {"_id": BLOB_ID}, {"$inc": {"ref_count": -1}}, return_document=server.ReturnDocument.AFTER
+        )
+        # ...then an upload of the same content takes a new one before the sweep
+        await db.blobs.update_one({"_id": BLOB_ID}, {"$inc": {"ref_count": 1}})
+        return await server.delete_unreferenced_blob(marked), await db.blobs.find_one({"_id": BLOB_ID})
+
+    reclaimed, blob = asyncio.run(scenario())
+    assert reclaimed is None
+    assert blob["ref_count"] == 1
+    assert exists(file_store, BLOB_KEY) and exists(file_store, THUMBNAIL_KEY)
+
+
+def test_reaper_releases_shared_blobs_one_reference_at_a_time(db, file_store, collector, wall_clock):
+    store(file_store, BLOB_KEY, THUMBNAIL_KEY)
+
+    async def scenario():
+        await seed_blob(db, 2)
+        documents = [document(name, blob_id=BLOB_ID, file_path=BLOB_KEY) for name in ("first", "second")]
+        await db.documents.insert_many([dict(item) for item in documents])
+        await server.tombstone_document(documents[0])
+        wall_clock.advance(1)
+        first = await collector.reap(), await db.blobs.find_one({"_id": BLOB_ID})
+        await server.tombstone_document(documents[1])
+        wall_clock.advance(1)
+        return first, await collector.reap(), await db.blobs.count_documents({}), await db.tombstones.count_documents({})
+
+    (reaped, blob), reaped_last, blobs, tombstones = asyncio.run(scenario())
+    assert reaped == 1 and blob["ref_count"] == 1
+    assert reaped_last == 1 and blobs == 0 and tombstones == 0
+    assert not exists(file_store, BLOB_KEY) and not exists(file_store, THUMBNAIL_KEY)
+
+
+def test_claimed_tombstone_is_retried_only_after_its_lease(db, file_store, collector, wall_clock, monkeypatch):
+    store(file_store, LEGACY_KEY)
+    delete_many = file_store.delete_many
+    failures = []
+
+    async def failing_once(keys):
+        if not failures:
+            failures.append(keys)
+            raise OSError("storage unavailable")
+        await delete_many(keys)
+
+    monkeypatch.setattr(file_store, "delete_many", failing_once)
+
+    async def scenario():
+        legacy = document("legacy", file_path=LEGACY_KEY)
+        await db.documents.insert_one(dict(legacy))
+        await server.tombstone_document(legacy)
+        wall_clock.advance(1)
+        passes = [await collector.reap()]
+        # The claim is still leased: no other pass may touch it
+        wall_clock.advance(299)
+        passes.append(await collector.reap())
+        wall_clock.advance(2)
+        passes.append(await collector.reap())
+        return passes, await db.tombstones.count_documents({})
+
+    passes, tombstones = asyncio.run(scenario())
+    assert passes == [0, 0, 1]
+    assert tombstones == 0
+    assert not exists(file_store, LEGACY_KEY)
@@ -0,0 +1,109 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+import server
+from tests.conftest import api_client, bearer, register
+
+
+async def upload(http, headers, content: bytes = b"%PDF-1.4 scan", filename: str = "scan.pdf"):
+    """Upload a file; returns the stored document record"""
+    response = await http.post(
+        "/api/documents/upload",
+        files={"file": (filename, content, "application/pdf")},
+        data={"document_type": "other"},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return await server.db.documents.find_one({"id": response.json()["id"]})
+
+
+def stored_keys(file_store) -> list:
+    return sorted(path.relative_to(file_store.root).as_posix() for path in (file_store.root / "uploads" / "blobs").rglob("*") if path.is_file())
+
+
+@pytest.mark.parametrize("filename, suffix", [
+    ("scan.pdf", ".pdf"),
+    ("Scan.JPEG", ".JPEG"),
+    ("archive.tar.gz", ".gz"),
+    ("no-extension", ""),
+    ("trailing.", ""),
+    ("x.a/b", ""),
+    ("x.../../etc", ""),
+    ("x.p d f", ""),
+    ("x." + "a" * 17, ""),
+    (None, ""),
+])
+def test_blob_suffix(filename, suffix):
+    assert server.blob_suffix(filename) == suffix
+
+
+def test_odd_file_names_store_flat_blob_keys(seeded, file_store):
+    async def scenario():
+        async with api_client() as http:
+            return await upload(http, bearer(await register(http)), filename="x.a/b")
+
+    document = asyncio.run(scenario())
+    [key] = stored_keys(file_store)
+    sha256 = document["blob_id"]
+    assert key.startswith(f"uploads/blobs/{sha256[:2]}/{sha256}-")
+    assert "." not in key.rsplit("/", 1)[-1]
+
+
+def test_identical_uploads_share_one_blob_until_both_are_deleted(seeded, file_store):
+    async def scenario():
+        async with api_client() as http:
+            headers = bearer(await register(http))
+            first = await upload(http, headers)
+            second = await upload(http, headers, filename="copy.pdf")
+            shared = await server.db.blobs.find_one({"_id": first["blob_id"]}), stored_keys(file_store)
+
+            await http.delete(f"/api/documents/{first['id']}", headers=headers)
+            tombstoned = await server.db.tombstones.count_documents({"_id": first["id"]})
+            await server.storage_collector.reap()
+            released = await server.db.blobs.find_one({"_id": first["blob_id"]}), stored_keys(file_store)
+
+            await http.delete(f"/api/documents/{second['id']}", headers=headers)
+            last_tombstone = await server.db.tombstones.find_one({"_id": second["id"]})
+            await server.storage_collector.reap()
+            return first, second, shared, tombstoned, released, last_tombstone, await server.db.blobs.count_documents({})
+
+    first, second, (blob, keys), tombstoned, (released, kept_keys), last_tombstone, blobs = asyncio.run(scenario())
+    assert first["blob_id"] == second["blob_id"]
+    assert blob["ref_count"] == 2
+    assert len(keys) == 1
+    assert tombstoned == 1
+    assert released["ref_count"] == 1
+    assert kept_keys == keys
+    assert last_tombstone["blob_id"] == first["blob_id"]
+    assert blobs == 0
+    assert stored_keys(file_store) == []
+
+
+def test_oversize_upload_is_413_and_leaves_nothing_behind(seeded, file_store, monkeypatch):
+    monkeypatch.setattr(server, "MAX_UPLOAD_SIZE", 100)
+
+    async def scenario():
+        async with api_client() as http:
+            headers = bearer(await register(http))
+            response = await http.post(
+                "/api/documents/upload", files={"file": ("big.pdf", b"x" * 101)}, data={"document_type": "other"}, headers=headers
+            )
+            return response, await server.db.usage.find_one({})
+
+    response, usage = asyncio.run(scenario())
+    assert response.status_code == 413
+    assert usage is None or usage["bytes"] == usage["objects"] == 0
+    assert stored_keys(file_store) == []
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
+
+
+def test_undeclared_oversize_stream_is_cut_off_at_the_limit(db, file_store, monkeypatch):
+    monkeypatch.setattr(server, "MAX_UPLOAD_SIZE", 100)
+    monkeypatch.setattr(server, "UPLOAD_CHUNK_SIZE", 30)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.save_uploaded_file(UploadFile(io.BytesIO(b"x" * 101), filename="big.pdf")))
+    assert error.value.status_code == 413
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
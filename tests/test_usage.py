@@ -0,0 +1,164 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException, UploadFile
+from starlette.datastructures import Headers
+
+import server
+from tests.conftest import CITIZEN, api_client, bearer, register
+
+
+@pytest.fixture
+def quota(monkeypatch):
+    """Default quotas of 1000 bytes and 5 documents for a user of no known role"""
+    monkeypatch.setattr(server, "DEFAULT_STORAGE_QUOTA_BYTES", 1000)
+    monkeypatch.setattr(server, "DEFAULT_DOCUMENT_QUOTA", 5)
+    return server.User(email="quota@impnet.ru", username="quota", full_name="Квотов", role_id="no-such-role", hashed_password="x")
+
+
+async def reserve_all(user, sizes):
+    async def reserve(size):
+        try:
+            await server.reserve_usage(user, size)
+            return True
+        except HTTPException as e:
+            assert e.status_code == 413
+            return False
+
+    return await asyncio.gather(*(reserve(size) for size in sizes))
+
+
+def test_concurrent_reservations_never_overshoot_the_byte_quota(db, quota):
+    async def scenario():
+        admitted = await reserve_all(quota, [300] * 10)
+        return admitted, await db.usage.find_one({"_id": quota.id})
+
+    admitted, usage = asyncio.run(scenario())
+    assert admitted.count(True) == 3
+    assert usage == {"_id": quota.id, "bytes": 900, "objects": 3}
+
+
+def test_concurrent_reservations_never_overshoot_the_document_quota(db, quota):
+    async def scenario():
+        admitted = await reserve_all(quota, [1] * 20)
+        return admitted, await db.usage.find_one({"_id": quota.id})
+
+    admitted, usage = asyncio.run(scenario())
+    assert admitted.count(True) == 5
+    assert usage["objects"] == 5
+
+
+def test_a_single_document_over_the_quota_is_refused(db, quota):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.reserve_usage(quota, 1001))
+    assert error.value.status_code == 413
+
+
+def test_recorded_deletions_free_the_quota(db, quota):
+    async def scenario():
+        await reserve_all(quota, [500, 500])
+        refused = await reserve_all(quota, [1])
+        await server.record_usage(quota.id, -500, -1)
+        return refused, await reserve_all(quota, [500]), await db.usage.find_one({"_id": quota.id})
+
+    refused, admitted, usage = asyncio.run(scenario())
+    assert refused == [False]
+    assert admitted == [True]
+    assert usage["bytes"] == 1000 and usage["objects"] == 2
+
+
+def test_unlimited_roles_are_still_counted(db, monkeypatch, quota):
+    monkeypatch.setattr(server, "DEFAULT_STORAGE_QUOTA_BYTES", 0)
+    monkeypatch.setattr(server, "DEFAULT_DOCUMENT_QUOTA", 0)
+
+    async def scenario():
+        admitted = await reserve_all(quota, [10**9] * 3)
+        return admitted, await db.usage.find_one({"_id": quota.id})
+
+    admitted, usage = asyncio.run(scenario())
+    assert admitted == [True] * 3
+    assert usage["bytes"] == 3 * 10**9 and usage["objects"] == 3
+
+
+def test_recording_without_a_counter_creates_none(db):
+    async def scenario():
+        await server.record_usage("nobody", -10, -1)
+        return await db.usage.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_default_roles_seeded_before_quotas_get_them(db):
+    citizen = next(role for role in server.DEFAULT_ROLES if role["name"] == "citizen")
+
+    async def scenario():
+        legacy = [{key: value for key, value in role.items() if key not in server.ROLE_QUOTA_FIELDS} for role in server.DEFAULT_ROLES]
+        # An operator chose the role default on purpose
+        legacy[0]["document_quota"] = None
+        await db.roles.insert_many([{**role, "id": role["name"]} for role in legacy])
+        await server.init_default_roles()
+        await server.init_default_roles()
+        return {role["name"]: role async for role in db.roles.find({}, {"_id": 0})}
+
+    roles = asyncio.run(scenario())
+    assert roles["citizen"]["storage_quota_bytes"] == citizen["storage_quota_bytes"]
+    assert roles["citizen"]["document_quota"] == citizen["document_quota"]
+    assert "storage_quota_bytes" not in roles["bank_employee"]
+    assert roles[server.DEFAULT_ROLES[0]["name"]]["document_quota"] is None
+    assert len(roles) == len(server.DEFAULT_ROLES)
+
+
+def upload_file(content: bytes, size=None) -> UploadFile:
+    return UploadFile(io.BytesIO(content), size=size, filename="scan.pdf", headers=Headers({"content-type": "application/pdf"}))
+
+
+def test_undeclared_upload_size_is_settled_to_the_bytes_stored(seeded, file_store):
+    async def scenario():
+        async with api_client() as http:
+            await register(http)
+        user = server.User(**await server.db.users.find_one({"username": CITIZEN["username"]}))
+        await server.upload_document(BackgroundTasks(), upload_file(b"x" * 1234), "other", None, user)
+        return await server.db.usage.find_one({"_id": user.id})
+
+    usage = asyncio.run(scenario())
+    assert usage["bytes"] == 1234
+    assert usage["objects"] == 1
+
+
+def test_failed_upload_gives_back_its_reservation(seeded, file_store, monkeypatch):
+    async def unavailable(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(file_store, "put_file", unavailable)
+
+    async def scenario():
+        async with api_client() as http:
+            await register(http)
+        user = server.User(**await server.db.users.find_one({"username": CITIZEN["username"]}))
+        with pytest.raises(OSError):
+            await server.upload_document(BackgroundTasks(), upload_file(b"x" * 1234), "other", None, user)
+        return await server.db.usage.find_one({"_id": user.id})
+
+    usage = asyncio.run(scenario())
+    assert usage["bytes"] == 0
+    assert usage["objects"] == 0
+
+
+def test_upload_near_the_quota_is_charged_its_real_size(seeded, file_store):
+    async def scenario():
+        async with api_client() as http:
+            headers = bearer(await register(http))
+            user_id = (await http.get("/api/auth/me", headers=headers)).json()["id"]
+            citizen = server.role_registry.get_by_name("citizen")
+            # 10 bytes left under the quota
+            await server.db.usage.insert_one({"_id": user_id, "bytes": citizen.storage_quota_bytes - 10, "objects": 0})
+            fits = await http.post("/api/documents/upload", files={"file": ("a.pdf", b"x" * 10)}, data={"document_type": "other"}, headers=headers)
+            over = await http.post("/api/documents/upload", files={"file": ("b.pdf", b"y")}, data={"document_type": "other"}, headers=headers)
+            return fits, over, await server.db.usage.find_one({"_id": user_id}), citizen
+
+    fits, over, usage, citizen = asyncio.run(scenario())
+    assert fits.status_code == 200
+    assert over.status_code == 413
+    assert usage["bytes"] == citizen.storage_quota_bytes
+    assert usage["objects"] == 1
@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+
+
+class Outage:
+    """Stands in for server.db, failing the first `failures` bulk writes like a lost primary"""
+
+    def __init__(self, db, failures: int = 0):
+        self.db = db
+        self.failures = failures
+        self.writes = []
+
+    def __getattr__(self, name):
+        return OutageCollection(self, getattr(self.db, name))
+
+
+class OutageCollection:
+    def __init__(self, outage: Outage, collection):
+        self.outage = outage
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def _write(self, method: str, documents: list, **kwargs):
+        if self.outage.failures:
+            self.outage.failures -= 1
+            raise AutoReconnect("primary stepped down")
+        self.outage.writes.append((self.collection.name, len(documents)))
+        return await getattr(self.collection, method)(documents, **kwargs)
+
+    async def bulk_write(self, operations, **kwargs):
+        return await self._write("bulk_write", operations, **kwargs)
+
+    async def insert_many(self, documents, **kwargs):
+        return await self._write("insert_many", documents, **kwargs)
+
+
+@pytest.fixture
+def outage(db, monkeypatch):
+    outage = Outage(db)
+    monkeypatch.setattr(server, "db", outage)
+    return outage
+
+
+def buffer(max_pending: int = 100) -> server.WriteBehindBuffer:
+    # Long interval: only explicit flushes and stop() write
+    return server.WriteBehindBuffer(batch_size=50, interval=3600, max_pending=max_pending)
+
+
+async def add_user(db, user_id: str = "u1"):
+    await db.users.insert_one({"id": user_id, "email": f"{user_id}@impnet.ru"})
+
+
+def test_updates_to_one_user_are_merged(db, outage):
+    first, second = datetime(2025, 1, 1), datetime(2025, 1, 2)
+
+    async def scenario():
+        await add_user(db)
+        write_behind = buffer()
+        write_behind.start()
+        await write_behind.update_user("u1", "u1@impnet.ru", {"last_login": first, "hashed_password": "new"})
+        await write_behind.update_user("u1", "u1@impnet.ru", {"last_login": second})
+        pending = write_behind.pending()
+        await write_behind.stop()
+        return pending, await db.users.find_one({"id": "u1"}, {"_id": 0})
+
+    pending, stored = asyncio.run(scenario())
+    assert pending == 1
+    assert outage.writes == [("users", 1)]
+    assert stored["last_login"] == second
+    assert stored["hashed_password"] == "new"
+
+
+def test_failed_flush_keeps_updates_for_the_next_one(db, outage):
+    async def scenario():
+        await add_user(db)
+        write_behind = buffer()
+        write_behind.start()
+        await write_behind.update_user("u1", "u1@impnet.ru", {"last_login": datetime(2025, 1, 1), "hashed_password": "new"})
+        await write_behind.add_status_check({"id": "s1", "client_name": "probe"})
+        outage.failures = 2
+        await write_behind.flush()
+        kept = write_behind.pending()
+        # Queued during the outage, so it wins over the retried value
+        await write_behind.update_user("u1", "u1@impnet.ru", {"last_login": datetime(2025, 1, 2)})
+        await write_behind.flush()
+        left = write_behind.pending()
+        await write_behind.stop()
+        return kept, left, await db.users.find_one({"id": "u1"}, {"_id": 0}), await db.status_checks.count_documents({})
+
+    kept, left, stored, status_checks = asyncio.run(scenario())
+    assert kept == 2
+    assert left == 0
+    assert stored["last_login"] == datetime(2025, 1, 2)
+    assert stored["hashed_password"] == "new"
+    assert status_checks == 1
+
+
+def test_stop_drains_the_buffer(db, outage):
+    async def scenario():
+        await add_user(db)
+        write_behind = buffer()
+        write_behind.start()
+        await write_behind.update_user("u1", "u1@impnet.ru", {"last_login": datetime(2025, 1, 1)})
+        for index in range(3):
+            await write_behind.add_status_check({"id": f"s{index}", "client_name": "probe"})
+        before = len(outage.writes)
+        await write_behind.stop()
+        return before, write_behind.pending(), await db.users.find_one({"id": "u1"}), await db.status_checks.count_documents({})
+
+    before, pending, stored, status_checks = asyncio.run(scenario())
+    assert before == 0
+    assert pending == 0
+    assert stored["last_login"] == datetime(2025, 1, 1)
+    assert status_checks == 3
+
+
+def test_full_buffer_flushes_before_taking_more(db, outage):
+    async def scenario():
+        write_behind = buffer(max_pending=2)
+        write_behind.start()
+        for index in range(3):
+            await write_behind.add_status_check({"id": f"s{index}", "client_name": "probe"})
+        pending = write_behind.pending()
+        await write_behind.stop()
+        return pending
+
+    assert asyncio.run(scenario()) == 1
+    assert outage.writes == [("status_checks", 2), ("status_checks", 1)]
+
+
+def test_writes_through_when_not_started(db, outage):
+    async def scenario():
+        await add_user(db)
+        await buffer().update_user("u1", "u1@impnet.ru", {"last_login": datetime(2025, 1, 1)})
+        return await db.users.find_one({"id": "u1"})
+
+    assert asyncio.run(scenario())["last_login"] == datetime(2025, 1, 1)